@@ -1,62 +1,110 @@
+import asyncio
+import copy
+import hashlib
 import json
 import os
-from typing import Dict
+import random
+import time
+from typing import Dict, List, Optional, Tuple
 
-from openai import OpenAI, OpenAIError
+import httpx
+from openai import (
+    APIConnectionError,
+    APITimeoutError,
+    AsyncOpenAI,
+    InternalServerError,
+    RateLimitError,
+)
 
+import fast_extract
+from cache import extraction_cache
+from metrics import record_llm
+
+# Bump whenever a prompt below changes so memoized part results are not reused
+PROMPT_VERSION = "2"
+FAST_EXTRACT_ENABLED = os.getenv("FAST_EXTRACT_ENABLED", "1") == "1"
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "60"))
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "3"))
+OPENAI_BACKOFF = float(os.getenv("OPENAI_BACKOFF", "1"))
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "20"))
+
+RETRYABLE_ERRORS = (APIConnectionError, APITimeoutError, RateLimitError, InternalServerError)
 
-def extract_fields_with_ai(testo_cv: str, testo_doc_identita: str, testo_tessera: str) -> Dict:
-    client = None
-    api_key = os.getenv("OPENAI_API_KEY")
-    if api_key:
-        client = OpenAI(api_key=api_key)
-
-    prompt = f"""
-Sei un assistente che estrae dati da tre testi. Restituisci SOLO un JSON valido senza testo aggiuntivo con i seguenti campi:
-
-Dal DOCUMENTO DI IDENTITÀ:
-- nome
-- cognome
-- numero_documento
-- ente_rilascio
-- data_nascita (YYYY-MM-DD)
-- comune_nascita
-- provincia_nascita
-- sesso
-- data_rilascio (YYYY-MM-DD)
-- data_scadenza (YYYY-MM-DD)
-- indirizzo_residenza
-
-Dalla TESSERA SANITARIA:
-- codice_fiscale
-
-Dal CV:
-- nome
-- cognome
-- indirizzo_domicilio
-- indirizzo_residenza
-- titolo_studio_piu_recente:
-    - titolo
-    - data_conseguimento (YYYY-MM-DD)
-- situazione_occupazionale
-- privacy_clause_present (boolean)
-- firma_presente (boolean)
-- data_cv (YYYY-MM-DD)
-
-Inserisci stringhe vuote o valori false se non trovi informazioni. Non inventare dati. Esempio di output:
-{"nome": "Mario", "cognome": "Rossi", ...}
-
-Testo CV:
-{testo_cv}
-
-Testo documento identità:
-{testo_doc_identita}
-
-Testo tessera sanitaria:
-{testo_tessera}
-"""
 
-    default_response = {
+class ExtractionFailed(RuntimeError):
+    # The model's answer is unusable (cut short, not a JSON object): the job's extraction stage
+    # fails and is retried (see jobs.py) rather than saving a person with empty fields
+    pass
+
+
+PARTS = {
+    "documento_identita": {
+        "label": "DOCUMENTO DI IDENTITÀ",
+        "max_output_tokens": 600,
+        "fields": {
+            "nome": "",
+            "cognome": "",
+            "numero_documento": "",
+            "ente_rilascio": "",
+            "data_nascita": " (YYYY-MM-DD)",
+            "comune_nascita": "",
+            "provincia_nascita": "",
+            "sesso": "",
+            "data_rilascio": " (YYYY-MM-DD)",
+            "data_scadenza": " (YYYY-MM-DD)",
+            "indirizzo_residenza": "",
+        },
+        "default": {
+            "nome": "",
+            "cognome": "",
+            "numero_documento": "",
+            "ente_rilascio": "",
+            "data_nascita": "",
+            "comune_nascita": "",
+            "provincia_nascita": "",
+            "sesso": "",
+            "data_rilascio": "",
+            "data_scadenza": "",
+            "indirizzo_residenza": "",
+        },
+    },
+    "tessera_sanitaria": {
+        "label": "TESSERA SANITARIA",
+        "max_output_tokens": 100,
+        "fields": {"codice_fiscale": ""},
+        "default": {"codice_fiscale": ""},
+    },
+    "cv": {
+        "label": "CV",
+        "max_output_tokens": 1000,
+        "fields": {
+            "nome": "",
+            "cognome": "",
+            "indirizzo_domicilio": "",
+            "indirizzo_residenza": "",
+            "titolo_studio_piu_recente": ":\n    - titolo\n    - data_conseguimento (YYYY-MM-DD)",
+            "situazione_occupazionale": "",
+            "privacy_clause_present": " (boolean)",
+            "firma_presente": " (boolean)",
+            "data_cv": " (YYYY-MM-DD)",
+        },
+        "default": {
+            "nome": "",
+            "cognome": "",
+            "indirizzo_domicilio": "",
+            "indirizzo_residenza": "",
+            "titolo_studio_piu_recente": {"titolo": "", "data_conseguimento": ""},
+            "situazione_occupazionale": "",
+            "privacy_clause_present": False,
+            "firma_presente": False,
+            "data_cv": "",
+        },
+    },
+}
+
+
+def default_response() -> Dict:
+    return {
         "nome": "",
         "cognome": "",
         "numero_documento": "",
@@ -77,22 +125,181 @@ Testo tessera sanitaria:
         "data_cv": "",
     }
 
-    if not client:
-        return default_response
 
-    try:
-        completion = client.responses.create(
-            model=os.getenv("OPENAI_MODEL", "gpt-4o-mini"),
-            input=prompt,
-            temperature=0,
-            max_output_tokens=500,
-            response_format={"type": "json_object"},
+def build_prompt(part: str, testo: str, fields: Optional[List[str]] = None) -> str:
+    spec = PARTS[part]
+    fields = fields or list(spec["fields"])
+    field_list = "\n".join(f"- {field}{spec['fields'][field]}" for field in fields)
+    return f"""
+Sei un assistente che estrae dati da un {spec['label']}. Restituisci SOLO un JSON valido senza testo aggiuntivo con i seguenti campi:
+
+{field_list}
+
+Inserisci stringhe vuote o valori false se non trovi informazioni. Non inventare dati.
+
+Testo {spec['label'].lower()}:
+{testo}
+"""
+
+
+_client: Optional[AsyncOpenAI] = None
+_client_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def get_client() -> Optional[AsyncOpenAI]:
+    # One pooled client per event loop: httpx connections cannot be shared across loops. Whoever
+    # ends the loop closes it (close_client): the job runner on shutdown, extract_fields_with_ai
+    # after each call
+    global _client, _client_loop
+    api_key = os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        return None
+    loop = asyncio.get_running_loop()
+    if _client is None or _client_loop is not loop:
+        _client = AsyncOpenAI(
+            api_key=api_key,
+            base_url=os.getenv("OPENAI_BASE_URL") or None,
+            timeout=OPENAI_TIMEOUT,
+            max_retries=0,
+            http_client=httpx.AsyncClient(
+                timeout=OPENAI_TIMEOUT,
+                limits=httpx.Limits(
+                    max_connections=OPENAI_MAX_CONNECTIONS, max_keepalive_connections=OPENAI_MAX_CONNECTIONS
+                ),
+            ),
+        )
+        _client_loop = loop
+    return _client
+
+
+async def close_client() -> None:
+    global _client, _client_loop
+    client, _client, _client_loop = _client, None, None
+    if client is not None:
+        await client.close()
+
+
+def memo_key(part: str, testo: str, model: str, fields: List[str]) -> str:
+    payload = f"{PROMPT_VERSION}:{model}:{part}:{','.join(fields)}:{testo}"
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+async def _request(client: AsyncOpenAI, model: str, part: str, testo: str, fields: List[str]) -> Dict:
+    start = time.perf_counter()
+    for attempt in range(OPENAI_MAX_RETRIES + 1):
+        try:
+            response = await client.responses.create(
+                model=model,
+                input=build_prompt(part, testo, fields),
+                temperature=0,
+                max_output_tokens=PARTS[part]["max_output_tokens"],
+                text={"format": {"type": "json_object"}},
+            )
+        except RETRYABLE_ERRORS:
+            if attempt == OPENAI_MAX_RETRIES:
+                record_llm(part, time.perf_counter() - start, 0, 0, attempt)
+                raise
+            await asyncio.sleep(OPENAI_BACKOFF * (2 ** attempt) * (0.5 + random.random()))
+            continue
+        usage = response.usage
+        record_llm(
+            part,
+            time.perf_counter() - start,
+            usage.input_tokens if usage else 0,
+            usage.output_tokens if usage else 0,
+            attempt,
         )
-        content = completion.output[0].content[0].text
-        data = json.loads(content)
-        # Ensure nested object exists
-        if "titolo_studio_piu_recente" not in data:
-            data["titolo_studio_piu_recente"] = {"titolo": "", "data_conseguimento": ""}
-        return {**default_response, **data}
-    except (OpenAIError, json.JSONDecodeError, KeyError):
-        return default_response
\ No newline at end of file
+        if response.status == "incomplete":
+            reason = response.incomplete_details.reason if response.incomplete_details else "sconosciuto"
+            raise ExtractionFailed(f"{part}: risposta del modello incompleta ({reason})")
+        try:
+            data = json.loads(response.output_text)
+        except json.JSONDecodeError as exc:
+            raise ExtractionFailed(f"{part}: la risposta del modello non è un JSON valido") from exc
+        if not isinstance(data, dict):
+            raise ExtractionFailed(f"{part}: la risposta del modello non è un oggetto JSON")
+        return data
+
+
+def fast_path(part: str, testo: str) -> Dict[str, Tuple[str, float]]:
+    if not FAST_EXTRACT_ENABLED:
+        return {}
+    return fast_extract.extract(part, testo)
+
+
+async def extract_part(part: str, testo: str) -> Tuple[Dict, Dict[str, float]]:
+    default = PARTS[part]["default"]
+    rules = fast_path(part, testo)
+    known = fast_extract.confident(rules, default)
+    confidence = {field: rules[field][1] for field in known}
+    missing = [field for field in default if field not in known]
+
+    result = {**copy.deepcopy(default), **known}
+    client = get_client()
+    if not missing or not client or not testo.strip():
+        return result, confidence
+
+    model = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
+    key = memo_key(part, testo, model, missing)
+    cached = await asyncio.to_thread(extraction_cache.get, key)
+    if cached is not None:
+        return {**result, **json.loads(cached)}, confidence
+
+    # Errors propagate once the retries of _request are spent: the stage fails and is retried
+    data = await _request(client, model, part, testo, missing)
+    extracted = {field: data.get(field, default[field]) for field in missing}
+    if not isinstance(extracted.get("titolo_studio_piu_recente", {}), dict):
+        extracted["titolo_studio_piu_recente"] = copy.deepcopy(default["titolo_studio_piu_recente"])
+    await asyncio.to_thread(extraction_cache.set, key, json.dumps(extracted))
+    return {**result, **extracted}, confidence
+
+
+def merge_parts(doc: Dict, tessera: Dict, cv: Dict) -> Dict:
+    merged = default_response()
+    merged.update(cv)
+    merged.update(tessera)
+    # The identity document is authoritative for the fields it shares with the CV,
+    # the CV only fills what the document leaves empty
+    for key, value in doc.items():
+        if value or not merged.get(key):
+            merged[key] = value
+    # Birth date, sex and birthplace (with fast_extract.COMUNI_CATASTALI_PATH) are encoded in a
+    # valid codice fiscale
+    if fast_extract.is_valid_codice_fiscale(merged["codice_fiscale"]):
+        decoded = fast_extract.decode_codice_fiscale(merged["codice_fiscale"].strip().upper())
+        for field in ("data_nascita", "sesso", "comune_nascita", "provincia_nascita"):
+            merged[field] = merged[field] or decoded[field]
+    return merged
+
+
+async def extract_fields_with_ai_async(
+    testo_cv: str, testo_doc_identita: str, testo_tessera: str, identity: Optional[Dict] = None
+) -> Dict:
+    if identity is not None:
+        # Identity fields already known for a returning candidate (see candidates.py): the
+        # documento_identita and tessera_sanitaria parts are not extracted again
+        cv, cv_conf = await extract_part("cv", testo_cv)
+        doc = {field: identity.get(field, value) for field, value in PARTS["documento_identita"]["default"].items()}
+        merged = merge_parts(doc, {"codice_fiscale": identity["codice_fiscale"]}, cv)
+        merged["field_confidence"] = cv_conf
+        return merged
+    (doc, doc_conf), (tessera, tessera_conf), (cv, cv_conf) = await asyncio.gather(
+        extract_part("documento_identita", testo_doc_identita),
+        extract_part("tessera_sanitaria", testo_tessera),
+        extract_part("cv", testo_cv),
+    )
+    merged = merge_parts(doc, tessera, cv)
+    # Confidence of the fields filled by the rule-based stage; anything else came from the model
+    merged["field_confidence"] = {**cv_conf, **tessera_conf, **doc_conf}
+    return merged
+
+
+def extract_fields_with_ai(testo_cv: str, testo_doc_identita: str, testo_tessera: str) -> Dict:
+    async def run() -> Dict:
+        # asyncio.run makes a loop per call: its client goes with it
+        try:
+            return await extract_fields_with_ai_async(testo_cv, testo_doc_identita, testo_tessera)
+        finally:
+            await close_client()
+
+    return asyncio.run(run())
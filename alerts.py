@@ -0,0 +1,270 @@
+import os
+import sys
+from datetime import date, timedelta
+from typing import Callable, Iterable, List, NamedTuple, Optional, Tuple
+
+from sqlalchemy import and_, delete, event, func, insert, literal, or_, select, update
+from sqlalchemy.orm import Session, attributes
+from sqlalchemy.sql import ColumnElement
+
+import fast_extract
+import versions
+from database import SessionLocal, write_queue
+from models import AlertState, Person, PersonAlert
+
+# Validation alerts, stored as PersonAlert rows. Every rule is written twice, side by side: on
+# the extracted data (build_alerts, for a job's result) and as a SQL condition on the persons
+# table, which the recompute evaluates for a batch of persons with one INSERT ... SELECT per
+# rule. Only the persons whose alerts are stale are evaluated: data changed since (an update
+# resets alerts_version), computed with another rule set, or with a date-based rule that has
+# turned on since the last day evaluated. Any change to RULES needs a new RULES_VERSION.
+#   python alerts.py recompute
+
+RULES_VERSION = 1
+# A CV dated more than this many days ago is flagged
+CV_MAX_AGE_DAYS = int(os.getenv("CV_MAX_AGE_DAYS", "365"))
+# The settings belong to the rule set: changing one recomputes everyone
+RULE_SET = f"{RULES_VERSION}.cv{CV_MAX_AGE_DAYS}"
+ALERTS_BATCH_SIZE = int(os.getenv("ALERTS_BATCH_SIZE", "1000"))
+# Seconds between background recomputes, which also pick up the documents expired meanwhile
+ALERTS_REFRESH_INTERVAL = float(os.getenv("ALERTS_REFRESH_INTERVAL", "3600"))
+
+# The Person columns the rules read: changing any of them makes the alerts stale
+DATA_COLUMNS = [
+    "project_id",
+    "nome",
+    "cognome",
+    "codice_fiscale",
+    "indirizzo_domicilio",
+    "indirizzo_residenza",
+    "privacy_ok",
+    "titolo_studio_piu_recente",
+    "data_conseguimento_titolo",
+    "situazione_occupazionale",
+    "cv_firmato",
+    "data_cv",
+    "data_scadenza",
+]
+
+
+class Rule(NamedTuple):
+    code: str
+    message: str
+    # On the extracted data, for the given day
+    check: Callable[[dict, date], bool]
+    # The same on the persons table
+    condition: Callable[[date], ColumnElement]
+    # (date column, days): the rule turns on by itself once the date is that many days past
+    ages: Optional[Tuple[ColumnElement, int]] = None
+
+
+def _empty(column) -> ColumnElement:
+    return func.coalesce(column, "") == ""
+
+
+def _titolo(data: dict) -> dict:
+    return data.get("titolo_studio_piu_recente") or {}
+
+
+def _missing(code: str, message: str, column, value: Callable[[dict], object]) -> Rule:
+    return Rule(code, message, lambda data, today: not value(data), lambda today: _empty(column))
+
+
+def _unchecked(code: str, message: str, column, key: str) -> Rule:
+    return Rule(code, message, lambda data, today: not data.get(key), lambda today: column.is_not(True))
+
+
+def _iso_before(value: Optional[str], day: date) -> bool:
+    # Mirrors _column_before: shaped like an ISO date and earlier, as strings
+    value = value or ""
+    return len(value) == 10 and value[4] == value[7] == "-" and value < day.isoformat()
+
+
+def _column_before(column, day: date) -> ColumnElement:
+    return and_(column.like("____-__-__"), column < day.isoformat())
+
+
+def _older_than(code: str, message: str, column, key: str, days: int) -> Rule:
+    return Rule(
+        code,
+        message,
+        lambda data, today: _iso_before(data.get(key), today - timedelta(days=days)),
+        lambda today: _column_before(column, today - timedelta(days=days)),
+        (column, days),
+    )
+
+
+def _cf_mismatch(data: dict, today: date) -> bool:
+    letters = fast_extract.cf_name_letters(data.get("nome"), data.get("cognome"))
+    codice_fiscale = (data.get("codice_fiscale") or "").upper()
+    return bool(letters) and len(codice_fiscale) == 16 and codice_fiscale[:6] != letters
+
+
+def _cf_mismatch_condition(today: date) -> ColumnElement:
+    # cf_nome_cognome is filled on every write, see _track_changes
+    return and_(
+        Person.cf_nome_cognome != "",
+        func.length(Person.codice_fiscale) == 16,
+        func.upper(func.substr(Person.codice_fiscale, 1, 6)) != Person.cf_nome_cognome,
+    )
+
+
+RULES: List[Rule] = [
+    _missing(
+        "domicilio", "Manca l'indirizzo di domicilio nel CV", Person.indirizzo_domicilio,
+        lambda data: data.get("indirizzo_domicilio"),
+    ),
+    _missing(
+        "residenza", "Manca l'indirizzo di residenza nel CV", Person.indirizzo_residenza,
+        lambda data: data.get("indirizzo_residenza"),
+    ),
+    _unchecked(
+        "privacy", "Manca la clausola di trattamento dei dati personali nel CV", Person.privacy_ok,
+        "privacy_clause_present",
+    ),
+    _missing("nome", "Manca il nome nel CV", Person.nome, lambda data: data.get("nome")),
+    _missing("cognome", "Manca il cognome nel CV", Person.cognome, lambda data: data.get("cognome")),
+    _missing(
+        "titolo", "Manca il titolo di studio più recente nel CV", Person.titolo_studio_piu_recente,
+        lambda data: _titolo(data).get("titolo"),
+    ),
+    _missing(
+        "data_titolo", "Manca la data di conseguimento del titolo nel CV", Person.data_conseguimento_titolo,
+        lambda data: _titolo(data).get("data_conseguimento"),
+    ),
+    _missing(
+        "situazione_occupazionale", "Manca la situazione occupazionale nel CV", Person.situazione_occupazionale,
+        lambda data: data.get("situazione_occupazionale"),
+    ),
+    _unchecked("firma", "Il CV non risulta firmato", Person.cv_firmato, "firma_presente"),
+    _missing("data_cv", "Il CV non risulta datato", Person.data_cv, lambda data: data.get("data_cv")),
+    _older_than("documento_scaduto", "Il documento di identità è scaduto", Person.data_scadenza, "data_scadenza", 0),
+    Rule(
+        "codice_fiscale_nominativo", "Il codice fiscale non corrisponde a nome e cognome",
+        _cf_mismatch, _cf_mismatch_condition,
+    ),
+    _older_than(
+        "cv_non_recente", f"Il CV risale a più di {CV_MAX_AGE_DAYS} giorni fa", Person.data_cv, "data_cv",
+        CV_MAX_AGE_DAYS,
+    ),
+]
+RULE_MESSAGES = {rule.code: rule.message for rule in RULES}
+
+
+def build_alerts(data: dict, today: Optional[date] = None) -> List[str]:
+    today = today or date.today()
+    return [rule.message for rule in RULES if rule.check(data, today)]
+
+
+@event.listens_for(Person, "before_insert")
+@event.listens_for(Person, "before_update")
+def _track_changes(mapper, connection, person: Person) -> None:
+    # Not called by bulk UPDATE statements: those reset alerts_version themselves
+    person.cf_nome_cognome = fast_extract.cf_name_letters(person.nome, person.cognome)
+    if any(attributes.get_history(person, column).has_changes() for column in DATA_COLUMNS):
+        person.alerts_version = None
+
+
+def _stale() -> ColumnElement:
+    return or_(Person.alerts_version.is_(None), Person.alerts_version != RULE_SET)
+
+
+def _evaluate(db: Session, scope: ColumnElement, today: date) -> None:
+    # Replaces the alerts of the persons matching scope, one statement per rule
+    options = {"synchronize_session": False}
+    persons = select(Person.id).where(scope)
+    db.execute(delete(PersonAlert).where(PersonAlert.person_id.in_(persons)).execution_options(**options))
+    for rule in RULES:
+        db.execute(
+            insert(PersonAlert).from_select(
+                ["person_id", "project_id", "rule", "message"],
+                select(Person.id, Person.project_id, literal(rule.code), literal(rule.message)).where(
+                    scope, rule.condition(today)
+                ),
+            )
+        )
+    # Bulk statements: the listener of versions.py does not see them
+    versions.bump(db.connection(), select(Person.project_id).where(scope).distinct())
+    db.execute(update(Person).where(scope).values(alerts_version=RULE_SET).execution_options(**options))
+
+
+def evaluate_persons(db: Session, person_ids: Iterable[int], today: Optional[date] = None) -> None:
+    # For the persons just written, inside the caller's transaction
+    person_ids = list(person_ids)
+    if person_ids:
+        _evaluate(db, Person.id.in_(person_ids), today or date.today())
+
+
+def _mark_aged(db: Session, today: date) -> None:
+    # Persons a date-based rule turned on for since the last day evaluated, all of them the
+    # first time
+    state = db.get(AlertState, 1)
+    since = date.fromisoformat(state.evaluated_on) if state else None
+    if since is not None and since >= today:
+        return
+    crossed = []
+    for rule in RULES:
+        if rule.ages is None:
+            continue
+        column, days = rule.ages
+        condition = _column_before(column, today - timedelta(days=days))
+        if since is not None:
+            condition = and_(condition, column >= (since - timedelta(days=days)).isoformat())
+        crossed.append(condition)
+    # The person pages show the alerts as being recomputed
+    versions.bump(db.connection(), select(Person.project_id).where(or_(*crossed)).distinct())
+    db.execute(
+        update(Person).where(or_(*crossed)).values(alerts_version=None).execution_options(synchronize_session=False)
+    )
+    if state is None:
+        db.add(AlertState(id=1, evaluated_on=today.isoformat()))
+    else:
+        state.evaluated_on = today.isoformat()
+    db.commit()
+
+
+def _evaluate_stale(db: Session, today: date, last_id: int, batch_size: int) -> List[int]:
+    # The next batch_size stale persons after last_id, in one transaction; their ids
+    ids = db.scalars(
+        select(Person.id).where(_stale(), Person.id > last_id).order_by(Person.id).limit(batch_size)
+    ).all()
+    if ids:
+        _evaluate(db, and_(_stale(), Person.id.between(ids[0], ids[-1])), today)
+        db.commit()
+    return list(ids)
+
+
+def recompute(today: Optional[date] = None, batch_size: int = ALERTS_BATCH_SIZE) -> int:
+    # Evaluates the stale persons, batch_size per transaction; returns how many. For the CLI:
+    # the server runs recompute_queued
+    today = today or date.today()
+    evaluated = last_id = 0
+    with SessionLocal() as db:
+        _mark_aged(db, today)
+        while ids := _evaluate_stale(db, today, last_id, batch_size):
+            evaluated += len(ids)
+            last_id = ids[-1]
+    return evaluated
+
+
+async def recompute_queued(today: Optional[date] = None, batch_size: int = ALERTS_BATCH_SIZE) -> int:
+    # The same, each transaction a write of database.write_queue: the job and handler writes
+    # take turns with the batches instead of waiting for the whole recompute
+    today = today or date.today()
+    evaluated = last_id = 0
+    await write_queue.run(_mark_aged, today)
+    while ids := await write_queue.run(_evaluate_stale, today, last_id, batch_size):
+        evaluated += len(ids)
+        last_id = ids[-1]
+    return evaluated
+
+
+def main(argv: List[str]) -> None:
+    if argv[:1] != ["recompute"]:
+        print("usage: python alerts.py recompute")
+        sys.exit(2)
+    print(f"{recompute()} persons evaluated (rule set {RULE_SET})")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
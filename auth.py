@@ -1,32 +1,167 @@
+import asyncio
 import os
-from fastapi import Request, Form, Depends
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Deque, Dict, Optional, Tuple
+
+from fastapi import Request
 from fastapi.responses import RedirectResponse
 from fastapi import status
 from passlib.context import CryptContext
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
-from database import get_db
+from database import SessionLocal, write_queue
 from models import User
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Hashes made with a different cost are replaced on the next successful login
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
 
 DEFAULT_USERNAME = os.getenv("ADMIN_USERNAME", "admin")
 DEFAULT_PASSWORD = os.getenv("ADMIN_PASSWORD", "admin")
 
+# bcrypt is slow on purpose: it runs on these threads, never on the event loop, and at most
+# AUTH_WORKERS checks at a time take CPU away from the rest of the application
+AUTH_WORKERS = int(os.getenv("AUTH_WORKERS", "2"))
+# Failed logins allowed per username and per client address within LOGIN_WINDOW seconds;
+# past that, attempts are refused without running bcrypt at all
+LOGIN_MAX_FAILURES = int(os.getenv("LOGIN_MAX_FAILURES", "5"))
+LOGIN_MAX_FAILURES_IP = int(os.getenv("LOGIN_MAX_FAILURES_IP", "20"))
+LOGIN_WINDOW = float(os.getenv("LOGIN_WINDOW", "900"))
+
+_executor = ThreadPoolExecutor(max_workers=AUTH_WORKERS, thread_name_prefix="auth")
+
+
+class LoginThrottled(Exception):
+    def __init__(self, retry_after: float):
+        super().__init__(f"retry after {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+class MemoryThrottleStore:
+    # Failure timestamps per key, in this process. A shared backend (the database, Redis) only
+    # needs the same three methods; pass it to LoginThrottle.
+    SWEEP_EVERY = 1000
+
+    def __init__(self):
+        self._failures: Dict[str, Deque[float]] = {}
+        self._lock = threading.Lock()
+        self._adds = 0
+
+    def failures(self, key: str, since: float) -> Tuple[int, Optional[float]]:
+        # (failures after `since`, time of the oldest of them)
+        with self._lock:
+            times = self._failures.get(key)
+            if not times:
+                return 0, None
+            while times and times[0] <= since:
+                times.popleft()
+            if not times:
+                del self._failures[key]
+                return 0, None
+            return len(times), times[0]
+
+    def add_failure(self, key: str, now: float, since: float) -> None:
+        with self._lock:
+            self._failures.setdefault(key, deque()).append(now)
+            self._adds += 1
+            if self._adds % self.SWEEP_EVERY == 0:
+                # Keys that stopped failing would otherwise stay in memory forever
+                for stale in [key for key, times in self._failures.items() if times[-1] <= since]:
+                    del self._failures[stale]
+
+    def clear(self, key: str) -> None:
+        with self._lock:
+            self._failures.pop(key, None)
+
+
+class LoginThrottle:
+    def __init__(
+        self,
+        store=None,
+        max_failures: int = LOGIN_MAX_FAILURES,
+        max_failures_ip: int = LOGIN_MAX_FAILURES_IP,
+        window: float = LOGIN_WINDOW,
+    ):
+        self.store = store or MemoryThrottleStore()
+        self.window = window
+        self.max_failures = max_failures
+        self.max_failures_ip = max_failures_ip
+
+    def _limits(self, username: str, address: str):
+        return ((f"user:{username.casefold()}", self.max_failures), (f"ip:{address}", self.max_failures_ip))
+
+    def retry_after(self, username: str, address: str) -> float:
+        # Seconds until the next attempt is allowed, 0 if it is allowed now
+        now = time.time()
+        wait = 0.0
+        for key, limit in self._limits(username, address):
+            count, oldest = self.store.failures(key, now - self.window)
+            if count >= limit:
+                wait = max(wait, oldest + self.window - now)
+        return wait
+
+    def failed(self, username: str, address: str) -> None:
+        now = time.time()
+        for key, _ in self._limits(username, address):
+            self.store.add_failure(key, now, now - self.window)
 
-def create_default_user(db: Session):
-    existing = db.query(User).filter_by(username=DEFAULT_USERNAME).first()
-    if not existing:
-        user = User(username=DEFAULT_USERNAME, password_hash=pwd_context.hash(DEFAULT_PASSWORD))
-        db.add(user)
-        db.commit()
+    def succeeded(self, username: str) -> None:
+        # The address keeps its failures: one valid account must not unlock guessing on others
+        self.store.clear(f"user:{username.casefold()}")
 
 
-def verify_user(username: str, password: str, db: Session) -> bool:
-    user = db.query(User).filter_by(username=username).first()
-    if not user:
-        return False
-    return pwd_context.verify(password, user.password_hash)
+throttle = LoginThrottle()
+
+
+@lru_cache(maxsize=1)
+def _dummy_hash() -> str:
+    return pwd_context.hash("not-a-password")
+
+
+def _check_password(password: str, password_hash: Optional[str]) -> Tuple[bool, Optional[str]]:
+    if password_hash is None:
+        # Unknown usernames cost as much as wrong passwords, so timing does not reveal them
+        pwd_context.verify(password, _dummy_hash())
+        return False, None
+    return pwd_context.verify_and_update(password, password_hash)
+
+
+async def check_password(password: str, password_hash: Optional[str]) -> Tuple[bool, Optional[str]]:
+    # (valid, new hash when the stored one was made with another cost)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, _check_password, password, password_hash)
+
+
+def create_default_user():
+    # Hashes a password: called from a worker thread at startup, not at import
+    with SessionLocal() as db:
+        existing = db.query(User).filter_by(username=DEFAULT_USERNAME).first()
+        if not existing:
+            user = User(username=DEFAULT_USERNAME, password_hash=pwd_context.hash(DEFAULT_PASSWORD))
+            db.add(user)
+            db.commit()
+
+
+def _store_hash(db: Session, username: str, password_hash: str) -> None:
+    db.query(User).filter_by(username=username).update({"password_hash": password_hash})
+    db.commit()
+
+
+async def verify_user(username: str, password: str, db: AsyncSession) -> bool:
+    password_hash = await db.scalar(select(User.password_hash).where(User.username == username))
+    # The connection goes back to the pool for as long as bcrypt takes: a burst of logins
+    # waiting on the executor must not hold every pooled connection
+    await db.rollback()
+    valid, new_hash = await check_password(password, password_hash)
+    if valid and new_hash:
+        await write_queue.run(_store_hash, username, new_hash)
+    return valid
 
 
 def get_current_user(request: Request):
@@ -39,12 +174,23 @@ def require_login(request: Request):
     return None
 
 
-def login_action(request: Request, db: Session, username: str, password: str):
-    if verify_user(username, password, db):
+async def login_action(request: Request, db: AsyncSession, username: str, password: str) -> bool:
+    # Raises LoginThrottled when the username or the client address failed too often
+    address = request.client.host if request.client else "unknown"
+    wait = throttle.retry_after(username, address)
+    if wait > 0:
+        raise LoginThrottled(wait)
+    if await verify_user(username, password, db):
+        throttle.succeeded(username)
         request.session["user"] = username
         return True
+    throttle.failed(username, address)
     return False
 
 
 def logout_action(request: Request):
-    request.session.clear()
\ No newline at end of file
+    request.session.clear()
+
+
+def shutdown_executor() -> None:
+    _executor.shutdown(wait=False, cancel_futures=True)
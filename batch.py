@@ -0,0 +1,238 @@
+import asyncio
+import csv
+import io
+import os
+import zipfile
+from datetime import datetime
+from pathlib import Path, PurePosixPath
+from typing import Callable, Dict, List, Optional, Tuple
+
+from fastapi import UploadFile
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from database import write_queue
+from models import Batch, Job
+from jobs import new_job, runner
+from storage import CHUNK_SIZE, MAX_UPLOAD_BYTES, StoredFile, UploadRejected, register_blobs, store_stream
+
+BATCH_IMPORT_ROOT = os.getenv("BATCH_IMPORT_ROOT", "")
+# An uploaded archive is rejected as soon as it grows past this, while it is being written
+BATCH_MAX_ARCHIVE_BYTES = int(os.getenv("BATCH_MAX_ARCHIVE_BYTES", str(2 * 1024 * 1024 * 1024)))
+
+MANIFEST_NAME = "manifest.csv"
+MANIFEST_COLUMNS = {"cv": "cv", "doc": "documento_identita", "tess": "tessera_sanitaria"}
+KIND_ALIASES = {
+    "cv": ("curriculum", "cv"),
+    "doc": ("documento_identita", "carta_identita", "documento", "identita", "doc"),
+    "tess": ("tessera_sanitaria", "tessera", "tess", "ts"),
+}
+ALLOWED_SUFFIXES = {".pdf", ".png", ".jpg", ".jpeg", ".tif", ".tiff", ".bmp", ".gif", ".webp"}
+SEPARATORS = "_-. "
+
+Candidates = Dict[str, Dict[str, str]]
+Errors = List[Dict[str, str]]
+
+
+def classify(name: str) -> Optional[Tuple[str, str]]:
+    # Naming convention, either one folder per candidate:
+    #   rossi_mario/cv.pdf, rossi_mario/documento_identita.jpg, rossi_mario/tessera_sanitaria.pdf
+    # or a flat archive with the document type as suffix:
+    #   rossi_mario_cv.pdf, rossi_mario_doc.jpg, rossi_mario_tessera.pdf
+    path = PurePosixPath(name)
+    if path.suffix.lower() not in ALLOWED_SUFFIXES:
+        return None
+    stem = path.stem.lower()
+    folder = "" if str(path.parent) == "." else str(path.parent)
+    for kind, aliases in KIND_ALIASES.items():
+        for alias in aliases:
+            starts = stem == alias or (stem.startswith(alias) and stem[len(alias)] in SEPARATORS)
+            ends = stem.endswith(alias) and len(stem) > len(alias) and stem[-len(alias) - 1] in SEPARATORS
+            if folder and (starts or ends):
+                return folder, kind
+            if not folder and ends:
+                return stem[: -len(alias) - 1].strip(SEPARATORS), kind
+    return None
+
+
+def group_by_convention(names: List[str]) -> Tuple[Candidates, Errors]:
+    candidates: Candidates = {}
+    errors: Errors = []
+    for name in sorted(names):
+        match = classify(name)
+        if not match:
+            continue
+        candidate, kind = match
+        files = candidates.setdefault(candidate, {})
+        if kind in files:
+            errors.append({"candidate": candidate, "error": f"Più file per lo stesso documento: {files[kind]}, {name}"})
+            continue
+        files[kind] = name
+    return candidates, errors
+
+
+def group_by_manifest(manifest: str, base: str, names: List[str]) -> Tuple[Candidates, Errors]:
+    # manifest.csv columns: candidato,cv,documento_identita,tessera_sanitaria (paths relative to the manifest)
+    available = set(names)
+    candidates: Candidates = {}
+    errors: Errors = []
+    for row in csv.DictReader(io.StringIO(manifest)):
+        candidate = (row.get("candidato") or "").strip()
+        if not candidate:
+            continue
+        files = {}
+        for kind, column in MANIFEST_COLUMNS.items():
+            value = (row.get(column) or "").strip()
+            if not value:
+                continue
+            name = str(PurePosixPath(base, value)) if base else value
+            if name not in available:
+                errors.append({"candidate": candidate, "error": f"File non trovato: {value}"})
+                continue
+            files[kind] = name
+        candidates[candidate] = files
+    return candidates, errors
+
+
+def complete_candidates(candidates: Candidates, errors: Errors) -> Candidates:
+    complete: Candidates = {}
+    for candidate, files in candidates.items():
+        missing = [MANIFEST_COLUMNS[kind] for kind in MANIFEST_COLUMNS if kind not in files]
+        if missing:
+            errors.append({"candidate": candidate, "error": "Documenti mancanti: " + ", ".join(missing)})
+        else:
+            complete[candidate] = files
+    return complete
+
+
+def match_files(names: List[str], read: Callable[[str], str]) -> Tuple[Candidates, Errors]:
+    manifests = sorted((name for name in names if PurePosixPath(name).name.lower() == MANIFEST_NAME), key=len)
+    if manifests:
+        base = str(PurePosixPath(manifests[0]).parent)
+        candidates, errors = group_by_manifest(read(manifests[0]), "" if base == "." else base, names)
+    else:
+        candidates, errors = group_by_convention(names)
+    return complete_candidates(candidates, errors), errors
+
+
+Ready = List[Tuple[str, Dict[str, StoredFile]]]
+
+
+def _create_jobs(db: Session, batch_id: int, ready: Ready, errors: Errors) -> List[int]:
+    batch = db.query(Batch).filter_by(id=batch_id).first()
+    register_blobs(db, [item for _, stored in ready for item in stored.values()])
+    jobs = [new_job(batch.project_id, stored, batch_id=batch.id, candidate=candidate) for candidate, stored in ready]
+    db.add_all(jobs)
+    batch.errors = errors
+    batch.status = "running" if jobs else "done"
+    if not jobs:
+        batch.finished_at = datetime.utcnow()
+    db.commit()
+    return [job.id for job in jobs]
+
+
+# The ingest functions only store the files; process_batch creates the jobs through write_queue
+
+
+async def store_archive(file: UploadFile, path: Path, max_bytes: int = BATCH_MAX_ARCHIVE_BYTES) -> None:
+    # Counted while copying, as BlobWriter does for single files: an oversized archive is
+    # dropped before it can fill the disk
+    size = 0
+    try:
+        with path.open("wb") as buffer:
+            while chunk := await file.read(CHUNK_SIZE):
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadRejected(
+                        f"{file.filename}: supera la dimensione massima di {max_bytes // (1024 * 1024)} MB"
+                    )
+                await asyncio.to_thread(buffer.write, chunk)
+    except BaseException:
+        path.unlink(missing_ok=True)
+        raise
+
+
+def ingest_archive(archive_path: Path) -> Tuple[Ready, Errors]:
+    # Members are streamed out of the archive one at a time into the blob store
+    ready: Ready = []
+    with zipfile.ZipFile(archive_path) as archive:
+        infos = {info.filename: info for info in archive.infolist() if not info.is_dir()}
+        candidates, errors = match_files(
+            list(infos), lambda name: archive.read(infos[name]).decode("utf-8-sig")
+        )
+        for candidate, files in candidates.items():
+            try:
+                stored = {}
+                for kind, name in files.items():
+                    info = infos[name]
+                    if info.file_size > MAX_UPLOAD_BYTES:
+                        raise UploadRejected(f"{name}: supera la dimensione massima consentita")
+                    with archive.open(info) as source:
+                        stored[kind] = store_stream(source, PurePosixPath(name).name)
+                ready.append((candidate, stored))
+            except (UploadRejected, OSError, zipfile.BadZipFile) as exc:
+                errors.append({"candidate": candidate, "error": str(exc)})
+    # The members now live in the blob store
+    archive_path.unlink(missing_ok=True)
+    return ready, errors
+
+
+def resolve_import_dir(directory: str) -> Path:
+    if not BATCH_IMPORT_ROOT:
+        raise ValueError("Importazione da cartella non abilitata (BATCH_IMPORT_ROOT)")
+    root = Path(BATCH_IMPORT_ROOT).resolve()
+    path = (root / directory).resolve()
+    if not path.is_relative_to(root) or not path.is_dir():
+        raise ValueError("Cartella non valida")
+    return path
+
+
+def ingest_directory(directory: Path) -> Tuple[Ready, Errors]:
+    names = [path.relative_to(directory).as_posix() for path in directory.rglob("*") if path.is_file()]
+    candidates, errors = match_files(names, lambda name: (directory / name).read_text(encoding="utf-8-sig"))
+    ready: Ready = []
+    for candidate, files in candidates.items():
+        try:
+            stored = {}
+            for kind, name in files.items():
+                with (directory / name).open("rb") as source:
+                    stored[kind] = store_stream(source, PurePosixPath(name).name)
+            ready.append((candidate, stored))
+        except (UploadRejected, OSError) as exc:
+            errors.append({"candidate": candidate, "error": str(exc)})
+    return ready, errors
+
+
+def create_batch(db: Session, project_id: int, source: str) -> int:
+    batch = Batch(project_id=project_id, source=source, errors=[])
+    db.add(batch)
+    db.commit()
+    return batch.id
+
+
+def _fail(db: Session, batch_id: int, error: str) -> None:
+    batch = db.query(Batch).filter_by(id=batch_id).first()
+    batch.status = "failed"
+    batch.errors = (batch.errors or []) + [{"candidate": "", "error": error}]
+    batch.finished_at = datetime.utcnow()
+    db.commit()
+
+
+async def process_batch(batch_id: int, ingest: Callable[[], Tuple[Ready, Errors]]) -> None:
+    # The batch is marked done by its last job to finish (jobs.settle_batches), including a
+    # job retried later or resumed after a restart
+    try:
+        ready, errors = await asyncio.to_thread(ingest)
+    except (zipfile.BadZipFile, ValueError, OSError) as exc:
+        await write_queue.run(_fail, batch_id, str(exc))
+        return
+    job_ids = await write_queue.run(_create_jobs, batch_id, ready, errors)
+    await runner.run_batch(job_ids)
+
+
+def batch_progress(db: Session, batch_id: int) -> Dict[str, int]:
+    counts = dict(
+        db.query(Job.status, func.count(Job.id)).filter(Job.batch_id == batch_id).group_by(Job.status).all()
+    )
+    counts["total"] = sum(counts.values())
+    return counts
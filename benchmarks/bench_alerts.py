@@ -0,0 +1,158 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+from pathlib import Path
+
+# Stored alerts on a seeded SQLite database:
+#   full          recompute of every person (first run, or after a rule change), set-based
+#   python_rows   the same rules row by row in Python (build_alerts on each loaded row), as before
+#   incremental   recompute after editing --changed persons: only those are evaluated
+#   noop          recompute with nothing stale
+#   pages_ms      the project page queries on the largest project (counts, per-rule counts and
+#                 the first page of "solo incomplete")
+#   python benchmarks/bench_alerts.py [--persons 50000] [--projects 20] [--changed 500]
+
+ROOT = Path(__file__).resolve().parent.parent
+WORKDIR = Path(tempfile.mkdtemp())
+os.environ["DATABASE_URL"] = f"sqlite:///{WORKDIR / 'bench_alerts.db'}"
+sys.path.insert(0, str(ROOT))
+
+import alerts  # noqa: E402
+import fast_extract  # noqa: E402
+import migrations  # noqa: E402
+from database import AsyncSessionLocal, SessionLocal, engine  # noqa: E402
+from models import Person, PersonAlert, Project, register_listeners  # noqa: E402
+from queries import person_page, project_counts, rule_counts  # noqa: E402
+
+NOMI = ["Mario", "Anna", "Luca", "Giulia", "Marco", "Sara"]
+COGNOMI = ["Rossi", "Bianchi", "Esposito", "Romano", "Colombo"]
+
+
+def seed(projects: int, persons: int) -> None:
+    migrations.migrate()
+    register_listeners()
+    rng = random.Random(1)
+    start = datetime(2024, 1, 1)
+    with engine.begin() as connection:
+        connection.execute(
+            Project.__table__.insert(), [{"name": f"Progetto {number}"} for number in range(projects)]
+        )
+        rows = []
+        for number in range(persons):
+            nome, cognome = rng.choice(NOMI), rng.choice(COGNOMI)
+            # Mostly consistent codici fiscali, some with the letters of someone else
+            letters = fast_extract.cf_name_letters(nome if number % 9 else "Pietro", cognome)
+            day = date(2023, 1, 1) + timedelta(days=rng.randint(0, 1400))
+            rows.append(
+                {
+                    "project_id": rng.randint(1, projects) if number % 4 else 1,
+                    "nome": nome,
+                    "cognome": cognome,
+                    "codice_fiscale": f"{letters}80A01H501U",
+                    "cf_nome_cognome": fast_extract.cf_name_letters(nome, cognome),
+                    "indirizzo_domicilio": "" if number % 6 == 0 else "Via Roma 1",
+                    "indirizzo_residenza": "Via Roma 1",
+                    "titolo_studio_piu_recente": "Diploma",
+                    "data_conseguimento_titolo": "2010-07-01",
+                    "situazione_occupazionale": "Disoccupato",
+                    "privacy_ok": number % 5 != 0,
+                    "cv_firmato": True,
+                    "data_cv": day.isoformat(),
+                    "data_scadenza": (day + timedelta(days=rng.randint(0, 3650))).isoformat(),
+                    "created_at": start + timedelta(minutes=number),
+                }
+            )
+        connection.execute(Person.__table__.insert(), rows)
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, round(time.perf_counter() - start, 3)
+
+
+def python_rows() -> int:
+    # What the export and the counts used to do: every person's alerts rebuilt in Python
+    count = 0
+    with SessionLocal() as db:
+        for person in db.query(Person).yield_per(1000):
+            data = {
+                "nome": person.nome,
+                "cognome": person.cognome,
+                "codice_fiscale": person.codice_fiscale,
+                "indirizzo_domicilio": person.indirizzo_domicilio,
+                "indirizzo_residenza": person.indirizzo_residenza,
+                "privacy_clause_present": person.privacy_ok,
+                "titolo_studio_piu_recente": {
+                    "titolo": person.titolo_studio_piu_recente,
+                    "data_conseguimento": person.data_conseguimento_titolo,
+                },
+                "situazione_occupazionale": person.situazione_occupazionale,
+                "firma_presente": person.cv_firmato,
+                "data_cv": person.data_cv,
+                "data_scadenza": person.data_scadenza,
+            }
+            count += bool(alerts.build_alerts(data))
+    return count
+
+
+def edit(count: int) -> None:
+    with SessionLocal() as db:
+        for person in db.query(Person).order_by(Person.id.desc()).limit(count):
+            person.indirizzo_domicilio = "Via Garibaldi 2"
+        db.commit()
+
+
+async def pages() -> dict:
+    async with AsyncSessionLocal() as db:
+        timings = {}
+        for name, query in (
+            ("counts", lambda: project_counts(db, [1])),
+            ("rule_counts", lambda: rule_counts(db, 1)),
+            ("only_alerts_page", lambda: person_page(db, 1, only_alerts=True)),
+            ("rule_page", lambda: person_page(db, 1, rule="codice_fiscale_nominativo")),
+        ):
+            await query()
+            start = time.perf_counter()
+            await query()
+            timings[name] = round((time.perf_counter() - start) * 1000, 2)
+        return timings
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--persons", type=int, default=50000)
+    parser.add_argument("--projects", type=int, default=20)
+    parser.add_argument("--changed", type=int, default=500)
+    args = parser.parse_args()
+
+    seed(args.projects, args.persons)
+    report = {"persons": args.persons, "projects": args.projects, "rules": len(alerts.RULES)}
+    evaluated, seconds = timed(alerts.recompute)
+    report["full"] = {"evaluated": evaluated, "seconds": seconds, "persons_per_s": round(evaluated / seconds)}
+    with SessionLocal() as db:
+        report["full"]["alerts"] = db.query(PersonAlert).count()
+        with_alerts = db.query(PersonAlert.person_id).distinct().count()
+    flagged, seconds = timed(python_rows)
+    report["python_rows"] = {"flagged": flagged, "seconds": seconds, "persons_per_s": round(args.persons / seconds)}
+    # Both ways flag the same persons
+    report["same_persons_flagged"] = flagged == with_alerts
+    edit(args.changed)
+    evaluated, seconds = timed(alerts.recompute)
+    report["incremental"] = {"changed": args.changed, "evaluated": evaluated, "seconds": seconds}
+    evaluated, seconds = timed(alerts.recompute)
+    report["noop"] = {"evaluated": evaluated, "seconds": seconds}
+    report["pages_ms"] = asyncio.run(pages())
+    with SessionLocal() as db:
+        report["largest_project_persons"] = db.query(Person).filter_by(project_id=1).count()
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+# Enrolment of returning candidates. Each candidate of the synthetic corpus is enrolled in a
+# first project, then again in two more with the same identity document and health card:
+# once with candidate reuse off and once on. The OCR and extraction caches are cleared before
+# each round, as for a candidate who comes back after they expired, so only the reuse differs.
+# Reports per-stage p50 and model calls per enrolment, as JSON, using benchmarks/stub_llm.py.
+#   python benchmarks/bench_candidates.py [--candidates 6] [--llm-latency-ms 800]
+
+ROOT = Path(__file__).resolve().parent.parent
+WORKDIR = Path(tempfile.mkdtemp())
+os.environ["DATABASE_URL"] = f"sqlite:///{WORKDIR / 'bench_candidates.db'}"
+os.environ["UPLOAD_DIR"] = str(WORKDIR / "uploads")
+os.environ["CACHE_PATH"] = str(WORKDIR / "cache.db")
+os.environ.setdefault("OPENAI_API_KEY", "stub")
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / "benchmarks"))
+
+import candidates  # noqa: E402
+import corpus  # noqa: E402
+import migrations  # noqa: E402
+import ocr  # noqa: E402
+# After the repo modules, which are then already configured: bench_pipeline sets its own
+# environment when imported
+from bench_pipeline import start_stub, upload  # noqa: E402
+from cache import extraction_cache, ocr_cache  # noqa: E402
+from database import SessionLocal  # noqa: E402
+from jobs import JobRunner  # noqa: E402
+from models import Candidate, Job, Person, Project, register_listeners  # noqa: E402
+from storage import UPLOAD_DIR  # noqa: E402
+
+
+async def enrol(project_id: int, people: list) -> list:
+    runner = JobRunner()
+    job_ids = []
+    for files, _ in people:
+        start = time.perf_counter()
+        job_id, _ = await asyncio.to_thread(upload, project_id, files)
+        await runner.run(job_id)
+        job_ids.append((job_id, time.perf_counter() - start))
+    return job_ids
+
+
+def summarise(project_id: int, job_ids: list) -> dict:
+    with SessionLocal() as db:
+        jobs = [db.get(Job, job_id) for job_id, _ in job_ids]
+        failed = [job.error for job in jobs if job.status != "done"]
+        timings = [job.timings or {} for job in jobs]
+    return {
+        "ocr_p50_ms": round(statistics.median(timing.get("ocr", 0) for timing in timings) * 1000, 1),
+        "extraction_p50_ms": round(statistics.median(timing.get("extraction", 0) for timing in timings) * 1000, 1),
+        "enrolment_p50_ms": round(statistics.median(seconds for _, seconds in job_ids) * 1000, 1),
+        "llm_calls_per_enrolment": round(
+            statistics.mean(timing.get("llm", {}).get("calls", 0) for timing in timings), 2
+        ),
+        "failed": failed,
+    }
+
+
+def identities(project_id: int) -> dict:
+    with SessionLocal() as db:
+        return {
+            person.codice_fiscale: tuple(getattr(person, field) for field in candidates.IDENTITY_FIELDS)
+            for person in db.query(Person).filter_by(project_id=project_id)
+        }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--candidates", type=int, default=6)
+    parser.add_argument("--llm-latency-ms", type=float, default=800)
+    args = parser.parse_args()
+
+    migrations.migrate()
+    register_listeners()
+    UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
+    rounds = ["first", "returning_without_reuse", "returning"]
+    with SessionLocal() as db:
+        projects = [Project(name=f"Benchmark {name}") for name in rounds]
+        db.add_all(projects)
+        db.commit()
+        project_ids = [project.id for project in projects]
+
+    stub = start_stub(args.llm_latency_ms)
+    try:
+        people = corpus.build(WORKDIR / "corpus", args.candidates, seed=1)
+        # Starts the OCR pool before anything is timed
+        asyncio.run(enrol(project_ids[0], corpus.build(WORKDIR / "warmup", 1, seed=0)))
+        report = {"cpus": os.cpu_count(), "candidates": args.candidates, "llm_latency_ms": args.llm_latency_ms}
+        for name, project_id in zip(rounds, project_ids):
+            candidates.CANDIDATE_REUSE_ENABLED = name != "returning_without_reuse"
+            ocr_cache.invalidate()
+            extraction_cache.invalidate()
+            report[name] = summarise(project_id, asyncio.run(enrol(project_id, people)))
+        ocr.get_pool().shutdown(wait=True)
+    finally:
+        stub.terminate()
+        stub.wait()
+
+    with SessionLocal() as db:
+        report["candidates_stored"] = db.query(Candidate).count()
+        report["persons_linked"] = db.query(Person).filter(Person.candidate_id.isnot(None)).count()
+    # The reused identity fields are those the full extraction reads
+    report["reused_fields_match"] = identities(project_ids[2]) == identities(project_ids[1])
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,216 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import httpx
+
+# Requests per second on the project list (GET /progetti) and a project's person list
+# (GET /progetti/{id}) at increasing concurrency, plus a burst of project creations
+# (POST /progetto) alongside the reads, on a seeded SQLite database. With --against REV the
+# same load also runs against a checkout of REV (git worktree), so the report has before and
+# after side by side.
+#   python benchmarks/bench_db.py [--projects 200] [--persons 20000] [--concurrency 1,4,12]
+#                                 [--seconds 5] [--against HEAD]
+
+ROOT = Path(__file__).resolve().parent.parent
+REQUEST_TIMEOUT = 40
+
+
+def seed(database_url: str, projects: int, persons: int) -> None:
+    env = {**os.environ, "DATABASE_URL": database_url}
+    script = (
+        "import sys\n"
+        f"sys.path.insert(0, {str(ROOT)!r})\n"
+        "import migrations\n"
+        "migrations.migrate()\n"
+    )
+    subprocess.run([sys.executable, "-c", script], env=env, check=True)
+    os.environ["DATABASE_URL"] = database_url
+    sys.path.insert(0, str(ROOT))
+    from database import engine
+    from models import Person, Project
+
+    rng = random.Random(1)
+    start = datetime(2024, 1, 1)
+    with engine.begin() as connection:
+        connection.execute(
+            Project.__table__.insert(),
+            [{"name": f"Progetto {number}", "created_at": start + timedelta(hours=number)} for number in range(projects)],
+        )
+        rows = [
+            {
+                "project_id": rng.randint(1, projects) if number % 4 else 1,
+                "nome": rng.choice(["Mario", "Anna", "Luca", "Giulia", "Marco", "Sara"]),
+                "cognome": rng.choice(["Rossi", "Bianchi", "Esposito", "Romano", "Colombo"]),
+                "codice_fiscale": f"RSSMRA80A01H501{number % 10}",
+                "numero_documento": "" if number % 7 == 0 else f"CA{number:07d}",
+                "privacy_ok": number % 5 != 0,
+                "cv_firmato": True,
+                "created_at": start + timedelta(minutes=number),
+            }
+            for number in range(persons)
+        ]
+        connection.execute(Person.__table__.insert(), rows)
+
+
+def start_server(tree: Path, env: dict) -> tuple:
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=tree,
+        env=env,
+        stderr=subprocess.DEVNULL,
+    )
+    return process, f"http://127.0.0.1:{port}"
+
+
+async def log_in(client) -> None:
+    # Retried until it works: the default user is created in the background at startup
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        try:
+            response = await client.post("/login", data={"username": "admin", "password": "admin"})
+            if response.status_code == 303:
+                return
+        except Exception:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError("could not log in")
+
+
+async def load(client, paths, concurrency: int, seconds: float) -> dict:
+    latencies, errors = [], 0
+    deadline = time.perf_counter() + seconds
+
+    async def worker(number: int) -> None:
+        nonlocal errors
+        rng = random.Random(number)
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                response = await client.get(rng.choice(paths))
+                errors += response.status_code != 200
+            except httpx.HTTPError:
+                # Timeouts included: a server stuck waiting on its pool counts as failing
+                errors += 1
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(number) for number in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    ordered = sorted(latencies)
+    return {
+        "requests_per_s": round(len(ordered) / elapsed, 1),
+        "p50_ms": round(statistics.median(ordered) * 1000, 1),
+        "p95_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000, 1),
+        "errors": errors,
+    }
+
+
+async def writes(client, concurrency: int, count: int, label: str) -> dict:
+    # Project creations racing each other and the readers: the "database is locked" case
+    statuses = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def create(number: int) -> None:
+        async with semaphore:
+            try:
+                response = await client.post("/progetto", data={"project_name": f"Nuovo {label} {number}"})
+                statuses.append(response.status_code)
+            except httpx.HTTPError:
+                statuses.append(0)
+
+    readers = asyncio.create_task(load(client, ["/progetti"], concurrency, 0.5))
+    start = time.perf_counter()
+    await asyncio.gather(*(create(number) for number in range(count)))
+    elapsed = time.perf_counter() - start
+    await readers
+    return {
+        "creations": count,
+        "per_s": round(count / elapsed, 1),
+        "ok": statuses.count(303),
+        "errors": len(statuses) - statuses.count(303),
+    }
+
+
+async def measure(tree: Path, env: dict, levels, seconds: float, projects: int, label: str) -> dict:
+    process, base_url = start_server(tree, env)
+    try:
+        limits = httpx.Limits(max_connections=max(levels) * 2)
+        async with httpx.AsyncClient(base_url=base_url, timeout=REQUEST_TIMEOUT, limits=limits) as client:
+            await log_in(client)
+            pages = {
+                "projects": ["/progetti"],
+                "persons": [f"/progetti/{number}" for number in range(1, min(projects, 50) + 1)],
+            }
+            # Warm up the routes and the connection pool
+            await load(client, pages["projects"] + pages["persons"], 4, 1)
+            report = {
+                page: {str(level): await load(client, paths, level, seconds) for level in levels}
+                for page, paths in pages.items()
+            }
+            report["writes"] = await writes(client, max(levels), 100, label)
+            return report
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def git_worktree(revision: str) -> Path:
+    path = Path(tempfile.mkdtemp()) / "tree"
+    subprocess.run(["git", "worktree", "add", "--detach", str(path), revision], cwd=ROOT, check=True, capture_output=True)
+    # Older trees mount static/ from the working directory and fail without it
+    (path / "static").mkdir(exist_ok=True)
+    return path
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--projects", type=int, default=200)
+    parser.add_argument("--persons", type=int, default=20000)
+    parser.add_argument("--concurrency", default="1,4,12")
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--against")
+    args = parser.parse_args()
+    levels = [int(level) for level in args.concurrency.split(",")]
+
+    workdir = Path(tempfile.mkdtemp())
+    database = workdir / "bench_db.db"
+    seed(f"sqlite:///{database}", args.projects, args.persons)
+    env = {
+        **os.environ,
+        "DATABASE_URL": f"sqlite:///{database}",
+        "UPLOAD_DIR": str(workdir / "uploads"),
+        "CACHE_PATH": str(workdir / "cache.db"),
+        "OPENAI_API_KEY": "stub",
+        "PREWARM_ENABLED": "0",
+        "METRICS_ENABLED": "0",
+    }
+    report = {"cpus": os.cpu_count(), "projects": args.projects, "persons": args.persons, "seconds": args.seconds}
+    trees = [("current", ROOT)]
+    if args.against:
+        trees.insert(0, (args.against, git_worktree(args.against)))
+    try:
+        for label, tree in trees:
+            report[label] = asyncio.run(measure(tree, env, levels, args.seconds, args.projects, label))
+    finally:
+        for label, tree in trees:
+            if tree != ROOT:
+                subprocess.run(["git", "worktree", "remove", "--force", str(tree)], cwd=ROOT, capture_output=True)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
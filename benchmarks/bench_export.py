@@ -0,0 +1,115 @@
+import json
+import multiprocessing
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+# Seeds a throwaway SQLite database and streams the persons export in a fresh process per run,
+# reporting rows/sec and the peak RSS of that process; the runs over a tenth of the rows and over
+# all of them should peak at about the same RSS.
+#   python benchmarks/bench_export.py [persons]
+
+# Spawned children import this module again: they must reuse the parent's database
+os.environ.setdefault("BENCH_EXPORT_DB", str(Path(tempfile.mkdtemp()) / "bench_export.db"))
+DB_PATH = Path(os.environ["BENCH_EXPORT_DB"])
+os.environ["DATABASE_URL"] = f"sqlite:///{DB_PATH}"
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from database import Base, engine  # noqa: E402
+from export import export_stream, iter_persons  # noqa: E402
+from models import Person, Project  # noqa: E402
+
+
+def seed(persons: int, projects: int = 10) -> None:
+    Base.metadata.create_all(bind=engine)
+    rng = random.Random(3)
+    start = datetime(2023, 1, 1)
+    with engine.begin() as conn:
+        conn.execute(Project.__table__.insert(), [{"name": f"Progetto {i}"} for i in range(projects)])
+        batch = []
+        for i in range(persons):
+            batch.append(
+                {
+                    "project_id": 1 + i % projects,
+                    "nome": "Nicolò",
+                    "cognome": f"D'Angelo {i}",
+                    "codice_fiscale": f"DNGNCL80A01H501{i % 10}",
+                    "indirizzo_domicilio": "Via Garibaldi 12, Perugia" if rng.random() < 0.8 else "",
+                    "indirizzo_residenza": "Via Garibaldi 12, Perugia",
+                    "data_nascita": "1980-01-01",
+                    "comune_nascita": "Roma",
+                    "provincia_nascita": "RM",
+                    "sesso": "M",
+                    "numero_documento": "CA12345AB",
+                    "ente_rilascio": "Comune di Perugia",
+                    "data_rilascio": "2020-01-01",
+                    "data_scadenza": "2030-01-01",
+                    "titolo_studio_piu_recente": "Laurea magistrale in Economia",
+                    "data_conseguimento_titolo": "2005-07-01",
+                    "situazione_occupazionale": "Disoccupato da più di 12 mesi",
+                    "privacy_ok": rng.random() < 0.9,
+                    "cv_firmato": rng.random() < 0.9,
+                    "data_cv": "2024-01-01",
+                    "created_at": start + timedelta(seconds=i * 13),
+                }
+            )
+            if len(batch) == 10000:
+                conn.execute(Person.__table__.insert(), batch)
+                batch = []
+        if batch:
+            conn.execute(Person.__table__.insert(), batch)
+
+
+def run_export(fmt: str, limit_to_project: bool, queue) -> None:
+    baseline_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    size = 0
+    project_ids = [1] if limit_to_project else None
+    for chunk in export_stream(fmt, iter_persons(project_ids=project_ids)):
+        size += len(chunk)
+    elapsed = time.perf_counter() - start
+    queue.put(
+        {
+            "elapsed_s": round(elapsed, 2),
+            "bytes": size,
+            "baseline_rss_mb": round(baseline_kb / 1024, 1),
+            "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        }
+    )
+
+
+def measure(fmt: str, limit_to_project: bool, rows: int) -> dict:
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+    process = context.Process(target=run_export, args=(fmt, limit_to_project, queue))
+    process.start()
+    process.join()
+    if process.exitcode != 0:
+        raise RuntimeError(f"export process failed with exit code {process.exitcode}")
+    result = queue.get()
+    result["rows"] = rows
+    result["rows_per_s"] = round(rows / result["elapsed_s"])
+    return result
+
+
+def main() -> None:
+    persons = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    seed(persons)
+    report = {"persons": persons}
+    for fmt in ("csv", "xlsx"):
+        # Project 1 holds a tenth of the persons
+        report[fmt] = {
+            "tenth": measure(fmt, True, persons // 10),
+            "all": measure(fmt, False, persons),
+        }
+    print(json.dumps(report, indent=2))
+    DB_PATH.unlink()
+
+
+if __name__ == "__main__":
+    main()
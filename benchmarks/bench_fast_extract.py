@@ -0,0 +1,109 @@
+import asyncio
+import json
+import os
+import random
+import statistics
+import sys
+import time
+from datetime import date, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import ai_extraction  # noqa: E402
+import fast_extract  # noqa: E402
+from corpus import make_codice_fiscale  # noqa: E402
+
+# Measures what the rule-based stage saves per document: its own latency, the prompt
+# tokens still sent to the model and how many calls are skipped outright.
+#   python benchmarks/bench_fast_extract.py [documents]
+# With OPENAI_BASE_URL pointing at benchmarks/stub_llm.py (and OPENAI_API_KEY set) it
+# also times extract_part end to end with the fast path on and off.
+
+try:
+    import tiktoken
+
+    _encoding = tiktoken.get_encoding("o200k_base")
+
+    def count_tokens(text: str) -> int:
+        return len(_encoding.encode(text))
+
+except ImportError:
+
+    def count_tokens(text: str) -> int:
+        return max(1, len(text) // 4)
+
+
+def make_documents(rng: random.Random, count: int):
+    for _ in range(count):
+        birth = date(1950, 1, 1) + timedelta(days=rng.randint(0, 365 * 50))
+        issued = date(2016, 1, 1) + timedelta(days=rng.randint(0, 365 * 8))
+        cf = make_codice_fiscale(rng, birth, rng.random() < 0.5)
+        numero = f"C{rng.choice('ABCD')}{rng.randint(0, 99999):05d}{rng.choice('ABCDEFGH')}{rng.choice('ABCDEFGH')}"
+        identity = (
+            "REPUBBLICA ITALIANA\nCARTA DI IDENTITA / IDENTITY CARD\n"
+            f"{numero}\nCOGNOME / SURNAME\nROSSI\nNOME / NAME\nMARIO\n"
+            f"LUOGO E DATA DI NASCITA / PLACE AND DATE OF BIRTH\nROMA (RM) {birth:%d.%m.%Y}\n"
+            f"EMISSIONE / ISSUING {issued:%d.%m.%Y}  SCADENZA / EXPIRY {issued.replace(year=issued.year + 10):%d.%m.%Y}\n"
+            f"INDIRIZZO DI RESIDENZA VIA ROMA 1 ROMA\nCODICE FISCALE / FISCAL CODE {cf}\n"
+        )
+        tessera = f"TESSERA SANITARIA\nCodice fiscale {cf[:6]} {cf[6:11]} {cf[11:]}\nCognome ROSSI\nNome MARIO\n"
+        yield {"documento_identita": identity, "tessera_sanitaria": tessera}
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+async def time_extract_part(documents, enabled: bool):
+    ai_extraction.FAST_EXTRACT_ENABLED = enabled
+    timings = {part: [] for part in fast_extract.EXTRACTORS}
+    for document in documents:
+        for part, text in document.items():
+            # A unique suffix keeps the extraction memo cache out of the measurement
+            text = f"{text}\nrif {random.random()}"
+            start = time.perf_counter()
+            await ai_extraction.extract_part(part, text)
+            timings[part].append((time.perf_counter() - start) * 1000)
+    return {part: {"p50_ms": statistics.median(values), "p95_ms": percentile(values, 0.95)} for part, values in timings.items()}
+
+
+def main() -> None:
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    documents = list(make_documents(random.Random(42), count))
+    report = {"documents": count, "parts": {}}
+
+    for part in fast_extract.EXTRACTORS:
+        wanted = list(ai_extraction.PARTS[part]["fields"])
+        rule_ms, full_tokens, reduced_tokens, skipped = [], 0, 0, 0
+        for document in documents:
+            text = document[part]
+            start = time.perf_counter()
+            known = fast_extract.confident(fast_extract.extract(part, text), wanted)
+            rule_ms.append((time.perf_counter() - start) * 1000)
+            missing = [field for field in wanted if field not in known]
+            full_tokens += count_tokens(ai_extraction.build_prompt(part, text))
+            if missing:
+                reduced_tokens += count_tokens(ai_extraction.build_prompt(part, text, missing))
+            else:
+                skipped += 1
+        report["parts"][part] = {
+            "rule_stage_p50_ms": statistics.median(rule_ms),
+            "rule_stage_p95_ms": percentile(rule_ms, 0.95),
+            "prompt_tokens_without_fast_path": full_tokens,
+            "prompt_tokens_with_fast_path": reduced_tokens,
+            "token_saving_pct": round(100 * (1 - reduced_tokens / full_tokens), 1),
+            "llm_calls_skipped": skipped,
+        }
+
+    if os.getenv("OPENAI_BASE_URL") and os.getenv("OPENAI_API_KEY"):
+        sample = documents[: min(count, 50)]
+        report["latency_without_fast_path"] = asyncio.run(time_extract_part(sample, False))
+        report["latency_with_fast_path"] = asyncio.run(time_extract_part(sample, True))
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
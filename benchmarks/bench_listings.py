@@ -0,0 +1,123 @@
+import asyncio
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+# Seeds a throwaway SQLite database and times the project/person list queries.
+#   python benchmarks/bench_listings.py [persons] [projects]
+
+DB_PATH = Path(tempfile.mkdtemp()) / "bench_listings.db"
+os.environ["DATABASE_URL"] = f"sqlite:///{DB_PATH}"
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import migrations  # noqa: E402
+from database import AsyncSessionLocal, SessionLocal, engine  # noqa: E402
+from models import Person, Project  # noqa: E402
+from queries import person_page, project_counts, project_page  # noqa: E402
+
+
+def seed(persons: int, projects: int) -> None:
+    migrations.migrate()
+    rng = random.Random(1)
+    start = datetime(2022, 1, 1)
+    with engine.begin() as conn:
+        conn.execute(
+            Project.__table__.insert(),
+            [{"name": f"Progetto {i}", "created_at": start + timedelta(days=i)} for i in range(projects)],
+        )
+        batch = []
+        for i in range(persons):
+            batch.append(
+                {
+                    "project_id": 1 + i % projects,
+                    "nome": f"Nome{i}",
+                    "cognome": f"Cognome{i}",
+                    "codice_fiscale": f"CF{i:014d}",
+                    "indirizzo_domicilio": "Via Roma 1" if rng.random() < 0.8 else "",
+                    "indirizzo_residenza": "Via Roma 1",
+                    "titolo_studio_piu_recente": "Laurea",
+                    "data_conseguimento_titolo": "2010-07-01",
+                    "situazione_occupazionale": "Disoccupato",
+                    "privacy_ok": rng.random() < 0.9,
+                    "cv_firmato": True,
+                    "data_cv": "2024-01-01",
+                    "created_at": start + timedelta(seconds=i * 37),
+                }
+            )
+            if len(batch) == 10000:
+                conn.execute(Person.__table__.insert(), batch)
+                batch = []
+        if batch:
+            conn.execute(Person.__table__.insert(), batch)
+
+
+def summarise(timings: list) -> dict:
+    timings.sort()
+    return {"p50_ms": round(statistics.median(timings), 3), "p95_ms": round(timings[int(len(timings) * 0.95) - 1], 3)}
+
+
+def measure(fn, repeat: int = 20) -> dict:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return summarise(timings)
+
+
+async def measure_async(fn, repeat: int = 20) -> dict:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        await fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return summarise(timings)
+
+
+async def listings() -> dict:
+    # The queries of the pages, on the async session the routes use
+    async with AsyncSessionLocal() as db:
+        cursor_page_20 = None
+        for _ in range(20):
+            _, cursor_page_20 = await person_page(db, 1, cursor_page_20)
+
+        async def projects_list_page_with_counts():
+            projects, _ = await project_page(db)
+            await project_counts(db, [row.id for row in projects])
+
+        return {
+            "project_detail_first_page": await measure_async(lambda: person_page(db, 1)),
+            "project_detail_page_21": await measure_async(lambda: person_page(db, 1, cursor_page_20)),
+            "project_detail_counts": await measure_async(lambda: project_counts(db, [1])),
+            "projects_list_page_with_counts": await measure_async(projects_list_page_with_counts),
+        }
+
+
+def main() -> None:
+    persons = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    projects = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    seed(persons, projects)
+
+    def full_project_detail():
+        # What project_detail did before: every Person of the project, fully hydrated
+        with SessionLocal() as db:
+            db.query(Person).filter_by(project_id=1).all()
+
+    report = {
+        "persons": persons,
+        "projects": projects,
+        "project_detail_all_rows": measure(full_project_detail, repeat=5),
+        **asyncio.run(listings()),
+    }
+    print(json.dumps(report, indent=2))
+    DB_PATH.unlink()
+
+
+if __name__ == "__main__":
+    main()
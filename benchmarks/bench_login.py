@@ -0,0 +1,143 @@
+import asyncio
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+# Latency of an unrelated page (GET /login) while a burst of logins is being checked, with the
+# bcrypt verification on the auth executor ("offloaded") and, as the baseline, called on the
+# event loop as before ("inline"). A last phase sends wrong passwords for one account and
+# counts how many reach bcrypt before the throttle answers 429.
+#   python benchmarks/bench_login.py [logins]
+
+ROOT = Path(__file__).resolve().parent.parent
+PROBE_INTERVAL = 0.02
+
+
+def serve(mode: str, port: int) -> None:
+    sys.path.insert(0, str(ROOT))
+    import uvicorn
+
+    import auth
+    import main
+
+    if mode == "inline":
+        async def check_password(password, password_hash):
+            return auth._check_password(password, password_hash)
+
+        auth.check_password = check_password
+    uvicorn.run(main.app, port=port, log_level="warning")
+
+
+def start_server(mode: str) -> tuple:
+    workdir = Path(tempfile.mkdtemp())
+    # main.py mounts static/ and loads templates/ from the working directory
+    (workdir / "static").mkdir()
+    (workdir / "templates").symlink_to(ROOT / "templates")
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    env = {
+        **os.environ,
+        "DATABASE_URL": f"sqlite:///{workdir / 'bench_login.db'}",
+        "UPLOAD_DIR": str(workdir / "uploads"),
+        "CACHE_PATH": str(workdir / "cache.db"),
+        "OPENAI_API_KEY": "stub",
+    }
+    process = subprocess.Popen([sys.executable, __file__, "--serve", mode, str(port)], cwd=workdir, env=env)
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            break
+        except OSError:
+            time.sleep(0.2)
+    return process, f"http://127.0.0.1:{port}"
+
+
+def summarise(values) -> dict:
+    ordered = sorted(values)
+    return {
+        "requests": len(ordered),
+        "p50_ms": round(statistics.median(ordered) * 1000, 1),
+        "p95_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000, 1),
+        "max_ms": round(ordered[-1] * 1000, 1),
+    }
+
+
+async def probe(client, stop: asyncio.Event) -> list:
+    latencies = []
+    while not stop.is_set():
+        start = time.perf_counter()
+        await client.get("/login")
+        latencies.append(time.perf_counter() - start)
+        await asyncio.sleep(PROBE_INTERVAL)
+    return latencies
+
+
+async def login(base_url: str, username: str, password: str) -> int:
+    import httpx
+
+    # A client per login: a fresh session cookie, as separate users would have
+    async with httpx.AsyncClient(base_url=base_url, timeout=120) as client:
+        response = await client.post("/login", data={"username": username, "password": password})
+        return response.status_code
+
+
+async def measure(base_url: str, logins: int) -> dict:
+    import httpx
+
+    report = {}
+    async with httpx.AsyncClient(base_url=base_url, timeout=120) as client:
+        # Warm up: loads the bcrypt backend and compiles the templates
+        await login(base_url, "admin", "admin")
+
+        stop = asyncio.Event()
+        task = asyncio.create_task(probe(client, stop))
+        await asyncio.sleep(2)
+        stop.set()
+        report["idle"] = summarise(await task)
+
+        stop = asyncio.Event()
+        task = asyncio.create_task(probe(client, stop))
+        start = time.perf_counter()
+        statuses = await asyncio.gather(*(login(base_url, "admin", "admin") for _ in range(logins)))
+        elapsed = time.perf_counter() - start
+        stop.set()
+        report["during_burst"] = summarise(await task)
+        report["burst"] = {"logins": logins, "ok": statuses.count(303), "seconds": round(elapsed, 2)}
+
+        start = time.perf_counter()
+        statuses = [await login(base_url, "admin", f"wrong-{number}") for number in range(logins)]
+        report["wrong_passwords"] = {
+            "attempts": logins,
+            "checked": statuses.count(200),
+            "throttled": statuses.count(429),
+            "seconds": round(time.perf_counter() - start, 2),
+        }
+    return report
+
+
+def main() -> None:
+    logins = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    report = {"logins": logins, "cpus": os.cpu_count()}
+    for mode in ("inline", "offloaded"):
+        process, base_url = start_server(mode)
+        try:
+            report[mode] = asyncio.run(measure(base_url, logins))
+        finally:
+            process.terminate()
+            process.wait()
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 3 and sys.argv[1] == "--serve":
+        serve(sys.argv[2], int(sys.argv[3]))
+    else:
+        main()
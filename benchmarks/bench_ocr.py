@@ -0,0 +1,245 @@
+import asyncio
+import json
+import os
+import random
+import re
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from pathlib import Path
+from typing import Tuple
+
+# Generates a corpus of synthetic candidate documents and OCRs it twice, in separate processes:
+# with the previous pipeline (document-level text layer check, fixed 300 dpi, raw images, one
+# tesseract process per call) and with ocr.py. Reports CPU (process tree) and word recall.
+#   python benchmarks/bench_ocr.py [photos]
+# Needs tesseract language data for OCR_LANG (OCR_LANG=eng is enough: the corpus is ASCII).
+
+os.environ.setdefault("CACHE_PATH", str(Path(tempfile.mkdtemp()) / "bench_ocr_cache.db"))
+os.environ["OCR_CACHE_ENABLED"] = "0"
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import pdfplumber  # noqa: E402
+import pytesseract  # noqa: E402
+from PIL import Image, ImageDraw, ImageFilter  # noqa: E402
+
+import ocr  # noqa: E402
+from corpus import A4, font, jpeg, write_pdf  # noqa: E402
+
+WORDS = (
+    "curriculum vitae esperienza lavorativa istruzione formazione laurea diploma magistrale "
+    "triennale universita liceo scientifico competenze linguistiche inglese francese tedesco "
+    "patente europea informatica contabilita amministrazione magazzino logistica vendite "
+    "assistenza clienti progetto regionale tirocinio apprendistato impiegato operaio tecnico "
+    "responsabile coordinatore stage volontariato certificazione attestato corso sicurezza "
+    "lavoro comune provincia residenza domicilio nascita documento identita carta rilasciata "
+    "scadenza firma privacy consenso trattamento dati personali disoccupato occupato"
+).split()
+A5 = (420, 595)
+
+
+def sentence(rng: random.Random, words: int) -> str:
+    parts = []
+    for _ in range(words):
+        roll = rng.random()
+        if roll < 0.08:
+            parts.append(f"{rng.randint(1, 28):02d}/{rng.randint(1, 12):02d}/{rng.randint(1970, 2024)}")
+        elif roll < 0.12:
+            parts.append(f"{rng.randint(10000, 99999)}")
+        else:
+            parts.append(rng.choice(WORDS))
+    return " ".join(parts)
+
+
+def text_image(rng: random.Random, size, lines: int, font_size: int) -> Tuple[Image.Image, str]:
+    image = Image.new("L", size, 255)
+    draw = ImageDraw.Draw(image)
+    face = font(font_size)
+    margin = size[0] // 12
+    words_per_line = max(3, (size[0] - 2 * margin) // (font_size * 4))
+    content = []
+    y = margin
+    for _ in range(lines):
+        if y + font_size * 1.6 > size[1] - margin:
+            break
+        line = sentence(rng, words_per_line)
+        draw.text((margin, y), line, fill=0, font=face)
+        content.append(line)
+        y += int(font_size * 1.7)
+    return image, "\n".join(content)
+
+
+def phone_photo(rng: random.Random) -> Tuple[Image.Image, str]:
+    # A page shot from above: 12 MP, tilted, uneven lighting, sensor noise, JPEG
+    page, content = text_image(rng, (2480, 3508), 40, 42)
+    page = page.rotate(rng.uniform(-4, 4), resample=Image.BICUBIC, expand=True, fillcolor=200)
+    page = page.resize((3000, 4000), Image.BICUBIC)
+    light = Image.linear_gradient("L").resize(page.size).point(lambda value: 150 + value * 100 // 255)
+    photo = Image.composite(page, light, page.point(lambda value: 255 - value))
+    noise = Image.effect_noise(photo.size, 18).point(lambda value: value - 128)
+    photo = Image.blend(photo, noise.convert("L"), 0.06).filter(ImageFilter.GaussianBlur(1.2))
+    return photo.convert("RGB"), content
+
+
+def typed_page(rng: random.Random, size=A4):
+    content = [sentence(rng, 9) for _ in range(30)]
+    lines = [(60, size[1] - 80 - 22 * number, 11, line) for number, line in enumerate(content)]
+    return (size, lines, []), "\n".join(content)
+
+
+def scanned_page(rng: random.Random, dpi: int, size=A4):
+    pixels = (size[0] * dpi // 72, size[1] * dpi // 72)
+    image, content = text_image(rng, pixels, 40, max(18, dpi // 7))
+    image = image.rotate(rng.uniform(-2, 2), resample=Image.BICUBIC, fillcolor=255)
+    return (size, [], [(jpeg(image), *pixels, (0, 0, *size))]), content
+
+
+def mixed_page(rng: random.Random):
+    # A short typed statement with a scanned ID card pasted below it
+    content = [sentence(rng, 9) for _ in range(6)]
+    lines = [(60, A4[1] - 80 - 22 * number, 11, line) for number, line in enumerate(content)]
+    card, card_text = text_image(rng, (1700, 1100), 8, 46)
+    return (A4, lines, [(jpeg(card), 1700, 1100, (60, 200, 425, 275))]), "\n".join(content + [card_text])
+
+
+def build_corpus(directory: Path, photos: int) -> dict:
+    rng = random.Random(7)
+    truth = {}
+    for number in range(photos):
+        image, content = phone_photo(rng)
+        path = directory / f"foto_{number}.jpg"
+        image.save(path, "JPEG", quality=85)
+        truth[str(path)] = content
+    documents = {
+        # Typed CV whose signed pages were scanned and appended
+        "cv_firmato.pdf": [typed_page(rng), scanned_page(rng, 200), scanned_page(rng, 200)],
+        # Fully scanned, low resolution scan and a half-size page
+        "scansione.pdf": [scanned_page(rng, 150), scanned_page(rng, 200, A5)],
+        "dichiarazione.pdf": [mixed_page(rng)],
+        "cv_testo.pdf": [typed_page(rng), typed_page(rng)],
+    }
+    for name, pages in documents.items():
+        path = directory / name
+        write_pdf(path, [page for page, _ in pages])
+        truth[str(path)] = "\n".join(content for _, content in pages)
+    return truth
+
+
+# Previous pipeline, kept here as the baseline
+def legacy_image(path: str) -> str:
+    with Image.open(path) as image:
+        return pytesseract.image_to_string(image, lang=ocr.OCR_LANG)
+
+
+def legacy_text_layer(path: str):
+    with pdfplumber.open(path) as pdf:
+        return [page.extract_text() or "" for page in pdf.pages]
+
+
+def legacy_page(path: str, number: int) -> str:
+    with pdfplumber.open(path) as pdf:
+        image = pdf.pages[number].to_image(resolution=300).original
+        return pytesseract.image_to_string(image, lang=ocr.OCR_LANG)
+
+
+def legacy_run(paths, kinds):
+    with ProcessPoolExecutor(max_workers=ocr.OCR_WORKERS, mp_context=get_context("spawn")) as pool:
+        first = [pool.submit(legacy_text_layer if kind == "pdf" else legacy_image, path) for path, kind in zip(paths, kinds)]
+        results = []
+        for path, kind, future in zip(paths, kinds, first):
+            if kind == "image":
+                results.append(future.result())
+                continue
+            pages = future.result()
+            if "".join(pages).strip():
+                results.append("\n".join(pages))
+            else:
+                jobs = [pool.submit(legacy_page, path, number) for number in range(len(pages))]
+                results.append("\n".join(job.result() for job in jobs))
+        return results
+
+
+def run_pipeline(name: str, paths) -> None:
+    kinds = ["pdf" if path.endswith(".pdf") else "image" for path in paths]
+    if name == "legacy":
+        texts = legacy_run(paths, kinds)
+    else:
+        texts = asyncio.run(ocr._run_ocr(paths, kinds))
+        # Joined, not just shut down, so the workers' CPU shows up in the parent's rusage
+        ocr.get_pool().shutdown(wait=True)
+    print(json.dumps(dict(zip(paths, texts))))
+
+
+def tokens(text: str) -> Counter:
+    return Counter(re.findall(r"[a-z0-9/]+", text.lower()))
+
+
+def recall(expected: str, found: str) -> float:
+    wanted, got = tokens(expected), tokens(found)
+    total = sum(wanted.values())
+    return sum(min(count, got[word]) for word, count in wanted.items()) / total if total else 1.0
+
+
+def ocr_calls(name: str, paths) -> int:
+    # Images and PDF pages each pipeline hands to tesseract
+    calls = 0
+    for path in paths:
+        if not path.endswith(".pdf"):
+            calls += 1
+        elif name == "legacy":
+            pages = legacy_text_layer(path)
+            calls += 0 if "".join(pages).strip() else len(pages)
+        else:
+            calls += sum(max(len(plan.regions), 1) for plan in ocr.pdf_plan(path) if plan.kind != "text")
+    return calls
+
+
+def measure(name: str, paths) -> dict:
+    before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    start = time.perf_counter()
+    output = subprocess.run(
+        [sys.executable, __file__, "--run", name, *paths], capture_output=True, text=True, check=True
+    ).stdout
+    wall = time.perf_counter() - start
+    after = resource.getrusage(resource.RUSAGE_CHILDREN)
+    cpu = (after.ru_utime - before.ru_utime) + (after.ru_stime - before.ru_stime)
+    return {"wall_s": round(wall, 2), "cpu_s": round(cpu, 2), "texts": json.loads(output)}
+
+
+def main() -> None:
+    photos = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    try:
+        ocr.engine_version()
+        if ocr.load_tesserocr() is not None:
+            ocr.load_tesserocr().PyTessBaseAPI(lang=ocr.OCR_LANG).End()
+        else:
+            pytesseract.get_tesseract_version()
+    except Exception as error:
+        print(json.dumps({"skipped": f"no OCR engine or language data for {ocr.OCR_LANG}: {error}"}))
+        return
+    directory = Path(tempfile.mkdtemp())
+    truth = build_corpus(directory, photos)
+    paths = list(truth)
+    report = {"documents": len(paths), "workers": ocr.OCR_WORKERS, "engine": "tesserocr" if ocr.load_tesserocr() else "pytesseract"}
+    for name in ("legacy", "adaptive"):
+        result = measure(name, paths)
+        result["ocr_calls"] = ocr_calls(name, paths)
+        result["cpu_s_per_call"] = round(result["cpu_s"] / result["ocr_calls"], 2)
+        texts = result.pop("texts")
+        result["recall"] = {Path(path).name: round(recall(truth[path], texts[path]), 3) for path in paths}
+        everything = "\n".join(truth.values())
+        result["recall_overall"] = round(recall(everything, "\n".join(texts[path] for path in paths)), 3)
+        report[name] = result
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 2 and sys.argv[1] == "--run":
+        run_pipeline(sys.argv[2], sys.argv[3:])
+    else:
+        main()
@@ -0,0 +1,164 @@
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+from sqlalchemy import event
+
+# Repeat views of the read-heavy pages (project list, the largest project, one of its persons)
+# with HTTP_CACHE_ENABLED off and on, in process through the ASGI app on a seeded SQLite
+# database. Per page, the database queries and p50 latency of:
+#   cold          the first view
+#   repeat        the same page again, no validator sent (page cache on the server)
+#   conditional   the same page again with If-None-Match, as a browser revalidates (304)
+#   after_write   the first view after one of the project's persons is edited
+# plus the person's uploaded document, whole and as a 64 KiB Range (a preview's first request).
+#   python benchmarks/bench_pages.py [--projects 200] [--persons 20000] [--repeat 50]
+
+ROOT = Path(__file__).resolve().parent.parent
+WORKDIR = Path(tempfile.mkdtemp())
+os.environ["UPLOAD_DIR"] = str(WORKDIR / "uploads")
+os.environ["CACHE_PATH"] = str(WORKDIR / "cache.db")
+os.environ["METRICS_ENABLED"] = "0"
+sys.path.insert(0, str(ROOT / "benchmarks"))
+
+from bench_db import log_in, seed  # noqa: E402
+
+DOCUMENT_BYTES = 4 * 1024 * 1024
+PREVIEW_RANGE = "bytes=0-65535"
+
+
+class QueryCounter:
+    def __init__(self, *engines):
+        self.count = 0
+        for engine in engines:
+            event.listen(engine, "before_cursor_execute", self._count)
+
+    def _count(self, *args) -> None:
+        self.count += 1
+
+
+async def timed(client, counter: QueryCounter, path: str, headers=None) -> tuple:
+    counter.count = 0
+    start = time.perf_counter()
+    response = await client.get(path, headers=headers or {})
+    return response, time.perf_counter() - start, counter.count
+
+
+async def views(client, counter: QueryCounter, path: str, repeat: int, headers=None) -> dict:
+    statuses, latencies, queries = set(), [], []
+    for _ in range(repeat):
+        response, seconds, count = await timed(client, counter, path, headers)
+        statuses.add(response.status_code)
+        latencies.append(seconds)
+        queries.append(count)
+    return {
+        "status": sorted(statuses),
+        "queries": round(statistics.mean(queries), 1),
+        "p50_ms": round(statistics.median(latencies) * 1000, 2),
+    }
+
+
+def edit_person(person_id: int, number: int) -> None:
+    from database import SessionLocal
+    from models import Person
+
+    with SessionLocal() as db:
+        db.get(Person, person_id).indirizzo_domicilio = f"Via Garibaldi {number}"
+        db.commit()
+
+
+def add_document(person_id: int) -> None:
+    import storage
+    from database import SessionLocal
+    from models import Blob, PersonDocument
+
+    content = b"%PDF-1.4\n" + os.urandom(DOCUMENT_BYTES)
+    sha256 = hashlib.sha256(content).hexdigest()
+    path = storage.blob_path(sha256, "application/pdf")
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(content)
+    with SessionLocal() as db:
+        db.add(Blob(sha256=sha256, size=len(content), mime="application/pdf", refcount=1))
+        db.add(PersonDocument(person_id=person_id, kind="cv", blob_sha256=sha256, filename="cv.pdf"))
+        db.commit()
+
+
+async def measure(app, counter: QueryCounter, pages: dict, person_id: int, repeat: int, round_number: int) -> dict:
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        await log_in(client)
+        report = {}
+        for name, path in pages.items():
+            response, seconds, count = await timed(client, counter, path)
+            entry = {"cold": {"queries": count, "ms": round(seconds * 1000, 2)}}
+            entry["repeat"] = await views(client, counter, path, repeat)
+            etag = response.headers.get("etag")
+            entry["conditional"] = (
+                await views(client, counter, path, repeat, {"If-None-Match": etag}) if etag else None
+            )
+            edit_person(person_id, round_number)
+            response, seconds, count = await timed(client, counter, path, {"If-None-Match": etag} if etag else None)
+            entry["after_write"] = {"status": response.status_code, "queries": count, "ms": round(seconds * 1000, 2)}
+            report[name] = entry
+            round_number += 1
+        document = f"/persone/{person_id}/documenti/cv"
+        report["document"] = {
+            "full": {**await views(client, counter, document, repeat), "bytes": DOCUMENT_BYTES},
+            "preview_range": {
+                **await views(client, counter, document, repeat, {"Range": PREVIEW_RANGE}),
+                "bytes": 65536,
+            },
+        }
+        return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--projects", type=int, default=200)
+    parser.add_argument("--persons", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    seed(f"sqlite:///{WORKDIR / 'bench_pages.db'}", args.projects, args.persons)
+    import alerts
+    import http_cache
+    import main as app_module
+    from cache import page_cache
+    from database import async_engine, engine
+    from models import register_listeners
+
+    register_listeners()
+    alerts.recompute()
+    app_module._prepare_database()
+    # Project 1 is the largest; its newest person gets a document
+    from database import SessionLocal
+    from models import Person
+
+    with SessionLocal() as db:
+        person_id = db.query(Person.id).filter_by(project_id=1).order_by(Person.id.desc()).limit(1).scalar()
+    add_document(person_id)
+
+    counter = QueryCounter(engine, async_engine.sync_engine)
+    pages = {"projects": "/progetti", "project": "/progetti/1", "person": f"/persone/{person_id}"}
+    report = {"projects": args.projects, "persons": args.persons, "repeat": args.repeat}
+    for number, enabled in enumerate((False, True)):
+        http_cache.HTTP_CACHE_ENABLED = enabled
+        page_cache.invalidate()
+        label = "cache_on" if enabled else "cache_off"
+        report[label] = asyncio.run(
+            measure(app_module.app, counter, pages, person_id, args.repeat, number * len(pages))
+        )
+    report["page_cache"] = page_cache.stats()
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,265 @@
+import argparse
+import asyncio
+import json
+import os
+import platform
+import resource
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+# End-to-end run of the candidate pipeline on the synthetic corpus of benchmarks/corpus.py:
+# upload (content-addressed store and job row), OCR, field extraction against
+# benchmarks/stub_llm.py in "read" mode, and the Person insert through the group-commit writer.
+# Reports per-stage p50/p95, throughput at each concurrency level, peak RSS and field-level
+# accuracy against the ground truth, as JSON.
+#   python benchmarks/bench_pipeline.py [--candidates 8] [--concurrency 1,4] [--llm-latency-ms 800]
+#                                       [--out run.json] [--baseline previous.json]
+# The corpus is ASCII-only, so OCR_LANG=eng is enough where Italian language data is missing.
+
+ROOT = Path(__file__).resolve().parent.parent
+WORKDIR = Path(tempfile.mkdtemp())
+os.environ["DATABASE_URL"] = f"sqlite:///{WORKDIR / 'bench_pipeline.db'}"
+os.environ["UPLOAD_DIR"] = str(WORKDIR / "uploads")
+os.environ["CACHE_PATH"] = str(WORKDIR / "cache.db")
+os.environ.setdefault("OPENAI_API_KEY", "stub")
+sys.path.insert(0, str(ROOT))
+
+import corpus  # noqa: E402
+import migrations  # noqa: E402
+import ocr  # noqa: E402
+from ai_extraction import extract_fields_with_ai_async  # noqa: E402
+from database import SessionLocal, async_engine, write_queue  # noqa: E402
+from jobs import PersonWriter, _save_stage, create_job  # noqa: E402
+from models import Project, register_listeners  # noqa: E402
+from storage import UPLOAD_DIR, store_stream  # noqa: E402
+
+STAGES = ["upload", "ocr", "extraction", "persist"]
+FIELDS = [
+    "nome", "cognome", "codice_fiscale", "data_nascita", "comune_nascita", "provincia_nascita", "sesso",
+    "numero_documento", "ente_rilascio", "data_rilascio", "data_scadenza", "indirizzo_residenza",
+    "indirizzo_domicilio", "titolo_studio_piu_recente.titolo", "titolo_studio_piu_recente.data_conseguimento",
+    "situazione_occupazionale", "privacy_clause_present", "firma_presente", "data_cv",
+]
+
+
+def start_stub(latency_ms: float):
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    env = {**os.environ, "STUB_LLM_MODE": "read", "STUB_LLM_LATENCY_MS": str(latency_ms)}
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "benchmarks.stub_llm:app", "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT,
+        env=env,
+    )
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            break
+        except OSError:
+            time.sleep(0.2)
+    os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{port}/v1"
+    return process
+
+
+def upload(project_id: int, files: dict) -> tuple:
+    # What POST /upload does: stream each file into the blob store, then one job row
+    stored = {}
+    for kind, path in files.items():
+        with open(path, "rb") as handle:
+            stored[kind] = store_stream(handle, path.name)
+    with SessionLocal() as db:
+        job_id = create_job(db, project_id, stored)
+    return job_id, stored
+
+
+async def run_candidate(project_id: int, files: dict, writer: PersonWriter) -> tuple:
+    # The stages of JobRunner._run_stages, timed one by one
+    timings = {}
+    start = time.perf_counter()
+    job_id, stored = await asyncio.to_thread(upload, project_id, files)
+    timings["upload"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    kinds = list(stored)
+    results = await ocr.extract_texts_async(
+        [str(stored[kind].path) for kind in kinds], [stored[kind].sha256 for kind in kinds]
+    )
+    texts = {kind: text for kind, (text, _) in zip(kinds, results)}
+    await write_queue.run(_save_stage, job_id, "extraction", texts=texts)
+    timings["ocr"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    data = await extract_fields_with_ai_async(texts["cv"], texts["doc"], texts["tess"])
+    await write_queue.run(_save_stage, job_id, "persist", data=data)
+    timings["extraction"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    await writer.submit(job_id, project_id, data)
+    timings["persist"] = time.perf_counter() - start
+    return timings, data
+
+
+async def run_level(project_id: int, candidates: list, concurrency: int) -> tuple:
+    semaphore = asyncio.Semaphore(concurrency)
+    writer = PersonWriter()
+
+    async def run_one(files: dict):
+        async with semaphore:
+            return await run_candidate(project_id, files, writer)
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*(run_one(files) for files, _ in candidates))
+    wall = time.perf_counter() - start
+    # Each level runs in its own event loop: its connections go with it
+    await async_engine.dispose()
+    return results, wall
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def summarise(values) -> dict:
+    return {
+        "p50_ms": round(statistics.median(values) * 1000, 1),
+        "p95_ms": round(percentile(values, 0.95) * 1000, 1),
+    }
+
+
+def _field(data: dict, name: str):
+    for part in name.split("."):
+        data = data.get(part, "") if isinstance(data, dict) else ""
+    return data
+
+
+def _normalise(value) -> str:
+    return " ".join(str(value).split()).casefold()
+
+
+def accuracy(results: list, truth: list) -> dict:
+    correct = {field: 0 for field in FIELDS}
+    for data, person in zip(results, truth):
+        for field in FIELDS:
+            correct[field] += _normalise(_field(data, field)) == _normalise(_field(person, field))
+    per_field = {field: round(count / len(truth), 3) for field, count in correct.items()}
+    return {"overall": round(statistics.mean(per_field.values()), 3), "fields": per_field}
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def compare(report: dict, baseline: dict) -> dict:
+    # Relative change per metric, in percent; positive means slower (latency) or better (throughput)
+    def change(new, old):
+        return round(100 * (new - old) / old, 1) if old else None
+
+    deltas = {}
+    for level, result in report["levels"].items():
+        previous = baseline.get("levels", {}).get(level)
+        if not previous:
+            continue
+        deltas[level] = {
+            "docs_per_s_pct": change(result["docs_per_s"], previous["docs_per_s"]),
+            "stages": {
+                stage: {
+                    metric: change(values[metric], previous["stages"][stage][metric])
+                    for metric in ("p50_ms", "p95_ms")
+                }
+                for stage, values in result["stages"].items()
+                if stage in previous.get("stages", {})
+            },
+        }
+    if "accuracy" in baseline:
+        deltas["accuracy_points"] = round(report["accuracy"]["overall"] - baseline["accuracy"]["overall"], 3)
+    return deltas
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--candidates", type=int, default=8)
+    parser.add_argument("--concurrency", default="1,4")
+    parser.add_argument("--llm-latency-ms", type=float, default=800)
+    parser.add_argument("--out")
+    parser.add_argument("--baseline")
+    args = parser.parse_args()
+    levels = [int(level) for level in args.concurrency.split(",")]
+
+    # The real schema and listeners: the persist stage also updates the search index
+    migrations.migrate()
+    register_listeners()
+    UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
+    with SessionLocal() as db:
+        project = Project(name="Benchmark")
+        db.add(project)
+        db.commit()
+        project_id = project.id
+
+    stub = start_stub(args.llm_latency_ms)
+    try:
+        # A separate corpus per level: identical files would be OCR and extraction cache hits
+        corpora = [corpus.build(WORKDIR / f"corpus_{level}", args.candidates, seed=index + 1) for index, level in enumerate(levels)]
+        warmup = corpus.build(WORKDIR / "warmup", 1, seed=0)
+        # Starts the OCR pool and loads the engine in its workers before anything is timed
+        asyncio.run(run_level(project_id, warmup, 1))
+
+        report = {
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "cpus": os.cpu_count(),
+            "ocr_workers": ocr.OCR_WORKERS,
+            "ocr_engine": ("tesserocr " if ocr.load_tesserocr() else "tesseract ") + ocr.engine_version(),
+            "llm_latency_ms": args.llm_latency_ms,
+            "candidates_per_level": args.candidates,
+            "levels": {},
+        }
+        all_results, all_truth = [], []
+        for level, candidates in zip(levels, corpora):
+            results, wall = asyncio.run(run_level(project_id, candidates, level))
+            timings = [timing for timing, _ in results]
+            report["levels"][str(level)] = {
+                "wall_s": round(wall, 2),
+                "candidates_per_s": round(len(candidates) / wall, 3),
+                "docs_per_s": round(3 * len(candidates) / wall, 3),
+                "stages": {
+                    **{stage: summarise([timing[stage] for timing in timings]) for stage in STAGES},
+                    "total": summarise([sum(timing.values()) for timing in timings]),
+                },
+            }
+            all_results += [data for _, data in results]
+            all_truth += [person for _, person in candidates]
+        report["accuracy"] = accuracy(all_results, all_truth)
+
+        # Joined so that the workers' peak RSS is accounted to this process
+        ocr.get_pool().shutdown(wait=True)
+        report["peak_rss_mb"] = {
+            "main": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+            "ocr_worker": round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1),
+        }
+    finally:
+        stub.terminate()
+        stub.wait()
+
+    if args.baseline:
+        report["vs_baseline"] = compare(report, json.loads(Path(args.baseline).read_text()))
+    output = json.dumps(report, indent=2)
+    if args.out:
+        Path(args.out).write_text(output)
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
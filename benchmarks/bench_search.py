@@ -0,0 +1,118 @@
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+# Seeds a throwaway SQLite database with persons and the OCR text of their documents,
+# builds the full-text index and times typical searches.
+#   python benchmarks/bench_search.py [persons] [projects]
+
+DB_PATH = Path(tempfile.mkdtemp()) / "bench_search.db"
+os.environ["DATABASE_URL"] = f"sqlite:///{DB_PATH}"
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from database import Base, SessionLocal, engine  # noqa: E402
+from models import Blob, Person, PersonDocument, Project  # noqa: E402
+from search import ensure_schema, search_persons  # noqa: E402
+
+FIRST_NAMES = ["Mario", "Giulia", "Luca", "Francesca", "Marco", "Chiara", "Andrea", "Sara", "Paolo", "Elena"]
+LAST_NAMES = ["Rossi", "Bianchi", "Russo", "Ferrari", "Esposito", "Romano", "Colombo", "Ricci", "Marino", "Greco"]
+TITLES = ["Laurea in Ingegneria", "Diploma di ragioneria", "Laurea in Economia", "Qualifica professionale", "Licenza media"]
+COMMON_WORDS = (
+    "esperienza lavoro azienda presso anni corso formazione gestione cliente patente inglese "
+    "informatica excel team progetto vendita logistica sicurezza magazziniere saldatore operaio "
+    "impiegato amministrativo contabilità carrello elevatore cantiere manutenzione elettricista idraulico"
+).split()
+SYLLABLES = ["ra", "to", "mi", "ne", "lo", "sa", "ci", "ve", "du", "po", "ga", "ri", "te", "mo", "fi"]
+
+
+def vocabulary(rng: random.Random, size: int = 20000):
+    # CV text follows a Zipf-like distribution: a few words everywhere, a long tail of rare ones
+    words = COMMON_WORDS + [
+        "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(3, 5))) for _ in range(size)
+    ]
+    weights, total = [], 0.0
+    for rank in range(1, len(words) + 1):
+        total += 1 / rank
+        weights.append(total)
+    return words, weights
+
+
+def seed(persons: int, projects: int) -> None:
+    Base.metadata.create_all(bind=engine)
+    rng = random.Random(7)
+    words, cum_weights = vocabulary(rng)
+    with engine.begin() as conn:
+        conn.execute(Project.__table__.insert(), [{"name": f"Progetto {i}"} for i in range(projects)])
+        conn.execute(Blob.__table__.insert(), [{"sha256": "0" * 64, "size": 1, "mime": "application/pdf", "refcount": 0}])
+        people, documents = [], []
+        for i in range(1, persons + 1):
+            people.append(
+                {
+                    "id": i,
+                    "project_id": 1 + i % projects,
+                    "nome": rng.choice(FIRST_NAMES),
+                    "cognome": f"{rng.choice(LAST_NAMES)}{i % 997}",
+                    "codice_fiscale": f"RSSMRA{i:08d}X{i % 10}",
+                    "titolo_studio_piu_recente": rng.choice(TITLES),
+                }
+            )
+            documents.append(
+                {
+                    "person_id": i,
+                    "kind": "cv",
+                    "blob_sha256": "0" * 64,
+                    "extracted_text": " ".join(rng.choices(words, cum_weights=cum_weights, k=150)),
+                }
+            )
+            if len(people) == 10000:
+                conn.execute(Person.__table__.insert(), people)
+                conn.execute(PersonDocument.__table__.insert(), documents)
+                people, documents = [], []
+        if people:
+            conn.execute(Person.__table__.insert(), people)
+            conn.execute(PersonDocument.__table__.insert(), documents)
+
+
+def measure(fn, repeat: int = 20) -> dict:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return {"p50_ms": round(statistics.median(timings), 3), "p95_ms": round(timings[int(len(timings) * 0.95) - 1], 3)}
+
+
+def main() -> None:
+    persons = int(sys.argv[1]) if len(sys.argv) > 1 else 300000
+    projects = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    seed(persons, projects)
+    start = time.perf_counter()
+    ensure_schema(engine)
+    build_s = time.perf_counter() - start
+    db = SessionLocal()
+    queries = {
+        "name_prefix": ("rossi12", None, None),
+        "codice_fiscale": ("RSSMRA0001234", "codice_fiscale", None),
+        "qualification": ("ingegneria", "titolo", 3),
+        "free_text_two_terms": ("saldat carrello", None, None),
+        "free_text_common_word": ("esperienza", "testo", None),
+        "free_text_in_project": ("elettric", "testo", 2),
+        "name_and_text": ("giulia patente", None, None),
+    }
+    report = {"persons": persons, "projects": projects, "index_build_s": round(build_s, 1), "queries": {}}
+    for label, (query, field, project_id) in queries.items():
+        hits = len(search_persons(db, query, field, project_id))
+        report["queries"][label] = {"hits": hits, **measure(lambda: search_persons(db, query, field, project_id))}
+    db.close()
+    print(json.dumps(report, indent=2))
+    DB_PATH.unlink()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+from pathlib import Path
+
+# Cold start of the application, each run in a fresh process against a fresh database:
+#   import_ms   `import main`
+#   live_ms     from launching uvicorn to the first 200 of /health/live
+#   ready_ms    same, /health/ready (schema migrated, default user, job runner)
+# plus which heavy modules `import main` loads. --max-import-ms / --max-ready-ms make the run
+# exit 1 when the median goes over budget, so it can guard the gains in CI.
+#   python benchmarks/bench_startup.py [--runs 5] [--max-import-ms 1000] [--max-ready-ms 3000]
+#                                      [--out run.json] [--baseline previous.json]
+
+ROOT = Path(__file__).resolve().parent.parent
+HEAVY_MODULES = ["openai", "pdfplumber", "pytesseract", "tesserocr", "PIL.Image", "ai_extraction", "ocr"]
+
+
+def environment() -> dict:
+    workdir = Path(tempfile.mkdtemp())
+    return {
+        **os.environ,
+        "DATABASE_URL": f"sqlite:///{workdir / 'bench_startup.db'}",
+        "UPLOAD_DIR": str(workdir / "uploads"),
+        "CACHE_PATH": str(workdir / "cache.db"),
+        "OPENAI_API_KEY": "stub",
+    }
+
+
+def import_run() -> dict:
+    script = (
+        "import json, sys, time\n"
+        "start = time.perf_counter()\n"
+        "import main\n"
+        "elapsed = time.perf_counter() - start\n"
+        f"print(json.dumps({{'seconds': elapsed, 'loaded': [m for m in {HEAVY_MODULES!r} if m in sys.modules]}}))\n"
+    )
+    output = subprocess.run(
+        [sys.executable, "-c", script], cwd=ROOT, env=environment(), capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+def _status(url: str) -> int:
+    try:
+        with urllib.request.urlopen(url, timeout=1) as response:
+            return response.status
+    except urllib.error.HTTPError as error:
+        return error.code
+    except OSError:
+        return 0
+
+
+def serve_run() -> dict:
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    base = f"http://127.0.0.1:{port}"
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT,
+        env=environment(),
+        stderr=subprocess.DEVNULL,
+    )
+    times = {}
+    try:
+        deadline = start + 60
+        while time.perf_counter() < deadline and len(times) < 2:
+            for name in ("live", "ready"):
+                if name not in times and _status(f"{base}/health/{name}") == 200:
+                    times[name] = time.perf_counter() - start
+            time.sleep(0.01)
+    finally:
+        process.terminate()
+        process.wait()
+    return times
+
+
+def median_ms(values) -> float:
+    return round(statistics.median(values) * 1000, 1)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--max-import-ms", type=float)
+    parser.add_argument("--max-ready-ms", type=float)
+    parser.add_argument("--out")
+    parser.add_argument("--baseline")
+    args = parser.parse_args()
+
+    imports = [import_run() for _ in range(args.runs)]
+    serves = [serve_run() for _ in range(args.runs)]
+    report = {
+        "python": sys.version.split()[0],
+        "cpus": os.cpu_count(),
+        "runs": args.runs,
+        "import_ms": median_ms([run["seconds"] for run in imports]),
+        "live_ms": median_ms([run.get("live", 60) for run in serves]),
+        "ready_ms": median_ms([run.get("ready", 60) for run in serves]),
+        "heavy_modules_at_import": imports[0]["loaded"],
+    }
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text())
+        report["vs_baseline_pct"] = {
+            key: round(100 * (report[key] - baseline[key]) / baseline[key], 1)
+            for key in ("import_ms", "live_ms", "ready_ms")
+            if baseline.get(key)
+        }
+    output = json.dumps(report, indent=2)
+    if args.out:
+        Path(args.out).write_text(output)
+    print(output)
+
+    over = [
+        f"{key} {report[key]} > {budget}"
+        for key, budget in (("import_ms", args.max_import_ms), ("ready_ms", args.max_ready_ms))
+        if budget is not None and report[key] > budget
+    ]
+    if over:
+        print("over budget: " + ", ".join(over), file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,360 @@
+import io
+import json
+import random
+import string
+import sys
+import zlib
+from datetime import date, timedelta
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+from PIL import Image, ImageChops, ImageDraw, ImageFilter, ImageFont
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import fast_extract  # noqa: E402
+
+# Synthetic candidates for the benchmarks: Italian identity cards (CIE), tessere sanitarie with a
+# valid codice fiscale and multi-page CVs, each rendered as a text PDF, a scanned PDF or a phone
+# photo, together with the ground truth of every field the pipeline extracts.
+#   python benchmarks/corpus.py <directory> [candidates]
+# writes one folder per candidate (the batch import naming convention) and truth.json.
+
+A4 = (595, 842)
+NOMI = [
+    ("MARIO", "M"), ("LUCA", "M"), ("GIUSEPPE", "M"), ("FRANCESCO", "M"), ("ANDREA", "M"), ("MARCO", "M"),
+    ("GIULIA", "F"), ("ANNA", "F"), ("FRANCESCA", "F"), ("CHIARA", "F"), ("SARA", "F"), ("ELENA", "F"),
+]
+COGNOMI = [
+    "ROSSI", "RUSSO", "FERRARI", "ESPOSITO", "BIANCHI", "ROMANO", "COLOMBO", "RICCI", "MARINO", "GRECO",
+    "BRUNO", "GALLO", "CONTI", "DE LUCA", "MANCINI", "COSTA", "GIORDANO", "RIZZO", "LOMBARDI", "MORETTI",
+]
+COMUNI = [
+    ("ROMA", "RM", "H501"), ("MILANO", "MI", "F205"), ("NAPOLI", "NA", "F839"), ("TORINO", "TO", "L219"),
+    ("PALERMO", "PA", "G273"), ("BARI", "BA", "A662"), ("FIRENZE", "FI", "D612"), ("BOLOGNA", "BO", "A944"),
+    ("SALERNO", "SA", "H703"), ("CAGLIARI", "CA", "B354"), ("PESCARA", "PE", "G482"), ("PERUGIA", "PG", "G478"),
+]
+VIE = ["VIA ROMA", "VIA GARIBALDI", "VIA MAZZINI", "CORSO ITALIA", "VIA DANTE", "PIAZZA DEL POPOLO", "VIA VERDI"]
+TITOLI = [
+    "Laurea in Economia", "Laurea in Ingegneria Informatica", "Diploma di Ragioneria",
+    "Diploma di Liceo Scientifico", "Laurea in Scienze della Formazione", "Qualifica professionale di Elettricista",
+]
+SITUAZIONI = ["Disoccupato", "Inoccupato", "Occupato", "Studente"]
+MANSIONI = [
+    "Impiegato amministrativo", "Addetto alle vendite", "Magazziniere", "Operatore call center",
+    "Tirocinio presso studio contabile", "Cameriere", "Assistente di segreteria", "Tecnico informatico",
+]
+ATTIVITA = (
+    "gestione della contabilita clienti e fornitori, archiviazione documentale, rapporti con il pubblico, "
+    "inserimento dati nel gestionale aziendale, organizzazione del magazzino e delle spedizioni, supporto "
+    "al coordinatore nelle attivita quotidiane, redazione di report mensili"
+).split(", ")
+PRIVACY = (
+    "Autorizzo il trattamento dei miei dati personali ai sensi del Regolamento UE 2016/679 (GDPR) "
+    "e del D.Lgs. 196/2003."
+)
+
+
+def font(size: int, bold: bool = False):
+    try:
+        return ImageFont.truetype("DejaVuSans-Bold.ttf" if bold else "DejaVuSans.ttf", size)
+    except OSError:
+        return ImageFont.load_default(size)
+
+
+def make_codice_fiscale(
+    rng: random.Random, birth: date, female: bool, cognome: str = "", nome: str = "", belfiore: str = ""
+) -> str:
+    # Random letters and place unless the real ones are given
+    if cognome and nome:
+        letters = fast_extract.cf_name_letters(nome, cognome)
+    else:
+        letters = "".join(rng.choice(string.ascii_uppercase) for _ in range(6))
+    day = birth.day + (40 if female else 0)
+    place = belfiore or f"{rng.choice('ABCDEFGHLM')}{rng.randint(1, 999):03d}"
+    body = f"{letters}{birth.year % 100:02d}{fast_extract.MONTHS[birth.month - 1]}{day:02d}{place}"
+    return body + fast_extract.cf_check_char(body)
+
+
+def make_person(rng: random.Random) -> Dict:
+    nome, sesso = rng.choice(NOMI)
+    cognome = rng.choice(COGNOMI)
+    comune, provincia, belfiore = rng.choice(COMUNI)
+    residenza = rng.choice(COMUNI)[0]
+    birth = date(1960, 1, 1) + timedelta(days=rng.randint(0, 365 * 38))
+    issued = date(2016, 1, 1) + timedelta(days=rng.randint(0, 365 * 8))
+    issued = issued.replace(day=min(issued.day, 28))
+    graduated = birth.replace(year=min(birth.year + rng.randint(19, 26), 2022), day=min(birth.day, 28))
+    indirizzo = f"{rng.choice(VIE)} {rng.randint(1, 180)}, {residenza}"
+    return {
+        "nome": nome,
+        "cognome": cognome,
+        "codice_fiscale": make_codice_fiscale(rng, birth, sesso == "F", cognome, nome, belfiore),
+        "data_nascita": birth.isoformat(),
+        "comune_nascita": comune,
+        "provincia_nascita": provincia,
+        "sesso": sesso,
+        "numero_documento": f"C{rng.choice('ABCD')}{rng.randint(0, 99999):05d}{rng.choice('ABCDEFGH')}{rng.choice('ABCDEFGH')}",
+        "ente_rilascio": f"COMUNE DI {residenza}",
+        "data_rilascio": issued.isoformat(),
+        "data_scadenza": issued.replace(year=issued.year + 10).isoformat(),
+        "indirizzo_residenza": indirizzo,
+        "indirizzo_domicilio": indirizzo if rng.random() < 0.7 else f"{rng.choice(VIE)} {rng.randint(1, 180)}, {rng.choice(COMUNI)[0]}",
+        "titolo_studio_piu_recente": {"titolo": rng.choice(TITOLI), "data_conseguimento": graduated.isoformat()},
+        "situazione_occupazionale": rng.choice(SITUAZIONI),
+        "privacy_clause_present": rng.random() < 0.85,
+        "firma_presente": rng.random() < 0.85,
+        "data_cv": (date(2024, 1, 1) + timedelta(days=rng.randint(0, 600))).isoformat(),
+    }
+
+
+def _day(iso: str) -> str:
+    return date.fromisoformat(iso).strftime("%d.%m.%Y")
+
+
+def _slash(iso: str) -> str:
+    return date.fromisoformat(iso).strftime("%d/%m/%Y")
+
+
+def render_lines(lines: List, size: Tuple[int, int], font_size: int, margin: int = 0, background: int = 255) -> Image.Image:
+    # lines: text, or (text, bold); every line advances by 1.6 font sizes
+    image = Image.new("L", size, background)
+    draw = ImageDraw.Draw(image)
+    regular, bold = font(font_size), font(font_size, bold=True)
+    margin = margin or size[0] // 12
+    y = margin
+    for line in lines:
+        text, strong = line if isinstance(line, tuple) else (line, False)
+        draw.text((margin, y), text, fill=0, font=bold if strong else regular)
+        y += int(font_size * 1.6)
+    return image
+
+
+def identity_card(person: Dict) -> Image.Image:
+    # Front and back of a CIE one above the other, 85.6 x 54 mm each at about 500 dpi
+    front = render_lines(
+        [
+            ("REPUBBLICA ITALIANA", True),
+            "CARTA DI IDENTITA / IDENTITY CARD",
+            person["ente_rilascio"],
+            f"COGNOME / SURNAME  {person['cognome']}",
+            f"NOME / NAME  {person['nome']}",
+            "LUOGO E DATA DI NASCITA / PLACE AND DATE OF BIRTH",
+            f"{person['comune_nascita']} ({person['provincia_nascita']}) {_day(person['data_nascita'])}",
+            f"SESSO / SEX  {person['sesso']}",
+            f"EMISSIONE / ISSUING  {_day(person['data_rilascio'])}",
+            f"SCADENZA / EXPIRY  {_day(person['data_scadenza'])}",
+            (person["numero_documento"], True),
+        ],
+        (1700, 1080), 40, margin=70, background=235,
+    )
+    back = render_lines(
+        [
+            f"CODICE FISCALE / FISCAL CODE  {person['codice_fiscale']}",
+            "INDIRIZZO DI RESIDENZA / RESIDENCE",
+            person["indirizzo_residenza"],
+        ],
+        (1700, 1080), 40, margin=70, background=235,
+    )
+    card = Image.new("L", (1700, 2260), 255)
+    card.paste(front, (0, 0))
+    card.paste(back, (0, 1180))
+    return card
+
+
+def tessera_sanitaria(person: Dict) -> Image.Image:
+    cf = person["codice_fiscale"]
+    return render_lines(
+        [
+            ("TESSERA SANITARIA", True),
+            "Codice fiscale",
+            (f"{cf[:6]} {cf[6:11]} {cf[11:]}", True),
+            "Cognome",
+            person["cognome"],
+            "Nome",
+            person["nome"],
+            f"Data di nascita  {_slash(person['data_nascita'])}",
+        ],
+        (1700, 1080), 48, margin=80, background=230,
+    )
+
+
+def cv_lines(person: Dict, rng: random.Random, experiences: int = 0) -> List:
+    titolo = person["titolo_studio_piu_recente"]
+    lines = [
+        ("CURRICULUM VITAE", True),
+        "",
+        ("INFORMAZIONI PERSONALI", True),
+        f"Nome: {person['nome'].title()}",
+        f"Cognome: {person['cognome'].title()}",
+        f"Data di nascita: {_slash(person['data_nascita'])}",
+        f"Residenza: {person['indirizzo_residenza'].title()}",
+        f"Domicilio: {person['indirizzo_domicilio'].title()}",
+        f"Situazione occupazionale: {person['situazione_occupazionale']}",
+        "",
+        ("ISTRUZIONE E FORMAZIONE", True),
+        f"Titolo di studio: {titolo['titolo']} conseguito il {_slash(titolo['data_conseguimento'])}",
+        "",
+        ("ESPERIENZA PROFESSIONALE", True),
+    ]
+    year = int(titolo["data_conseguimento"][:4])
+    for _ in range(experiences or rng.randint(4, 12)):
+        start = rng.randint(year, 2023)
+        lines.append(f"{start} - {min(start + rng.randint(1, 4), 2024)}  {rng.choice(MANSIONI)}")
+        lines.extend(f"    {activity}" for activity in rng.sample(ATTIVITA, 3))
+    lines += ["", ("COMPETENZE", True), "Lingua inglese: livello B1", "Patente europea del computer (ECDL)", ""]
+    if person["privacy_clause_present"]:
+        lines += [PRIVACY[:95], PRIVACY[95:]]
+    lines.append(f"Luogo e data: {person['comune_nascita'].title()}, {_slash(person['data_cv'])}")
+    lines.append(f"Firma: {person['nome'].title()} {person['cognome'].title()}" if person["firma_presente"] else "Firma:")
+    return lines
+
+
+def photograph(image: Image.Image, rng: random.Random, size=(3000, 4000)) -> Image.Image:
+    # Shot with a phone from above: on a table, tilted, uneven lighting, sensor noise and blur
+    scale = min(size[0] * 0.85 / image.width, size[1] * 0.85 / image.height)
+    subject = image.resize((int(image.width * scale), int(image.height * scale)), Image.BICUBIC)
+    subject = subject.rotate(rng.uniform(-4, 4), resample=Image.BICUBIC, expand=True, fillcolor=110)
+    photo = Image.new("L", size, 110)
+    photo.paste(subject, ((size[0] - subject.width) // 2, (size[1] - subject.height) // 2))
+    light = Image.linear_gradient("L").rotate(rng.choice([0, 90, 180, 270])).resize(size)
+    photo = ImageChops.multiply(photo, light.point(lambda value: 150 + value * 105 // 255))
+    noise = Image.effect_noise(size, 18).point(lambda value: value - 128)
+    photo = Image.blend(photo, noise.convert("L"), 0.06).filter(ImageFilter.GaussianBlur(1.2))
+    return photo.convert("RGB")
+
+
+def scan(image: Image.Image, rng: random.Random) -> Image.Image:
+    return image.rotate(rng.uniform(-1.5, 1.5), resample=Image.BICUBIC, fillcolor=255)
+
+
+def jpeg(image: Image.Image, quality: int = 80) -> bytes:
+    buffer = io.BytesIO()
+    image.convert("L").save(buffer, "JPEG", quality=quality)
+    return buffer.getvalue()
+
+
+def write_pdf(path: Path, pages) -> None:
+    # pages: [(size, [(x, y, size, text)], [(jpeg, width, height, (x, y, w, h))])], PDF coordinates
+    objects = []
+
+    def add(body: bytes) -> int:
+        objects.append(body)
+        return len(objects)
+
+    font_id = add(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+    page_ids = []
+    pages_id = len(objects) + 1 + sum(2 + len(images) for _, _, images in pages)
+    for (width, height), lines, images in pages:
+        stream = []
+        xobjects = []
+        for number, (data, pixels_w, pixels_h, (x, y, w, h)) in enumerate(images):
+            image_id = add(
+                f"<< /Type /XObject /Subtype /Image /Width {pixels_w} /Height {pixels_h} /ColorSpace /DeviceGray "
+                f"/BitsPerComponent 8 /Filter /DCTDecode /Length {len(data)} >>\nstream\n".encode() + data
+                + b"\nendstream"
+            )
+            xobjects.append(f"/Im{number} {image_id} 0 R")
+            stream.append(f"q {w} 0 0 {h} {x} {y} cm /Im{number} Do Q")
+        for x, y, size, text in lines:
+            text = text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+            stream.append(f"BT /F1 {size} Tf {x} {y} Td ({text}) Tj ET")
+        content = zlib.compress("\n".join(stream).encode("latin-1"))
+        content_id = add(f"<< /Length {len(content)} /Filter /FlateDecode >>\nstream\n".encode() + content + b"\nendstream")
+        page_ids.append(
+            add(
+                f"<< /Type /Page /Parent {pages_id} 0 R /MediaBox [0 0 {width} {height}] /Contents {content_id} 0 R "
+                f"/Resources << /Font << /F1 {font_id} 0 R >> /XObject << {' '.join(xobjects)} >> >> >>".encode()
+            )
+        )
+    kids = " ".join(f"{page_id} 0 R" for page_id in page_ids)
+    assert add(f"<< /Type /Pages /Kids [{kids}] /Count {len(page_ids)} >>".encode()) == pages_id
+    catalog_id = add(f"<< /Type /Catalog /Pages {pages_id} 0 R >>".encode())
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += f"{number} 0 obj\n".encode() + body + b"\nendobj\n"
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    out += "".join(f"{offset:010d} 00000 n \n" for offset in offsets).encode()
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root {catalog_id} 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    path.write_bytes(bytes(out))
+
+
+def text_pdf(path: Path, lines: List, per_page: int = 45) -> None:
+    pages = []
+    for start in range(0, len(lines), per_page):
+        chunk = [line[0] if isinstance(line, tuple) else line for line in lines[start:start + per_page]]
+        pages.append((A4, [(60, A4[1] - 70 - 16 * number, 10, text) for number, text in enumerate(chunk) if text], []))
+    write_pdf(path, pages)
+
+
+def scanned_pdf(path: Path, images: List[Image.Image], rng: random.Random, dpi: int = 200) -> None:
+    pages = []
+    for image in images:
+        # Fitted to the width of an A4 sheet, as a flatbed scanner would
+        pixels = (A4[0] * dpi // 72, A4[1] * dpi // 72)
+        sheet = Image.new("L", pixels, 255)
+        fitted = image.copy()
+        fitted.thumbnail((pixels[0] - 2 * dpi // 4, pixels[1] - 2 * dpi // 4))
+        sheet.paste(fitted, (dpi // 4, dpi // 4))
+        pages.append((A4, [], [(jpeg(scan(sheet, rng)), *pixels, (0, 0, *A4))]))
+    write_pdf(path, pages)
+
+
+def cv_pages(lines: List, per_page: int = 45) -> List[Image.Image]:
+    return [render_lines(lines[start:start + per_page], (1654, 2339), 26, margin=140) for start in range(0, len(lines), per_page)]
+
+
+def write_candidate(directory: Path, person: Dict, rng: random.Random) -> Dict[str, Path]:
+    # One folder per candidate with cv, documento_identita and tessera_sanitaria, each in a
+    # randomly chosen format; returns {kind: path} with the pipeline's kinds (cv, doc, tess)
+    directory.mkdir(parents=True, exist_ok=True)
+    files = {}
+    cv_format = rng.choice(["text", "text", "scan", "photo"])
+    if cv_format == "text":
+        files["cv"] = directory / "cv.pdf"
+        text_pdf(files["cv"], cv_lines(person, rng))
+    elif cv_format == "scan":
+        files["cv"] = directory / "cv.pdf"
+        scanned_pdf(files["cv"], cv_pages(cv_lines(person, rng)), rng)
+    else:
+        # A one-page CV, photographed
+        files["cv"] = directory / "cv.jpg"
+        photograph(cv_pages(cv_lines(person, rng, experiences=2))[0], rng).save(files["cv"], quality=85)
+    for kind, name, image in (
+        ("doc", "documento_identita", identity_card(person)),
+        ("tess", "tessera_sanitaria", tessera_sanitaria(person)),
+    ):
+        if rng.random() < 0.5:
+            files[kind] = directory / f"{name}.jpg"
+            photograph(image, rng).save(files[kind], quality=85)
+        else:
+            files[kind] = directory / f"{name}.pdf"
+            scanned_pdf(files[kind], [image], rng, dpi=300)
+    return files
+
+
+def build(directory: Path, count: int, seed: int = 1) -> List[Tuple[Dict[str, Path], Dict]]:
+    rng = random.Random(seed)
+    candidates = []
+    for number in range(count):
+        person = make_person(rng)
+        folder = directory / f"{person['cognome'].lower().replace(' ', '')}_{person['nome'].lower()}_{number}"
+        candidates.append((write_candidate(folder, person, rng), person))
+    return candidates
+
+
+def main() -> None:
+    directory = Path(sys.argv[1])
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    candidates = build(directory, count)
+    truth = {files["cv"].parent.name: person for files, person in candidates}
+    (directory / "truth.json").write_text(json.dumps(truth, indent=2))
+    print(f"{count} candidati in {directory}")
+
+
+if __name__ == "__main__":
+    main()
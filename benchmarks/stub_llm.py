@@ -0,0 +1,162 @@
+import asyncio
+import json
+import os
+import re
+import time
+import uuid
+
+from fastapi import FastAPI, Request, Response
+
+# Minimal stand-in for the OpenAI Responses endpoint, for local runs and benchmarks:
+#   uvicorn benchmarks.stub_llm:app --port 8001
+#   OPENAI_BASE_URL=http://127.0.0.1:8001/v1 OPENAI_API_KEY=stub uvicorn main:app
+# STUB_LLM_LATENCY_MS adds a fixed delay, STUB_LLM_FAIL_EVERY makes every Nth call return 500,
+# STUB_LLM_INCOMPLETE_EVERY makes every Nth answer stop at max_output_tokens (JSON cut short).
+# STUB_LLM_MODE=read answers with the labelled values found in the document text (the layout of
+# benchmarks/corpus.py) instead of a fixed person, so extraction accuracy follows the OCR output.
+
+STUB_LLM_LATENCY_MS = float(os.getenv("STUB_LLM_LATENCY_MS", "0"))
+STUB_LLM_FAIL_EVERY = int(os.getenv("STUB_LLM_FAIL_EVERY", "0"))
+STUB_LLM_INCOMPLETE_EVERY = int(os.getenv("STUB_LLM_INCOMPLETE_EVERY", "0"))
+STUB_LLM_MODE = os.getenv("STUB_LLM_MODE", "fixed")
+
+RESPONSES = {
+    "DOCUMENTO DI IDENTITÀ": {
+        "nome": "Mario",
+        "cognome": "Rossi",
+        "numero_documento": "CA00000AA",
+        "ente_rilascio": "Comune di Roma",
+        "data_nascita": "1980-01-01",
+        "comune_nascita": "Roma",
+        "provincia_nascita": "RM",
+        "sesso": "M",
+        "data_rilascio": "2020-01-01",
+        "data_scadenza": "2030-01-01",
+        "indirizzo_residenza": "Via Roma 1, Roma",
+    },
+    "TESSERA SANITARIA": {"codice_fiscale": "RSSMRA80A01H501U"},
+    "CV": {
+        "nome": "Mario",
+        "cognome": "Rossi",
+        "indirizzo_domicilio": "Via Roma 1, Roma",
+        "indirizzo_residenza": "Via Roma 1, Roma",
+        "titolo_studio_piu_recente": {"titolo": "Laurea in Economia", "data_conseguimento": "2005-07-15"},
+        "situazione_occupazionale": "Disoccupato",
+        "privacy_clause_present": True,
+        "firma_presente": True,
+        "data_cv": "2024-01-10",
+    },
+}
+
+DATE = r"(\d{1,2})\s?[./-]\s?(\d{1,2})\s?[./-]\s?(\d{4})"
+# field: pattern whose first group is the value; the value may follow the label on the next line
+READ_PATTERNS = {
+    "nome": r"\bNOME(?:\s*/\s*NAME)?\s*:?\s*([^\n]+)",
+    "cognome": r"\bCOGNOME(?:\s*/\s*SURNAME)?\s*:?\s*([^\n]+)",
+    "numero_documento": r"\b([A-Z]{2}\d{5}[A-Z]{2})\b",
+    "ente_rilascio": r"\b(COMUNE DI [^\n]+)",
+    "comune_nascita": r"BIRTH\s*:?\s*([A-Z' ]+?)\s*\(",
+    "provincia_nascita": r"BIRTH\s*:?\s*[A-Z' ]+?\s*\(([A-Z]{2})\)",
+    "sesso": r"\bSESSO(?:\s*/\s*SEX)?\s*:?\s*([MF])\b",
+    "data_nascita": rf"(?:NASCITA|BIRTH)[^\d]*?{DATE}",
+    "data_rilascio": rf"(?:EMISSIONE|ISSUING)[^\d]*?{DATE}",
+    "data_scadenza": rf"(?:SCADENZA|EXPIRY)[^\d]*?{DATE}",
+    "indirizzo_residenza": r"\bRESIDENZA(?:\s*/\s*RESIDENCE)?\s*:?\s*([^\n]+)",
+    "indirizzo_domicilio": r"\bDOMICILIO\s*:?\s*([^\n]+)",
+    "codice_fiscale": r"\b([A-Z]{6}\s?[0-9A-Z]{5}\s?[0-9A-Z]{5})\b",
+    "situazione_occupazionale": r"SITUAZIONE OCCUPAZIONALE\s*:?\s*([^\n]+)",
+    "data_cv": rf"LUOGO E DATA\s*:?[^\n]*?{DATE}",
+}
+TITOLO_PATTERN = rf"TITOLO DI STUDIO\s*:?\s*([^\n]+?)\s+CONSEGUIT[OA] IL\s*{DATE}"
+PRIVACY_PATTERN = r"TRATTAMENTO DEI (?:MIEI )?DATI PERSONALI"
+FIRMA_PATTERN = r"\bFIRMA\s*:?[ \t]*[A-Z]{2,}"
+
+app = FastAPI(title="Stub LLM")
+app.state.calls = 0
+
+
+def _iso(day: str, month: str, year: str) -> str:
+    return f"{year}-{int(month):02d}-{int(day):02d}"
+
+
+def read_fields(prompt: str) -> dict:
+    fields = re.findall(r"^- (\w+)", prompt, re.MULTILINE)
+    text = prompt.split("\nTesto ", 1)[-1].split("\n", 1)[-1]
+    flags = re.IGNORECASE | re.MULTILINE
+    data = {}
+    for field in fields:
+        if field == "titolo_studio_piu_recente":
+            match = re.search(TITOLO_PATTERN, text, flags)
+            data[field] = {"titolo": match.group(1).strip(), "data_conseguimento": _iso(*match.groups()[1:])} if match else {}
+        elif field == "privacy_clause_present":
+            data[field] = bool(re.search(PRIVACY_PATTERN, text, flags))
+        elif field == "firma_presente":
+            data[field] = bool(re.search(FIRMA_PATTERN, text, flags))
+        elif field in READ_PATTERNS:
+            match = re.search(READ_PATTERNS[field], text, flags)
+            if not match:
+                data[field] = ""
+            elif len(match.groups()) == 3:
+                data[field] = _iso(*match.groups())
+            else:
+                data[field] = match.group(1).strip()
+    if data.get("codice_fiscale"):
+        data["codice_fiscale"] = data["codice_fiscale"].replace(" ", "").upper()
+    return data
+
+
+def respond(prompt: str) -> dict:
+    if STUB_LLM_MODE == "read":
+        return read_fields(prompt)
+    for label, payload in RESPONSES.items():
+        if f"estrae dati da un {label}" in prompt:
+            return payload
+    return {}
+
+
+def response_body(model: str, prompt: str, text: str) -> dict:
+    input_tokens = max(1, len(prompt) // 4)
+    output_tokens = max(1, len(text) // 4)
+    return {
+        "id": f"resp_{uuid.uuid4().hex}",
+        "object": "response",
+        "created_at": int(time.time()),
+        "status": "completed",
+        "model": model,
+        "output": [
+            {
+                "type": "message",
+                "id": f"msg_{uuid.uuid4().hex}",
+                "status": "completed",
+                "role": "assistant",
+                "content": [{"type": "output_text", "text": text, "annotations": []}],
+            }
+        ],
+        "parallel_tool_calls": True,
+        "tool_choice": "auto",
+        "tools": [],
+        "usage": {
+            "input_tokens": input_tokens,
+            "input_tokens_details": {"cached_tokens": 0},
+            "output_tokens": output_tokens,
+            "output_tokens_details": {"reasoning_tokens": 0},
+            "total_tokens": input_tokens + output_tokens,
+        },
+    }
+
+
+@app.post("/v1/responses")
+async def responses(request: Request):
+    body = await request.json()
+    app.state.calls += 1
+    if STUB_LLM_LATENCY_MS:
+        await asyncio.sleep(STUB_LLM_LATENCY_MS / 1000)
+    if STUB_LLM_FAIL_EVERY and app.state.calls % STUB_LLM_FAIL_EVERY == 0:
+        return Response(status_code=500)
+    prompt = body.get("input", "")
+    text = json.dumps(respond(prompt))
+    if STUB_LLM_INCOMPLETE_EVERY and app.state.calls % STUB_LLM_INCOMPLETE_EVERY == 0:
+        response = response_body(body.get("model", "stub"), prompt, text[: len(text) // 2])
+        response.update(status="incomplete", incomplete_details={"reason": "max_output_tokens"})
+        return response
+    return response_body(body.get("model", "stub"), prompt, text)
@@ -0,0 +1,208 @@
+import os
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+CACHE_PATH = os.getenv("CACHE_PATH", "cache.db")
+EVICT_EVERY = 50
+
+
+class DiskCache:
+    # SQLite-backed key/value store shared by every process on the host; WAL keeps
+    # concurrent readers from blocking the writer and busy_timeout serialises writers.
+
+    def __init__(self, namespace: str, max_bytes: int, max_age: float, path: str = CACHE_PATH):
+        self.namespace = namespace
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.path = path
+        self._local = threading.local()
+        self._sets = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None or getattr(self._local, "pid", None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache_entries ("
+                " namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL,"
+                " size INTEGER NOT NULL, created_at REAL NOT NULL, accessed_at REAL NOT NULL,"
+                " PRIMARY KEY (namespace, key))"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS ix_cache_entries_accessed ON cache_entries (namespace, accessed_at)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache_stats ("
+                " namespace TEXT PRIMARY KEY, hits INTEGER NOT NULL DEFAULT 0, misses INTEGER NOT NULL DEFAULT 0)"
+            )
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _count(self, conn: sqlite3.Connection, column: str) -> None:
+        conn.execute(
+            f"INSERT INTO cache_stats (namespace, {column}) VALUES (?, 1) "
+            f"ON CONFLICT(namespace) DO UPDATE SET {column} = {column} + 1",
+            (self.namespace,),
+        )
+
+    def get(self, key: str) -> Optional[str]:
+        conn = self._connect()
+        now = time.time()
+        with conn:
+            row = conn.execute(
+                "SELECT value, created_at FROM cache_entries WHERE namespace = ? AND key = ?",
+                (self.namespace, key),
+            ).fetchone()
+            if row is None or now - row[1] > self.max_age:
+                self._count(conn, "misses")
+                return None
+            conn.execute(
+                "UPDATE cache_entries SET accessed_at = ? WHERE namespace = ? AND key = ?",
+                (now, self.namespace, key),
+            )
+            self._count(conn, "hits")
+        return row[0]
+
+    def set(self, key: str, value: str) -> None:
+        conn = self._connect()
+        now = time.time()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO cache_entries (namespace, key, value, size, created_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (self.namespace, key, value, len(value.encode("utf-8")), now, now),
+            )
+        self._sets += 1
+        if self._sets % EVICT_EVERY == 0:
+            self.evict()
+
+    def evict(self) -> int:
+        conn = self._connect()
+        with conn:
+            removed = conn.execute(
+                "DELETE FROM cache_entries WHERE namespace = ? AND created_at < ?",
+                (self.namespace, time.time() - self.max_age),
+            ).rowcount
+            total = conn.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM cache_entries WHERE namespace = ?", (self.namespace,)
+            ).fetchone()[0]
+            # Least recently used entries go first until the namespace fits its budget again
+            while total > self.max_bytes:
+                rows = conn.execute(
+                    "SELECT key, size FROM cache_entries WHERE namespace = ? ORDER BY accessed_at LIMIT 100",
+                    (self.namespace,),
+                ).fetchall()
+                if not rows:
+                    break
+                for key, size in rows:
+                    conn.execute("DELETE FROM cache_entries WHERE namespace = ? AND key = ?", (self.namespace, key))
+                    removed += 1
+                    total -= size
+                    if total <= self.max_bytes:
+                        break
+        return removed
+
+    def invalidate(self, key: Optional[str] = None) -> int:
+        conn = self._connect()
+        with conn:
+            if key is None:
+                return conn.execute("DELETE FROM cache_entries WHERE namespace = ?", (self.namespace,)).rowcount
+            return conn.execute(
+                "DELETE FROM cache_entries WHERE namespace = ? AND key = ?", (self.namespace, key)
+            ).rowcount
+
+    def stats(self) -> Dict[str, int]:
+        conn = self._connect()
+        hits, misses = conn.execute(
+            "SELECT hits, misses FROM cache_stats WHERE namespace = ?", (self.namespace,)
+        ).fetchone() or (0, 0)
+        entries, size = conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache_entries WHERE namespace = ?", (self.namespace,)
+        ).fetchone()
+        return {"hits": hits, "misses": misses, "entries": entries, "bytes": size}
+
+
+class MemoryCache:
+    # In-process LRU bounded in bytes, for values keyed so that they never go stale (the key
+    # changes with the data instead) and cheap to lose: every worker process has its own.
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, bytes]" = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: str, value: bytes) -> None:
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._size -= len(previous)
+            self._entries[key] = value
+            self._size += len(value)
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+
+    def invalidate(self) -> int:
+        with self._lock:
+            removed = len(self._entries)
+            self._entries.clear()
+            self._size = 0
+            return removed
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries), "bytes": self._size}
+
+
+ocr_cache = DiskCache(
+    "ocr",
+    max_bytes=int(os.getenv("OCR_CACHE_MAX_BYTES", str(512 * 1024 * 1024))),
+    max_age=float(os.getenv("OCR_CACHE_MAX_AGE_DAYS", "90")) * 86400,
+)
+
+extraction_cache = DiskCache(
+    "extraction",
+    max_bytes=int(os.getenv("EXTRACTION_CACHE_MAX_BYTES", str(64 * 1024 * 1024))),
+    max_age=float(os.getenv("EXTRACTION_CACHE_MAX_AGE_DAYS", "90")) * 86400,
+)
+
+# Rendered pages, see http_cache.py; not in CACHES, which the command below reads from the disk
+page_cache = MemoryCache(max_bytes=int(os.getenv("PAGE_CACHE_MAX_BYTES", str(32 * 1024 * 1024))))
+
+CACHES = {"ocr": ocr_cache, "extraction": extraction_cache}
+
+
+if __name__ == "__main__":
+    # python cache.py stats|clear|evict [namespace]
+    command = sys.argv[1] if len(sys.argv) > 1 else "stats"
+    names = sys.argv[2:] or list(CACHES)
+    for name in names:
+        cache = CACHES[name]
+        if command == "clear":
+            print(name, "removed", cache.invalidate())
+        elif command == "evict":
+            print(name, "removed", cache.evict())
+        else:
+            print(name, cache.stats())
@@ -0,0 +1,223 @@
+import os
+import sys
+from collections import defaultdict
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from sqlalchemy import func, update
+from sqlalchemy.orm import Session
+
+import fast_extract
+from database import SessionLocal
+from models import Candidate, Job, Person, PersonDocument, register_listeners
+
+# A candidate is the same person across projects, keyed by a valid codice fiscale; every
+# enrolment (a Person, one per project) links to it. When a returning candidate's health card
+# matches and the identity document is the same file as last time (blob hash), the job takes the
+# document's text and the identity fields from here and only reads and extracts the new CV.
+#   python candidates.py merge   link the existing persons to their candidate and fold the
+#                                duplicates (same codice fiscale twice in a project)
+
+CANDIDATE_REUSE_ENABLED = os.getenv("CANDIDATE_REUSE_ENABLED", "1") == "1"
+
+IDENTITY_FIELDS = [
+    "nome",
+    "cognome",
+    "data_nascita",
+    "comune_nascita",
+    "provincia_nascita",
+    "sesso",
+    "numero_documento",
+    "ente_rilascio",
+    "data_rilascio",
+    "data_scadenza",
+    "indirizzo_residenza",
+]
+
+
+class KnownDocument(NamedTuple):
+    codice_fiscale: str
+    text: str
+
+
+def normalise_codice_fiscale(value: Optional[str]) -> Optional[str]:
+    codice_fiscale = (value or "").strip().upper()
+    return codice_fiscale if fast_extract.is_valid_codice_fiscale(codice_fiscale) else None
+
+
+def known_document(doc_sha256: Optional[str]) -> Optional[KnownDocument]:
+    # The candidate an identity document was last read for, with the text read then
+    if not CANDIDATE_REUSE_ENABLED or not doc_sha256:
+        return None
+    with SessionLocal() as db:
+        candidate = db.query(Candidate).filter_by(doc_sha256=doc_sha256).first()
+        if candidate is None:
+            return None
+        text = (
+            db.query(PersonDocument.extracted_text)
+            .filter(
+                PersonDocument.blob_sha256 == doc_sha256,
+                PersonDocument.kind == "doc",
+                PersonDocument.extracted_text.isnot(None),
+            )
+            .limit(1)
+            .scalar()
+        )
+        return KnownDocument(candidate.codice_fiscale, text) if text is not None else None
+
+
+def reusable_identity(tessera_text: str, doc_sha256: Optional[str]) -> Optional[Dict]:
+    # Identity fields of the candidate on the health card, if the identity document is unchanged
+    if not CANDIDATE_REUSE_ENABLED or not doc_sha256:
+        return None
+    codice_fiscale = fast_extract.find_codice_fiscale(tessera_text or "")
+    if codice_fiscale is None:
+        return None
+    with SessionLocal() as db:
+        candidate = db.query(Candidate).filter_by(codice_fiscale=codice_fiscale).first()
+        if candidate is None or candidate.doc_sha256 != doc_sha256:
+            return None
+        return {"codice_fiscale": codice_fiscale, **{field: getattr(candidate, field) or "" for field in IDENTITY_FIELDS}}
+
+
+def upsert_candidate(db: Session, data: dict, doc_sha256: Optional[str]) -> Optional[Candidate]:
+    # The latest enrolment wins: its identity fields and document replace the stored ones.
+    # Flushed, so that a second enrolment in the same transaction finds it
+    codice_fiscale = normalise_codice_fiscale(data.get("codice_fiscale"))
+    if codice_fiscale is None:
+        return None
+    candidate = db.query(Candidate).filter_by(codice_fiscale=codice_fiscale).first()
+    if candidate is None:
+        candidate = Candidate(codice_fiscale=codice_fiscale)
+        db.add(candidate)
+    for field in IDENTITY_FIELDS:
+        setattr(candidate, field, data.get(field) or "")
+    candidate.doc_sha256 = doc_sha256
+    db.flush()
+    return candidate
+
+
+def _fold(db: Session, duplicate: Person, keep: Person) -> None:
+    # The jobs follow the kept enrolment, so do the documents of a kind it lacks; the rest go
+    # with the duplicate
+    db.query(Job).filter(Job.person_id == duplicate.id).update({Job.person_id: keep.id}, synchronize_session=False)
+    kinds = {document.kind for document in keep.documents}
+    for document in list(duplicate.documents):
+        if document.kind not in kinds:
+            document.person = keep
+            kinds.add(document.kind)
+    db.delete(duplicate)
+
+
+MERGE_BATCH_SIZE = int(os.getenv("MERGE_BATCH_SIZE", "1000"))
+
+
+def _cf_key():
+    return func.upper(func.trim(Person.codice_fiscale))
+
+
+def _doc_hashes(db: Session, person_ids: List[int]) -> Dict[int, str]:
+    return dict(
+        db.query(PersonDocument.person_id, PersonDocument.blob_sha256).filter(
+            PersonDocument.kind == "doc", PersonDocument.person_id.in_(person_ids)
+        )
+    )
+
+
+def _merge_shared(db: Session) -> Tuple[int, int]:
+    # The codici fiscali with more than one enrolment, found by the database; only their persons
+    # are loaded, a chunk of codes at a time
+    shared = (
+        db.query(_cf_key())
+        .filter(func.length(_cf_key()) == 16)
+        .group_by(_cf_key())
+        .having(func.count(Person.id) > 1)
+    )
+    codes = [code for (code,) in shared if normalise_codice_fiscale(code)]
+    linked = folded = 0
+    for start in range(0, len(codes), MERGE_BATCH_SIZE):
+        groups: Dict[str, List[Person]] = defaultdict(list)
+        for person in (
+            db.query(Person)
+            .filter(_cf_key().in_(codes[start:start + MERGE_BATCH_SIZE]))
+            .order_by(Person.created_at, Person.id)
+        ):
+            groups[normalise_codice_fiscale(person.codice_fiscale)].append(person)
+        doc_hashes = _doc_hashes(db, [persons[-1].id for persons in groups.values()])
+        for codice_fiscale, persons in groups.items():
+            latest = persons[-1]
+            data = {"codice_fiscale": codice_fiscale, **{field: getattr(latest, field) for field in IDENTITY_FIELDS}}
+            candidate = upsert_candidate(db, data, doc_hashes.get(latest.id))
+            by_project: Dict[int, List[Person]] = defaultdict(list)
+            for person in persons:
+                by_project[person.project_id].append(person)
+            for enrolments in by_project.values():
+                # The most recent enrolment in the project is kept
+                keep = enrolments[-1]
+                for duplicate in enrolments[:-1]:
+                    _fold(db, duplicate, keep)
+                    folded += 1
+                if keep.candidate_id != candidate.id:
+                    keep.candidate_id = candidate.id
+                    linked += 1
+        db.commit()
+        db.expunge_all()
+    return linked, folded
+
+
+def _link_single(db: Session) -> int:
+    # The remaining unlinked persons have a codice fiscale of their own: keyset batches of
+    # columns, their candidates created in one flush and linked with one bulk UPDATE
+    linked = last_id = 0
+    columns = [getattr(Person, field) for field in IDENTITY_FIELDS]
+    while True:
+        rows = (
+            db.query(Person.id, Person.codice_fiscale, *columns)
+            .filter(Person.id > last_id, Person.candidate_id.is_(None), func.length(_cf_key()) == 16)
+            .order_by(Person.id)
+            .limit(MERGE_BATCH_SIZE)
+            .all()
+        )
+        if not rows:
+            return linked
+        last_id = rows[-1].id
+        rows = [row for row in rows if normalise_codice_fiscale(row.codice_fiscale)]
+        codes = {row.id: normalise_codice_fiscale(row.codice_fiscale) for row in rows}
+        candidates = {
+            candidate.codice_fiscale: candidate
+            for candidate in db.query(Candidate).filter(Candidate.codice_fiscale.in_(set(codes.values())))
+        }
+        doc_hashes = _doc_hashes(db, list(codes))
+        for row in rows:
+            candidate = candidates.get(codes[row.id])
+            if candidate is None:
+                candidate = candidates[codes[row.id]] = Candidate(codice_fiscale=codes[row.id])
+                db.add(candidate)
+            for field in IDENTITY_FIELDS:
+                setattr(candidate, field, getattr(row, field) or "")
+            candidate.doc_sha256 = doc_hashes.get(row.id)
+        db.flush()
+        if rows:
+            db.execute(update(Person), [{"id": row.id, "candidate_id": candidates[codes[row.id]].id} for row in rows])
+        db.commit()
+        db.expunge_all()
+        linked += len(rows)
+
+
+def merge_duplicates(db: Session) -> Dict[str, int]:
+    linked, folded = _merge_shared(db)
+    linked += _link_single(db)
+    return {"candidates": db.query(func.count(Candidate.id)).scalar(), "linked": linked, "folded": folded}
+
+
+def main(argv: List[str]) -> None:
+    if argv[:1] != ["merge"]:
+        print("usage: python candidates.py merge")
+        sys.exit(2)
+    register_listeners()
+    with SessionLocal() as db:
+        report = merge_duplicates(db)
+    print(f"{report['candidates']} candidates, {report['linked']} persons linked, {report['folded']} duplicates folded")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
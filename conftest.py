@@ -0,0 +1,33 @@
+import os
+import tempfile
+
+import pytest
+
+# The modules read their settings at import time: a scratch database, caches and upload directory
+WORKDIR = tempfile.mkdtemp(prefix="progetto-tests-")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(WORKDIR, 'test.db')}")
+os.environ.setdefault("CACHE_PATH", os.path.join(WORKDIR, "cache.db"))
+os.environ.setdefault("UPLOAD_DIR", os.path.join(WORKDIR, "uploads"))
+os.environ.setdefault("METRICS_ENABLED", "0")
+os.environ.setdefault("PREWARM_ENABLED", "0")
+
+
+@pytest.fixture(scope="session")
+def migrated():
+    import migrations
+    from models import register_listeners
+
+    register_listeners()
+    migrations.migrate()
+
+
+@pytest.fixture
+def project(migrated):
+    from database import SessionLocal
+    from models import Project
+
+    with SessionLocal() as db:
+        created = Project(name=f"Progetto {os.urandom(4).hex()}")
+        db.add(created)
+        db.commit()
+        return created.id
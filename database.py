@@ -1,18 +1,131 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, declarative_base
+import asyncio
 import os
+from typing import Callable, Optional, TypeVar
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker, declarative_base
 
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./app.db")
 
+# Two engines on the same database: the request handlers use the async one (aiosqlite, or
+# asyncpg for PostgreSQL), the job runner, exports and migrations the sync one from threads.
+# Each has its own pool of DB_POOL_SIZE connections plus DB_MAX_OVERFLOW on demand.
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+# Seconds; connections older than this are replaced, before a server or proxy drops them
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+# A round trip per checkout to catch connections the server closed; pointless for a local file
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "1") == "1"
+# How long a SQLite writer waits for the lock before "database is locked", in milliseconds
+SQLITE_BUSY_TIMEOUT = int(os.getenv("SQLITE_BUSY_TIMEOUT", "10000"))
+
+ASYNC_DRIVERS = {"sqlite": "sqlite+aiosqlite", "postgresql": "postgresql+asyncpg"}
+
+T = TypeVar("T")
+
+
+def async_url(url: str) -> str:
+    # ASYNC_DATABASE_URL wins; otherwise the async driver for the backend of DATABASE_URL
+    if os.getenv("ASYNC_DATABASE_URL"):
+        return os.environ["ASYNC_DATABASE_URL"]
+    parsed = make_url(url)
+    return parsed.set(drivername=ASYNC_DRIVERS.get(parsed.get_backend_name(), parsed.drivername)).render_as_string(
+        hide_password=False
+    )
+
+
+IS_SQLITE = make_url(DATABASE_URL).get_backend_name() == "sqlite"
+IN_MEMORY = IS_SQLITE and make_url(DATABASE_URL).database in (None, "", ":memory:")
+
+
+def _engine_options() -> dict:
+    if IN_MEMORY:
+        # A single shared connection: pool sizing does not apply
+        return {}
+    return {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING and not IS_SQLITE,
+    }
+
+
 engine = create_engine(
-    DATABASE_URL, connect_args={"check_same_thread": False} if DATABASE_URL.startswith("sqlite") else {}
+    DATABASE_URL, connect_args={"check_same_thread": False} if IS_SQLITE else {}, **_engine_options()
 )
+async_engine = create_async_engine(async_url(DATABASE_URL), **_engine_options())
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# expire_on_commit=False: attributes are not reloaded (lazily, which async sessions cannot do)
+# after a commit
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
 Base = declarative_base()
 
+if IS_SQLITE:
+
+    def _sqlite_pragmas(dbapi_connection, connection_record) -> None:
+        # WAL: readers no longer block the writer nor the writer the readers (persistent in the
+        # file, so only the first connection actually switches it)
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT}")
+        cursor.close()
+
+    event.listen(engine, "connect", _sqlite_pragmas)
+    event.listen(async_engine.sync_engine, "connect", _sqlite_pragmas)
+
+
+class WriteQueue:
+    # SQLite takes one writer at a time and a second one either waits (busy_timeout) or, if it
+    # read first, fails at once with "database is locked". Every write of the server goes
+    # through here one after the other, in arrival order (asyncio.Lock wakes its waiters FIFO):
+    # the handlers', the job runner's (claims, stages, the grouped Person inserts, failures),
+    # the batches' job creation and the alert recompute. Reads stay outside, WAL lets them run
+    # beside the writer; only the command-line tools (migrations, merges, gc) write on their
+    # own, from another process, and rely on busy_timeout. PostgreSQL has row locks, so there
+    # the writes run concurrently.
+
+    def __init__(self, serialise: bool = IS_SQLITE):
+        self.serialise = serialise
+        self._lock: Optional[asyncio.Lock] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def _loop_lock(self) -> asyncio.Lock:
+        # One lock per event loop: the CLI tools, tests and benchmarks run several asyncio.run
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop, self._lock = loop, asyncio.Lock()
+        return self._lock
+
+    async def run(self, function: Callable[..., T], *args, **kwargs) -> T:
+        # function(session, *args, **kwargs) runs with a sync Session on a new async session and
+        # commits itself, so the existing helpers (create_job, create_batch, ...) are reused as is
+        if not self.serialise:
+            return await self._run(function, *args, **kwargs)
+        async with self._loop_lock():
+            return await self._run(function, *args, **kwargs)
+
+    @staticmethod
+    async def _run(function: Callable[..., T], *args, **kwargs) -> T:
+        async with AsyncSessionLocal() as db:
+            return await db.run_sync(function, *args, **kwargs)
+
+
+write_queue = WriteQueue()
+
+
 def get_db():
     db = SessionLocal()
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
@@ -0,0 +1,255 @@
+import csv
+import io
+import os
+import re
+import zipfile
+from datetime import datetime
+from typing import Iterator, List, Optional, Sequence
+from xml.sax.saxutils import escape
+
+from sqlalchemy import and_
+
+from database import SessionLocal
+from models import Person, PersonAlert, Project
+from queries import alert_filter
+
+# Project rosters as CSV or XLSX, streamed: persons are read EXPORT_BATCH_SIZE at a time
+# (keyset on id) and every batch is written to the response before the next one is read.
+
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+CSV_DELIMITER = ";"
+# A cell starting with one of these is a formula to a spreadsheet
+FORMULA_PREFIXES = ("=", "+", "-", "@", "\t", "\r")
+
+# (header, Person attribute)
+COLUMNS = [
+    ("ID", "id"),
+    ("Progetto", "project_name"),
+    ("Nome", "nome"),
+    ("Cognome", "cognome"),
+    ("Codice fiscale", "codice_fiscale"),
+    ("Indirizzo domicilio", "indirizzo_domicilio"),
+    ("Indirizzo residenza", "indirizzo_residenza"),
+    ("Data nascita", "data_nascita"),
+    ("Comune nascita", "comune_nascita"),
+    ("Provincia nascita", "provincia_nascita"),
+    ("Sesso", "sesso"),
+    ("Numero documento", "numero_documento"),
+    ("Ente rilascio", "ente_rilascio"),
+    ("Data rilascio", "data_rilascio"),
+    ("Data scadenza", "data_scadenza"),
+    ("Titolo studio", "titolo_studio_piu_recente"),
+    ("Data conseguimento titolo", "data_conseguimento_titolo"),
+    ("Situazione occupazionale", "situazione_occupazionale"),
+    ("Clausola privacy", "privacy_ok"),
+    ("CV firmato", "cv_firmato"),
+    ("Data CV", "data_cv"),
+    ("Creato il", "created_at"),
+]
+HEADERS = [header for header, _ in COLUMNS] + ["Numero alert", "Alert"]
+
+MEDIA_TYPES = {
+    "csv": "text/csv; charset=utf-8",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+}
+
+
+def _format(value):
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "Sì" if value else "No"
+    if isinstance(value, int):
+        return value
+    if isinstance(value, datetime):
+        return value.strftime("%Y-%m-%d %H:%M")
+    text = str(value)
+    # The values come from OCR and the model: a crafted document must not put a formula in the
+    # roster, so it is quoted as text
+    return "'" + text if text.startswith(FORMULA_PREFIXES) else text
+
+
+def iter_persons(
+    project_ids: Optional[Sequence[int]] = None,
+    only_alerts: bool = False,
+    created_from: Optional[datetime] = None,
+    created_to: Optional[datetime] = None,
+    batch_size: int = EXPORT_BATCH_SIZE,
+) -> Iterator[List]:
+    # Batches of rows, the last value of each being the alerts; the session lives as long as the
+    # generator, not the request, because the response body is produced after the handler returns
+    columns = [getattr(Person, name) for _, name in COLUMNS if name != "project_name"]
+    filters = []
+    if project_ids:
+        filters.append(Person.project_id.in_(project_ids))
+    if only_alerts:
+        filters.append(alert_filter())
+    if created_from:
+        filters.append(Person.created_at >= created_from)
+    if created_to:
+        filters.append(Person.created_at < created_to)
+    last_id = 0
+    with SessionLocal() as db:
+        while True:
+            rows = (
+                db.query(Project.name.label("project_name"), *columns)
+                .join(Project, Project.id == Person.project_id)
+                .filter(and_(Person.id > last_id, *filters))
+                .order_by(Person.id)
+                .limit(batch_size)
+                .all()
+            )
+            if not rows:
+                return
+            # The stored alerts of the batch's persons in one query, not of the whole id range:
+            # with a filter, other projects' persons fall in it too
+            alerts_by_person = {}
+            for person_id, message in (
+                db.query(PersonAlert.person_id, PersonAlert.message)
+                .filter(PersonAlert.person_id.in_([row.id for row in rows]))
+                .order_by(PersonAlert.person_id, PersonAlert.id)
+            ):
+                alerts_by_person.setdefault(person_id, []).append(message)
+            last_id = rows[-1].id
+            batch = []
+            for row in rows:
+                alerts = alerts_by_person.get(row.id, [])
+                batch.append([_format(getattr(row, name)) for _, name in COLUMNS] + [len(alerts), " | ".join(alerts)])
+            yield batch
+
+
+def csv_stream(batches: Iterator[List]) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, delimiter=CSV_DELIMITER)
+    # BOM so that Excel opens the accented letters as UTF-8
+    buffer.write("\ufeff")
+    writer.writerow(HEADERS)
+    for batch in batches:
+        writer.writerows(batch)
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+
+class _Sink(io.RawIOBase):
+    # Write-only, non-seekable target for ZipFile: it falls back to data descriptors and never
+    # seeks back, so whatever has been compressed so far can be handed to the response
+    def __init__(self):
+        super().__init__()
+        self.chunks: List[bytes] = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self) -> bytes:
+        data, self.chunks = b"".join(self.chunks), []
+        return data
+
+
+# Characters XML 1.0 does not allow even escaped; OCR output occasionally contains them
+_INVALID_XML = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+XLSX_PARTS = {
+    "[Content_Types].xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '<Override PartName="/xl/styles.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+        "</Types>"
+    ),
+    "_rels/.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+        'Target="xl/workbook.xml"/>'
+        "</Relationships>"
+    ),
+    "xl/workbook.xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="Persone" sheetId="1" r:id="rId1"/></sheets>'
+        "</workbook>"
+    ),
+    "xl/_rels/workbook.xml.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+        'Target="worksheets/sheet1.xml"/>'
+        '<Relationship Id="rId2" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" '
+        'Target="styles.xml"/>'
+        "</Relationships>"
+    ),
+    # Style 1 is the bold header
+    "xl/styles.xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+        '<fonts count="2"><font><sz val="11"/><name val="Calibri"/></font>'
+        '<font><b/><sz val="11"/><name val="Calibri"/></font></fonts>'
+        '<fills count="2"><fill><patternFill patternType="none"/></fill>'
+        '<fill><patternFill patternType="gray125"/></fill></fills>'
+        '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+        '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+        '<cellXfs count="2"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+        '<xf numFmtId="0" fontId="1" fillId="0" borderId="0" xfId="0" applyFont="1"/></cellXfs>'
+        '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+        "</styleSheet>"
+    ),
+}
+SHEET_START = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+    '<sheetViews><sheetView workbookViewId="0"><pane ySplit="1" topLeftCell="A2" state="frozen"/></sheetView></sheetViews>'
+    "<sheetData>"
+)
+SHEET_END = "</sheetData></worksheet>"
+
+
+def _xlsx_row(values, style: str = "") -> str:
+    # Inline strings: no shared string table to keep in memory until the end of the file
+    cells = []
+    for value in values:
+        if isinstance(value, int):
+            cells.append(f"<c{style}><v>{value}</v></c>")
+        else:
+            text = escape(_INVALID_XML.sub("", value))
+            cells.append(f'<c t="inlineStr"{style}><is><t xml:space="preserve">{text}</t></is></c>')
+    return f"<row>{''.join(cells)}</row>"
+
+
+def xlsx_stream(batches: Iterator[List]) -> Iterator[bytes]:
+    sink = _Sink()
+    with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        for name, content in XLSX_PARTS.items():
+            archive.writestr(name, content)
+        with archive.open("xl/worksheets/sheet1.xml", "w", force_zip64=True) as sheet:
+            sheet.write((SHEET_START + _xlsx_row(HEADERS, ' s="1"')).encode("utf-8"))
+            for batch in batches:
+                sheet.write("".join(_xlsx_row(row) for row in batch).encode("utf-8"))
+                yield sink.drain()
+            sheet.write(SHEET_END.encode("utf-8"))
+    yield sink.drain()
+
+
+def export_stream(fmt: str, batches: Iterator[List]) -> Iterator[bytes]:
+    return xlsx_stream(batches) if fmt == "xlsx" else csv_stream(batches)
+
+
+def export_filename(fmt: str, label: str) -> str:
+    slug = re.sub(r"[^A-Za-z0-9]+", "_", label).strip("_") or "export"
+    return f"persone_{slug}_{datetime.utcnow():%Y%m%d}.{fmt}"
@@ -0,0 +1,248 @@
+import csv
+import os
+import re
+import unicodedata
+from datetime import date
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Rule-based extraction of the machine-parseable fields, run before the LLM.
+# Every extractor returns {field: (value, confidence)}; ai_extraction only asks the
+# model for the fields that did not reach CONFIDENCE_THRESHOLD.
+
+CONFIDENCE_THRESHOLD = 0.8
+# Cadastral codes of the comuni, "codice;comune;sigla provincia" per line (e.g. H501;ROMA;RM),
+# from the ISTAT/Agenzia delle Entrate list. Without it the birthplace is left to the model:
+# the codice fiscale only gives its code
+COMUNI_CATASTALI_PATH = os.getenv("COMUNI_CATASTALI_PATH", "")
+
+OMOCODIA = "LMNPQRSTUV"
+MONTHS = "ABCDEHLMPRST"
+ODD_VALUES = {
+    **dict(zip("0123456789", [1, 0, 5, 7, 9, 13, 15, 17, 19, 21])),
+    **dict(
+        zip(
+            "ABCDEFGHIJKLMNOPQRSTUVWXYZ",
+            [1, 0, 5, 7, 9, 13, 15, 17, 19, 21, 2, 4, 18, 20, 11, 3, 6, 8, 12, 14, 16, 10, 22, 25, 24, 23],
+        )
+    ),
+}
+EVEN_VALUES = {
+    **{str(digit): digit for digit in range(10)},
+    **{letter: index for index, letter in enumerate("ABCDEFGHIJKLMNOPQRSTUVWXYZ")},
+}
+
+CF_DIGIT = f"[0-9{OMOCODIA}]"
+CF_RE = re.compile(
+    rf"(?<![A-Z0-9])[A-Z]{{6}}{CF_DIGIT}{{2}}[{MONTHS}]{CF_DIGIT}{{2}}[A-Z]{CF_DIGIT}{{3}}[A-Z](?![A-Z0-9])"
+)
+DATE_RE = re.compile(r"(?<!\d)(\d{1,2})\s?[./-]\s?(\d{1,2})\s?[./-]\s?(\d{4})(?!\d)")
+DOCUMENT_PATTERNS = [
+    # Carta d'identità elettronica: CA12345AB
+    ("cie", re.compile(r"(?<![A-Z0-9])([A-Z]{2}\d{5}[A-Z]{2})(?![A-Z0-9])"), 0.9),
+    # Patente di guida: RM1234567X
+    ("patente", re.compile(r"(?<![A-Z0-9])([A-Z]{2}\d{7}[A-Z])(?![A-Z0-9])"), 0.85),
+    # Passaporto e carta d'identità cartacea: YA1234567 / AA 1234567
+    ("passaporto", re.compile(r"(?<![A-Z0-9])([A-Z]{2}) ?(\d{7})(?![A-Z0-9])"), 0.85),
+]
+DATE_LABELS = {
+    "data_nascita": re.compile(r"NASCITA|NAT[OA]\b|BIRTH", re.IGNORECASE),
+    "data_rilascio": re.compile(r"RILASCI|EMISSIONE|ISSUING|ISSUE", re.IGNORECASE),
+    "data_scadenza": re.compile(r"SCADENZA|EXPIRY|VALIDIT", re.IGNORECASE),
+}
+
+
+def cf_check_char(first15: str) -> str:
+    total = sum(
+        ODD_VALUES[char] if index % 2 == 0 else EVEN_VALUES[char] for index, char in enumerate(first15)
+    )
+    return chr(ord("A") + total % 26)
+
+
+def is_valid_codice_fiscale(cf: str) -> bool:
+    cf = cf.strip().upper()
+    return bool(CF_RE.fullmatch(cf)) and cf_check_char(cf[:15]) == cf[15]
+
+
+def _cf_number(chars: str) -> int:
+    return int("".join(str(OMOCODIA.index(c)) if c in OMOCODIA else c for c in chars))
+
+
+def _cf_letters(name: str, surname: bool) -> str:
+    # Accents dropped (À -> A), then consonants first; a given name with more than three
+    # consonants skips the second one
+    plain = unicodedata.normalize("NFKD", name.upper()).encode("ascii", "ignore").decode()
+    letters = [char for char in plain if "A" <= char <= "Z"]
+    consonants = [char for char in letters if char not in "AEIOU"]
+    vowels = [char for char in letters if char in "AEIOU"]
+    if not surname and len(consonants) > 3:
+        consonants = [consonants[0]] + consonants[2:4]
+    return "".join(consonants + vowels + ["X"] * 3)[:3]
+
+
+def cf_name_letters(nome: Optional[str], cognome: Optional[str]) -> str:
+    # The first six characters of the codice fiscale of nome and cognome; "" without both
+    if not (nome or "").strip() or not (cognome or "").strip():
+        return ""
+    return _cf_letters(cognome, surname=True) + _cf_letters(nome, surname=False)
+
+
+@lru_cache(maxsize=1)
+def comuni_catastali() -> Dict[str, Tuple[str, str]]:
+    # {codice catastale: (comune, provincia)}; empty when COMUNI_CATASTALI_PATH is not set
+    if not COMUNI_CATASTALI_PATH:
+        return {}
+    with open(COMUNI_CATASTALI_PATH, encoding="utf-8", newline="") as handle:
+        return {
+            row[0].strip().upper(): (row[1].strip().upper(), row[2].strip().upper())
+            for row in csv.reader(handle, delimiter=";")
+            if len(row) >= 3
+        }
+
+
+def decode_codice_fiscale(cf: str, today: Optional[date] = None) -> Dict[str, str]:
+    # comune_nascita and provincia_nascita are "" when the code is not in comuni_catastali()
+    today = today or date.today()
+    year = _cf_number(cf[6:8])
+    month = MONTHS.index(cf[8]) + 1
+    day = _cf_number(cf[9:11])
+    sesso = "F" if day > 40 else "M"
+    if day > 40:
+        day -= 40
+    # Two-digit year: anything after the current year belongs to the previous century
+    century = 2000 if 2000 + year <= today.year else 1900
+    try:
+        nascita = date(century + year, month, day).isoformat()
+    except ValueError:
+        nascita = ""
+    codice_catastale = cf[11] + str(_cf_number(cf[12:15])).zfill(3)
+    comune, provincia = comuni_catastali().get(codice_catastale, ("", ""))
+    return {
+        "data_nascita": nascita,
+        "sesso": sesso,
+        "codice_catastale": codice_catastale,
+        "comune_nascita": comune,
+        "provincia_nascita": provincia,
+    }
+
+
+def _normalise(text: str) -> str:
+    return text.upper().replace("\u00a0", " ")
+
+
+def find_codice_fiscale(text: str) -> Optional[str]:
+    # A valid checksum wins over a merely well-formed candidate, which is often an OCR misread
+    normalised = _normalise(text)
+    candidates = CF_RE.findall(normalised)
+    # Health cards often print the code in spaced groups: RSSMRA 80A01 H501U
+    tokens = re.findall(r"[A-Z0-9]+", normalised)
+    for start in range(len(tokens)):
+        joined = ""
+        for token in tokens[start:start + 5]:
+            joined += token
+            if len(joined) >= 16:
+                break
+        if len(joined) == 16 and CF_RE.fullmatch(joined):
+            candidates.append(joined)
+    for candidate in candidates:
+        if cf_check_char(candidate[:15]) == candidate[15]:
+            return candidate
+    return None
+
+
+def to_iso_date(day: str, month: str, year: str) -> str:
+    try:
+        return date(int(year), int(month), int(day)).isoformat()
+    except ValueError:
+        return ""
+
+
+def find_dates(text: str) -> List[str]:
+    return [iso for iso in (to_iso_date(*match) for match in DATE_RE.findall(text)) if iso]
+
+
+def find_labelled_dates(text: str) -> Dict[str, str]:
+    lines = text.splitlines()
+    found: Dict[str, str] = {}
+    for index, line in enumerate(lines):
+        for field, label in DATE_LABELS.items():
+            if field in found:
+                continue
+            match = label.search(line)
+            if not match:
+                continue
+            # The value sits after the label on the same line or just below it on ID cards
+            window = [line[match.end():]] + lines[index + 1:index + 3]
+            for candidate in window:
+                dates = find_dates(candidate)
+                if dates:
+                    found[field] = dates[0]
+                    break
+    return found
+
+
+def find_numero_documento(text: str) -> Optional[Tuple[str, float]]:
+    normalised = _normalise(text)
+    for _, pattern, confidence in DOCUMENT_PATTERNS:
+        match = pattern.search(normalised)
+        if match:
+            return "".join(match.groups()), confidence
+    return None
+
+
+def _codice_fiscale_fields(text: str) -> Dict[str, Tuple[str, float]]:
+    cf = find_codice_fiscale(text)
+    if not cf:
+        return {}
+    decoded = decode_codice_fiscale(cf)
+    fields = {"codice_fiscale": (cf, 0.99), "sesso": (decoded["sesso"], 0.95)}
+    if decoded["data_nascita"]:
+        fields["data_nascita"] = (decoded["data_nascita"], 0.9)
+    if decoded["comune_nascita"]:
+        fields["comune_nascita"] = (decoded["comune_nascita"], 0.9)
+        fields["provincia_nascita"] = (decoded["provincia_nascita"], 0.9)
+    return fields
+
+
+def extract_identity_fields(text: str) -> Dict[str, Tuple[str, float]]:
+    fields = _codice_fiscale_fields(text)
+    for field, value in find_labelled_dates(text).items():
+        if field == "data_nascita" and "data_nascita" in fields:
+            # Printed date and the one encoded in the CF confirm each other
+            agree = fields["data_nascita"][0] == value
+            fields[field] = (value, 0.99 if agree else 0.6)
+        else:
+            fields[field] = (value, 0.85)
+    rilascio, scadenza = fields.get("data_rilascio"), fields.get("data_scadenza")
+    if rilascio and scadenza and rilascio[0] >= scadenza[0]:
+        fields["data_rilascio"] = (rilascio[0], 0.5)
+        fields["data_scadenza"] = (scadenza[0], 0.5)
+    numero = find_numero_documento(text)
+    if numero:
+        fields["numero_documento"] = numero
+    return fields
+
+
+def extract_tessera_fields(text: str) -> Dict[str, Tuple[str, float]]:
+    fields = _codice_fiscale_fields(text)
+    return {"codice_fiscale": fields["codice_fiscale"]} if fields else {}
+
+
+EXTRACTORS = {
+    "documento_identita": extract_identity_fields,
+    "tessera_sanitaria": extract_tessera_fields,
+}
+
+
+def extract(part: str, text: str) -> Dict[str, Tuple[str, float]]:
+    extractor = EXTRACTORS.get(part)
+    return extractor(text) if extractor else {}
+
+
+def confident(fields: Dict[str, Tuple[str, float]], wanted: Iterable[str]) -> Dict[str, str]:
+    wanted = set(wanted)
+    return {
+        field: value
+        for field, (value, confidence) in fields.items()
+        if field in wanted and value and confidence >= CONFIDENCE_THRESHOLD
+    }
@@ -0,0 +1,164 @@
+import hashlib
+import os
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from pathlib import Path
+from typing import Awaitable, Callable, Iterator, Optional, Tuple
+
+from fastapi import Request
+from fastapi.responses import FileResponse, Response, StreamingResponse
+
+from cache import page_cache
+from metrics import PAGE_CACHE
+from versions import Validator
+
+# Conditional GETs for the read-heavy pages and the uploaded documents. A page's ETag is built
+# from its validator (see versions.py) and the templates, so a repeat view answers 304 after one
+# small query; a miss renders the page once per version and keeps the body in page_cache, keyed
+# by the ETag, so it needs no invalidation: a write bumps the version and the next key differs.
+# Documents are content-addressed (blob hash), hence immutable, and served with Range support
+# so that a preview does not download the whole scan.
+
+HTTP_CACHE_ENABLED = os.getenv("HTTP_CACHE_ENABLED", "1") == "1"
+# Revalidated on every view: the pages change with any upload to the project
+PAGE_CACHE_CONTROL = "private, no-cache"
+FILE_CACHE_CONTROL = "private, max-age=31536000, immutable"
+CHUNK_SIZE = 256 * 1024
+
+TEMPLATES_DIR = Path(__file__).resolve().parent / "templates"
+
+
+def _templates_digest() -> str:
+    # Part of every page ETag: a deploy with changed templates does not answer 304 to old copies
+    digest = hashlib.sha256()
+    for path in sorted(TEMPLATES_DIR.glob("*.html")):
+        digest.update(path.name.encode())
+        digest.update(path.read_bytes())
+    return digest.hexdigest()[:12]
+
+
+TEMPLATES_DIGEST = _templates_digest() if TEMPLATES_DIR.is_dir() else ""
+
+
+def etag_for(*parts: object) -> str:
+    # Weak: the same data rendered again, not necessarily the same bytes
+    digest = hashlib.sha256("|".join(str(part) for part in (TEMPLATES_DIGEST, *parts)).encode())
+    return f'W/"{digest.hexdigest()[:32]}"'
+
+
+def _http_date(value: datetime) -> str:
+    # The stored datetimes are naive UTC
+    return format_datetime(value.replace(microsecond=0, tzinfo=timezone.utc), usegmt=True)
+
+
+def _opaque(tag: str) -> str:
+    return tag[2:] if tag.startswith("W/") else tag
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    # Weak comparison, as If-None-Match requires
+    tags = [tag.strip() for tag in header.split(",")]
+    return "*" in tags or _opaque(etag) in {_opaque(tag) for tag in tags}
+
+
+def not_modified(request: Request, etag: str, last_modified: Optional[datetime] = None) -> bool:
+    # If-None-Match wins over If-Modified-Since when both are sent
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        return _etag_matches(if_none_match, etag)
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since and last_modified is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since).replace(tzinfo=None)
+        except (TypeError, ValueError):
+            return False
+        return last_modified.replace(microsecond=0) <= since
+    return False
+
+
+def _validator_headers(etag: str, last_modified: Optional[datetime], cache_control: str) -> dict:
+    headers = {"ETag": etag, "Cache-Control": cache_control}
+    if last_modified is not None:
+        headers["Last-Modified"] = _http_date(last_modified)
+    return headers
+
+
+async def cached_page(
+    request: Request, validator: Validator, render: Callable[[], Awaitable[Response]], *parts: object
+) -> Response:
+    # render builds the page; only a 200 is cached. parts: anything else the page depends on
+    if not HTTP_CACHE_ENABLED:
+        return await render()
+    etag = etag_for(validator.tag, *parts)
+    headers = _validator_headers(etag, validator.last_modified, PAGE_CACHE_CONTROL)
+    if not_modified(request, etag, validator.last_modified):
+        PAGE_CACHE.inc(result="not_modified")
+        return Response(status_code=304, headers=headers)
+    key = f"{request.url.path}?{request.url.query}|{etag}"
+    body = page_cache.get(key)
+    if body is not None:
+        PAGE_CACHE.inc(result="hit")
+        return Response(body, media_type="text/html", headers=headers)
+    PAGE_CACHE.inc(result="miss")
+    response = await render()
+    if response.status_code == 200:
+        page_cache.set(key, bytes(response.body))
+        response.headers.update(headers)
+    return response
+
+
+def _byte_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    # A single "bytes=start-end", "bytes=start-" or "bytes=-suffix", as (start, end) inclusive;
+    # (size, size) when it cannot be satisfied, None when it is not one of those (whole file)
+    unit, _, spec = header.partition("=")
+    if unit.strip() != "bytes" or "," in spec:
+        return None
+    start, dash, end = spec.strip().partition("-")
+    if not dash or not (start or end) or not all(value.isdigit() for value in (start, end) if value):
+        return None
+    if not start:
+        suffix = int(end)
+        return (max(size - suffix, 0), size - 1) if suffix and size else (size, size)
+    first = int(start)
+    if end and int(end) < first:
+        return None
+    if first >= size:
+        return (size, size)
+    return first, min(int(end), size - 1) if end else size - 1
+
+
+def _read_range(path: Path, start: int, end: int) -> Iterator[bytes]:
+    with path.open("rb") as handle:
+        handle.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = handle.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                return
+            remaining -= len(chunk)
+            yield chunk
+
+
+def file_response(request: Request, path: Path, media_type: str, sha256: str, filename: str) -> Response:
+    etag = f'"{sha256}"'
+    headers = {"ETag": etag, "Cache-Control": FILE_CACHE_CONTROL, "Accept-Ranges": "bytes"}
+    if not_modified(request, etag):
+        return Response(status_code=304, headers=headers)
+    size = path.stat().st_size
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    # A Range under If-Range holds only for this very file (strong comparison)
+    if range_header and (if_range is None or if_range.strip() == etag):
+        byte_range = _byte_range(range_header, size)
+        if byte_range == (size, size):
+            return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+        if byte_range is not None:
+            start, end = byte_range
+            headers.update({"Content-Range": f"bytes {start}-{end}/{size}", "Content-Length": str(end - start + 1)})
+            # A sync iterator: Starlette reads each chunk in the threadpool
+            return StreamingResponse(
+                _read_range(path, start, end), status_code=206, media_type=media_type, headers=headers
+            )
+    return FileResponse(
+        path, media_type=media_type, filename=filename or path.name, content_disposition_type="inline", headers=headers
+    )
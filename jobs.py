@@ -0,0 +1,391 @@
+import asyncio
+import logging
+import os
+import sys
+import time
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy.orm import Session
+
+from database import write_queue
+from metrics import CANDIDATE_REUSES, job_timings, timed
+from models import Batch, Job, Person
+from alerts import build_alerts, evaluate_persons
+from candidates import known_document, reusable_identity, upsert_candidate
+from fast_extract import find_codice_fiscale
+from storage import StoredFile, link_documents, register_blobs
+
+logger = logging.getLogger(__name__)
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_RETRY_DELAY = float(os.getenv("JOB_RETRY_DELAY", "5"))
+PERSIST_BATCH_SIZE = int(os.getenv("PERSIST_BATCH_SIZE", "50"))
+PERSIST_BATCH_DELAY = float(os.getenv("PERSIST_BATCH_DELAY", "0.2"))
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "8"))
+
+
+def person_from_data(project_id: int, data: dict) -> Person:
+    return Person(
+        project_id=project_id,
+        nome=data.get("nome", ""),
+        cognome=data.get("cognome", ""),
+        codice_fiscale=data.get("codice_fiscale", ""),
+        indirizzo_domicilio=data.get("indirizzo_domicilio", ""),
+        indirizzo_residenza=data.get("indirizzo_residenza", ""),
+        data_nascita=data.get("data_nascita", ""),
+        comune_nascita=data.get("comune_nascita", ""),
+        provincia_nascita=data.get("provincia_nascita", ""),
+        sesso=data.get("sesso", ""),
+        numero_documento=data.get("numero_documento", ""),
+        ente_rilascio=data.get("ente_rilascio", ""),
+        data_rilascio=data.get("data_rilascio", ""),
+        data_scadenza=data.get("data_scadenza", ""),
+        titolo_studio_piu_recente=data.get("titolo_studio_piu_recente", {}).get("titolo", ""),
+        data_conseguimento_titolo=data.get("titolo_studio_piu_recente", {}).get("data_conseguimento", ""),
+        situazione_occupazionale=data.get("situazione_occupazionale", ""),
+        privacy_ok=bool(data.get("privacy_clause_present")),
+        cv_firmato=bool(data.get("firma_presente")),
+        data_cv=data.get("data_cv", ""),
+    )
+
+
+def new_job(project_id: int, stored: Dict[str, StoredFile], **values) -> Job:
+    return Job(
+        project_id=project_id,
+        cv_path=str(stored["cv"].path),
+        doc_path=str(stored["doc"].path),
+        tess_path=str(stored["tess"].path),
+        documents={kind: {"sha256": item.sha256, "filename": item.filename} for kind, item in stored.items()},
+        **values,
+    )
+
+
+def create_job(db: Session, project_id: int, stored: Dict[str, StoredFile], timings: Optional[dict] = None) -> int:
+    register_blobs(db, stored.values())
+    job = new_job(project_id, stored, timings=timings)
+    db.add(job)
+    db.commit()
+    return job.id
+
+
+# The writes below take the Session first and run through database.write_queue
+
+
+def _requeue_interrupted(db: Session) -> List[int]:
+    # At startup no job is running: the ones left "running" were interrupted by the restart and
+    # are pending again, so that _load_job can claim them
+    db.query(Job).filter(Job.status == "running").update({Job.status: "pending"}, synchronize_session=False)
+    db.commit()
+    return [row.id for row in db.query(Job.id).filter(Job.status == "pending").order_by(Job.id)]
+
+
+def _load_job(db: Session, job_id: int) -> Optional[Dict]:
+    # Claimed atomically, pending -> running: a job queued twice (by its batch and by a retry
+    # or the startup requeue) runs once, the second claim finds it taken and returns None
+    claimed = (
+        db.query(Job)
+        .filter(Job.id == job_id, Job.status == "pending")
+        .update({Job.status: "running", Job.error: ""}, synchronize_session=False)
+    )
+    db.commit()
+    if not claimed:
+        return None
+    job = db.query(Job).filter_by(id=job_id).first()
+    return {
+        "id": job.id,
+        "project_id": job.project_id,
+        "stage": job.stage,
+        "paths": {"cv": job.cv_path, "doc": job.doc_path, "tess": job.tess_path},
+        "hashes": {kind: document["sha256"] for kind, document in (job.documents or {}).items()},
+        "texts": job.texts,
+        "data": job.data,
+        "timings": dict(job.timings or {}),
+    }
+
+
+def _save_stage(db: Session, job_id: int, next_stage: str, **values) -> None:
+    job = db.query(Job).filter_by(id=job_id).first()
+    for key, value in values.items():
+        setattr(job, key, value)
+    job.stage = next_stage
+    db.commit()
+
+
+def settle_batches(db: Session, batch_ids: Iterable[Optional[int]]) -> None:
+    # A batch is done once none of its jobs is pending or running, whichever way they ended;
+    # checked in the transaction that ends a job, so it holds across restarts and retries.
+    # The caller flushes the job statuses first
+    batch_ids = {batch_id for batch_id in batch_ids if batch_id is not None}
+    if not batch_ids:
+        return
+    unfinished = {
+        batch_id
+        for (batch_id,) in db.query(Job.batch_id)
+        .filter(Job.batch_id.in_(batch_ids), Job.status.in_(["pending", "running"]))
+        .distinct()
+    }
+    for batch in db.query(Batch).filter(Batch.id.in_(batch_ids), Batch.status != "failed"):
+        if batch.id in unfinished:
+            batch.status, batch.finished_at = "running", None
+        elif batch.status != "done":
+            batch.status, batch.finished_at = "done", datetime.utcnow()
+
+
+def _persist_many(db: Session, items: List[Tuple[int, int, dict]]) -> None:
+    # One transaction for the whole group instead of a commit per Person
+    start = time.perf_counter()
+    jobs = {job.id: job for job in db.query(Job).filter(Job.id.in_([item[0] for item in items]))}
+    created = []
+    job_timings_by_id = {}
+    for job_id, project_id, data in items:
+        job = jobs[job_id]
+        with job_timings(dict(job.timings or {})) as timings:
+            with timed("alerts"):
+                job.alerts = build_alerts(data)
+        job_timings_by_id[job_id] = timings
+        if job.person_id is None:
+            person = person_from_data(project_id, data)
+            person.candidate = upsert_candidate(db, data, (job.documents or {}).get("doc", {}).get("sha256"))
+            created.append((job, person))
+        job.stage = "done"
+        job.status = "done"
+    db.add_all([person for _, person in created])
+    db.flush()
+    for job, person in created:
+        job.person_id = person.id
+        if job.documents:
+            link_documents(db, person.id, job.documents, job.texts)
+    # Stored alerts of the new persons, in the same transaction: set-based over the group
+    evaluate_persons(db, [person.id for _, person in created])
+    settle_batches(db, [job.batch_id for job in jobs.values()])
+    # Every job of the group waited for the whole insert (up to the commit): that is its persist
+    # stage, stored with the job and its Person
+    seconds = time.perf_counter() - start
+    for job_id, timings in job_timings_by_id.items():
+        timings["persist"] = round(timings.get("persist", 0) + seconds, 4)
+        jobs[job_id].timings = timings
+    for job, person in created:
+        person.timings = job.timings
+    db.commit()
+
+
+class PersonWriter:
+    # Group commit for finished jobs: Person rows are inserted PERSIST_BATCH_SIZE at a
+    # time, or after PERSIST_BATCH_DELAY, whichever comes first.
+
+    def __init__(self, max_size: int = PERSIST_BATCH_SIZE, max_delay: float = PERSIST_BATCH_DELAY):
+        self.max_size = max_size
+        self.max_delay = max_delay
+        self._pending: List[Tuple[Tuple[int, int, dict], asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        # Flushes in flight, referenced until done, as JobRunner.spawn does
+        self._flushes: Set[asyncio.Task] = set()
+
+    async def submit(self, job_id: int, project_id: int, data: dict) -> None:
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append(((job_id, project_id, data), future))
+        if len(self._pending) >= self.max_size:
+            self._schedule(0)
+        elif self._timer is None:
+            self._schedule(self.max_delay)
+        await future
+
+    def _schedule(self, delay: float) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+        loop = asyncio.get_running_loop()
+        self._timer = loop.call_later(delay, self._start_flush)
+
+    def _start_flush(self) -> None:
+        task = asyncio.get_running_loop().create_task(self._flush())
+        self._flushes.add(task)
+        task.add_done_callback(self._flush_done)
+
+    def _flush_done(self, task: asyncio.Task) -> None:
+        self._flushes.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("person flush failed", exc_info=task.exception())
+
+    async def _flush(self) -> None:
+        self._timer = None
+        group, self._pending = self._pending, []
+        if not group:
+            return
+        try:
+            # The histogram gets the whole group once; each job's own timings get the insert in
+            # _persist_many
+            with job_timings(), timed("persist"):
+                await write_queue.run(_persist_many, [item for item, _ in group])
+        except Exception:
+            # One bad row must not sink the others: fall back to one transaction per job
+            for item, future in group:
+                try:
+                    await write_queue.run(_persist_many, [item])
+                    future.set_result(None)
+                except Exception as exc:
+                    future.set_exception(exc)
+            return
+        for _, future in group:
+            future.set_result(None)
+
+
+def _record_failure(db: Session, job_id: int, error: str) -> bool:
+    job = db.query(Job).filter_by(id=job_id).first()
+    job.attempts = (job.attempts or 0) + 1
+    job.error = error
+    retry = job.attempts < JOB_MAX_ATTEMPTS
+    job.status = "pending" if retry else "failed"
+    db.flush()
+    settle_batches(db, [job.batch_id])
+    db.commit()
+    return retry
+
+
+def _reset_for_retry(db: Session, job_id: int) -> bool:
+    job = db.query(Job).filter_by(id=job_id).first()
+    if not job or job.status != "failed":
+        return False
+    job.status = "pending"
+    job.attempts = 0
+    job.error = ""
+    db.flush()
+    # Its batch, if done, is running again
+    settle_batches(db, [job.batch_id])
+    db.commit()
+    return True
+
+
+class JobRunner:
+    def __init__(self, workers: int = JOB_WORKERS):
+        self.workers = workers
+        self.queue: Optional[asyncio.Queue] = None
+        self.writer = PersonWriter()
+        self._tasks: List[asyncio.Task] = []
+        self._background: Set[asyncio.Task] = set()
+
+    async def start(self) -> None:
+        self.queue = asyncio.Queue()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        # Jobs left pending or interrupted mid-run by a restart are picked up again
+        for job_id in await write_queue.run(_requeue_interrupted):
+            self.queue.put_nowait(job_id)
+
+    async def stop(self) -> None:
+        tasks = self._tasks + list(self._background)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks = []
+        # Only if a job (or the prewarm) imported it: stopping must not pay for the import
+        if "ocr" in sys.modules:
+            sys.modules["ocr"].shutdown_pool()
+        if "ai_extraction" in sys.modules:
+            await sys.modules["ai_extraction"].close_client()
+
+    def enqueue(self, job_id: int) -> None:
+        # Before start (the server accepts requests while it migrates, see main._start) the job
+        # only stays pending: start() queues every pending job
+        if self.queue is not None:
+            self.queue.put_nowait(job_id)
+
+    async def retry(self, job_id: int) -> bool:
+        if not await write_queue.run(_reset_for_retry, job_id):
+            return False
+        self.enqueue(job_id)
+        return True
+
+    async def _worker(self) -> None:
+        while True:
+            job_id = await self.queue.get()
+            try:
+                await self.run(job_id)
+            finally:
+                self.queue.task_done()
+
+    def spawn(self, coroutine) -> asyncio.Task:
+        # Keep a reference so fire-and-forget tasks are not garbage collected mid-run
+        task = asyncio.create_task(coroutine)
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+        return task
+
+    async def run_batch(self, job_ids: Iterable[int], concurrency: int = BATCH_CONCURRENCY) -> None:
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def run_one(job_id: int) -> None:
+            async with semaphore:
+                await self.run(job_id)
+
+        await asyncio.gather(*(run_one(job_id) for job_id in job_ids))
+
+    async def _requeue_later(self, job_id: int) -> None:
+        await asyncio.sleep(JOB_RETRY_DELAY)
+        self.enqueue(job_id)
+
+    async def run(self, job_id: int) -> None:
+        job = await write_queue.run(_load_job, job_id)
+        if job is None:
+            return
+        try:
+            await self._run_stages(job)
+        except Exception as exc:
+            if await write_queue.run(_record_failure, job_id, f"{job['stage']}: {exc!r}"):
+                self.spawn(self._requeue_later(job_id))
+
+    async def _run_stages(self, job: Dict) -> None:
+        # Stage timings accumulate on the job across retries and are saved with each stage
+        with job_timings(job["timings"]) as timings:
+            await self._run_timed_stages(job, timings)
+
+    @staticmethod
+    async def _ocr(job: Dict, kinds: List[str]) -> Dict[str, str]:
+        # Imported here, not at module level: pdfplumber and tesseract take much of the
+        # application's import time and only the jobs need them (main.py prewarms them)
+        from ocr import extract_texts_async
+
+        # The OCR engine spreads the documents and their pages over its process pool, awaited
+        # without holding a thread. The blob hashes double as OCR cache keys, so the files are
+        # not hashed a second time
+        results = await extract_texts_async(
+            [job["paths"][kind] for kind in kinds],
+            [job["hashes"].get(kind) for kind in kinds],
+        )
+        return {kind: text for kind, (text, _) in zip(kinds, results)}
+
+    async def _run_timed_stages(self, job: Dict, timings: dict) -> None:
+        # Lazy for the same reason as ocr in _ocr
+        from ai_extraction import extract_fields_with_ai_async
+
+        if job["stage"] == "ocr":
+            with timed("ocr"):
+                # A returning candidate's unchanged identity document is not read again: its text
+                # from the last enrolment is used once the health card confirms who it is
+                known = await asyncio.to_thread(known_document, job["hashes"].get("doc"))
+                texts = await self._ocr(job, [kind for kind in job["paths"] if not (known and kind == "doc")])
+                if known and find_codice_fiscale(texts["tess"]) == known.codice_fiscale:
+                    texts["doc"] = known.text
+                    CANDIDATE_REUSES.inc(stage="ocr")
+                elif known:
+                    texts.update(await self._ocr(job, ["doc"]))
+            job["texts"] = {kind: texts[kind] for kind in job["paths"]}
+            job["stage"] = "extraction"
+            await write_queue.run(_save_stage, job["id"], "extraction", texts=job["texts"], timings=dict(timings))
+
+        if job["stage"] == "extraction":
+            texts = job["texts"]
+            with timed("extraction"):
+                # Stored identity fields of a returning candidate: only the CV is extracted
+                identity = await asyncio.to_thread(reusable_identity, texts["tess"], job["hashes"].get("doc"))
+                if identity is not None:
+                    CANDIDATE_REUSES.inc(stage="extraction")
+                job["data"] = await extract_fields_with_ai_async(texts["cv"], texts["doc"], texts["tess"], identity)
+            job["stage"] = "persist"
+            await write_queue.run(_save_stage, job["id"], "persist", data=job["data"], timings=dict(timings))
+
+        if job["stage"] == "persist":
+            await self.writer.submit(job["id"], job["project_id"], job["data"])
+
+
+runner = JobRunner()
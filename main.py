@@ -1,67 +1,186 @@
+import asyncio
+import importlib
+import logging
+import math
 import os
-import shutil
+import time
+import uuid
+from contextlib import asynccontextmanager
+from datetime import date, datetime, timedelta
 from pathlib import Path
-from typing import List
-
-from fastapi import Depends, FastAPI, File, Form, Request, UploadFile
-from fastapi.responses import RedirectResponse, HTMLResponse
+from typing import List, Optional
+
+from fastapi import Depends, FastAPI, File, Form, Query, Request, UploadFile
+from fastapi.responses import (
+    HTMLResponse,
+    JSONResponse,
+    PlainTextResponse,
+    RedirectResponse,
+    Response,
+    StreamingResponse,
+)
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from starlette.middleware.sessions import SessionMiddleware
-from sqlalchemy.orm import Session
+from sqlalchemy import select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, joinedload
+
+from alerts import ALERTS_REFRESH_INTERVAL, RULE_MESSAGES, RULE_SET, recompute_queued
+from database import async_engine, get_async_db, write_queue
+from models import Blob, Project, Person, PersonAlert, PersonDocument, Job, Batch, register_listeners
+from auth import (
+    LoginThrottled,
+    create_default_user,
+    get_current_user,
+    login_action,
+    logout_action,
+    require_login,
+    shutdown_executor,
+)
+from jobs import create_job, runner
+from batch import (
+    create_batch,
+    batch_progress,
+    ingest_archive,
+    ingest_directory,
+    process_batch,
+    resolve_import_dir,
+    store_archive,
+)
+from storage import UPLOAD_DIR, UploadRejected, blob_path, store_upload
+from queries import person_page, project_counts, project_page, rule_counts
+from search import SEARCH_LIMIT, search_persons
+from export import MEDIA_TYPES, export_filename, export_stream, iter_persons
+from metrics import HTTP_SECONDS, METRICS_ENABLED, job_timings, render
+from http_cache import cached_page, file_response
+from versions import person_validator, project_validator, projects_validator
+import migrations
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = Path(__file__).resolve().parent
+# Schema migrations at startup; with 0 they are left to `python migrations.py`, run once per deploy
+MIGRATE_ON_STARTUP = os.getenv("MIGRATE_ON_STARTUP", "1") == "1"
+# The modules only the jobs need, slow to import (openai, pdfplumber, tesseract), are imported
+# once the app is ready rather than at import or by the first job
+PREWARM_ENABLED = os.getenv("PREWARM_ENABLED", "1") == "1"
+
+
+class Startup:
+    # Readiness: set once the database is migrated (or found current) and the job runner started
+    ready = False
+    error = ""
+
+
+def _prepare_database() -> None:
+    if MIGRATE_ON_STARTUP:
+        migrations.migrate()
+    elif migrations.pending():
+        raise RuntimeError(
+            f"schema alla versione {migrations.current_version()}, attesa {migrations.LATEST_VERSION}: "
+            "eseguire python migrations.py"
+        )
+    UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
+    create_default_user()
+
+
+async def _prewarm() -> None:
+    await asyncio.to_thread(importlib.import_module, "ai_extraction")
+    # Off the loop too: ocr no longer imports tesserocr, which only its pool workers load
+    await asyncio.to_thread(importlib.import_module, "ocr")
+
+
+async def _refresh_alerts() -> None:
+    # Stored alerts left stale by a rule change, and the date-based ones turning on over time
+    while True:
+        try:
+            await recompute_queued()
+        except Exception:
+            logger.exception("alert recompute failed")
+        await asyncio.sleep(ALERTS_REFRESH_INTERVAL)
+
+
+async def _start() -> None:
+    # Runs after the server is accepting connections: /health/live answers at once and
+    # /health/ready turns 200 when this is done
+    try:
+        await asyncio.to_thread(_prepare_database)
+        await runner.start()
+    except Exception as exc:
+        logger.exception("startup failed")
+        Startup.error = repr(exc)
+        return
+    Startup.ready = True
+    runner.spawn(_refresh_alerts())
+    if PREWARM_ENABLED:
+        await _prewarm()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    register_listeners()
+    startup = asyncio.create_task(_start())
+    yield
+    startup.cancel()
+    await asyncio.gather(startup, return_exceptions=True)
+    await runner.stop()
+    shutdown_executor()
+
+
+app = FastAPI(title="Controllo Documenti e CRM", lifespan=lifespan)
+app.add_middleware(SessionMiddleware, secret_key=os.getenv("SESSION_SECRET", "supersecretkey"))
 
-from database import Base, engine, get_db
-from models import Project, Person
-from auth import create_default_user, login_action, logout_action, require_login, get_current_user
-from ocr import extract_text
-from ai_extraction import extract_fields_with_ai
+# Not checked at import: a missing directory only means 404s under /static
+app.mount("/static", StaticFiles(directory=BASE_DIR / "static", check_dir=False), name="static")
+templates = Jinja2Templates(directory=BASE_DIR / "templates")
 
-app = FastAPI(title="Controllo Documenti e CRM")
-app.add_middleware(SessionMiddleware, secret_key=os.getenv("SESSION_SECRET", "supersecretkey"))
 
-app.mount("/static", StaticFiles(directory="static"), name="static")
-templates = Jinja2Templates(directory="templates")
-
-UPLOAD_DIR = Path("uploads")
-UPLOAD_DIR.mkdir(exist_ok=True)
-
-# Initialize DB
-Base.metadata.create_all(bind=engine)
-with next(get_db()) as db:
-    create_default_user(db)
-
-
-def save_upload(file: UploadFile, destination: Path) -> Path:
-    destination.parent.mkdir(parents=True, exist_ok=True)
-    with destination.open("wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
-    return destination
-
-
-def build_alerts(data: dict) -> List[str]:
-    alerts: List[str] = []
-    if not data.get("indirizzo_domicilio"):
-        alerts.append("Manca l'indirizzo di domicilio nel CV")
-    if not data.get("indirizzo_residenza"):
-        alerts.append("Manca l'indirizzo di residenza nel CV")
-    if not data.get("privacy_clause_present"):
-        alerts.append("Manca la clausola di trattamento dei dati personali nel CV")
-    if not data.get("nome"):
-        alerts.append("Manca il nome nel CV")
-    if not data.get("cognome"):
-        alerts.append("Manca il cognome nel CV")
-    titolo = data.get("titolo_studio_piu_recente", {})
-    if not titolo.get("titolo"):
-        alerts.append("Manca il titolo di studio più recente nel CV")
-    if not titolo.get("data_conseguimento"):
-        alerts.append("Manca la data di conseguimento del titolo nel CV")
-    if not data.get("situazione_occupazionale"):
-        alerts.append("Manca la situazione occupazionale nel CV")
-    if not data.get("firma_presente"):
-        alerts.append("Il CV non risulta firmato")
-    if not data.get("data_cv"):
-        alerts.append("Il CV non risulta datato")
-    return alerts
+if METRICS_ENABLED:
+
+    @app.middleware("http")
+    async def observe_latency(request: Request, call_next):
+        start = time.perf_counter()
+        response = await call_next(request)
+        # The route template, not the path, so that /jobs/1 and /jobs/2 share a series
+        route = request.scope.get("route")
+        HTTP_SECONDS.observe(
+            time.perf_counter() - start,
+            method=request.method,
+            route=getattr(route, "path", "other"),
+            status=str(response.status_code),
+        )
+        return response
+
+    @app.get("/metrics", include_in_schema=False)
+    async def metrics():
+        return PlainTextResponse(render(), media_type="text/plain; version=0.0.4")
+
+
+async def _database_reachable() -> bool:
+    try:
+        async with async_engine.connect() as connection:
+            await connection.execute(text("SELECT 1"))
+        return True
+    except Exception:
+        return False
+
+
+@app.get("/health/live", include_in_schema=False)
+async def health_live():
+    # The process is up and its event loop answers; nothing else is checked
+    return {"status": "ok"}
+
+
+@app.get("/health/ready", include_in_schema=False)
+async def health_ready():
+    if Startup.error:
+        return JSONResponse({"status": "error", "error": Startup.error}, status_code=503)
+    if not Startup.ready:
+        return JSONResponse({"status": "starting"}, status_code=503)
+    if not await _database_reachable():
+        return JSONResponse({"status": "error", "error": "database non raggiungibile"}, status_code=503)
+    return {"status": "ready"}
 
 
 @app.get("/", response_class=HTMLResponse)
@@ -78,8 +197,17 @@ async def login_page(request: Request):
 
 
 @app.post("/login")
-async def login(request: Request, username: str = Form(...), password: str = Form(...), db: Session = Depends(get_db)):
-    success = login_action(request, db, username, password)
+async def login(request: Request, username: str = Form(...), password: str = Form(...), db: AsyncSession = Depends(get_async_db)):
+    try:
+        success = await login_action(request, db, username, password)
+    except LoginThrottled as exc:
+        minutes = math.ceil(exc.retry_after / 60)
+        return templates.TemplateResponse(
+            "login.html",
+            {"request": request, "error": f"Troppi tentativi di accesso: riprova tra {minutes} minuti"},
+            status_code=429,
+            headers={"Retry-After": str(math.ceil(exc.retry_after))},
+        )
     if success:
         return RedirectResponse(url="/progetto", status_code=303)
     return templates.TemplateResponse("login.html", {"request": request, "error": "Credenziali non valide"})
@@ -92,39 +220,44 @@ async def logout(request: Request):
 
 
 @app.get("/progetto", response_class=HTMLResponse)
-async def select_project(request: Request, db: Session = Depends(get_db)):
+async def select_project(request: Request, db: AsyncSession = Depends(get_async_db)):
     if require_login(request):
         return require_login(request)
     current_project_id = request.session.get("project_id")
     project = None
     if current_project_id:
-        project = db.query(Project).filter_by(id=current_project_id).first()
+        project = await db.get(Project, current_project_id)
     return templates.TemplateResponse("select_project.html", {"request": request, "project": project})
 
 
-@app.post("/progetto")
-async def set_project(request: Request, project_name: str = Form(...), db: Session = Depends(get_db)):
-    if require_login(request):
-        return require_login(request)
-    project = db.query(Project).filter_by(name=project_name.strip()).first()
+def project_id_for_name(db: Session, name: str) -> int:
+    project = db.query(Project).filter_by(name=name).first()
     if not project:
-        project = Project(name=project_name.strip())
+        project = Project(name=name)
         db.add(project)
         db.commit()
-        db.refresh(project)
-    request.session["project_id"] = project.id
+    return project.id
+
+
+@app.post("/progetto")
+async def set_project(request: Request, project_name: str = Form(...)):
+    if require_login(request):
+        return require_login(request)
+    request.session["project_id"] = await write_queue.run(project_id_for_name, project_name.strip())
     return RedirectResponse(url="/upload", status_code=303)
 
 
 @app.get("/upload", response_class=HTMLResponse)
-async def upload_page(request: Request, db: Session = Depends(get_db)):
+async def upload_page(request: Request, db: AsyncSession = Depends(get_async_db)):
     if require_login(request):
         return require_login(request)
     project_id = request.session.get("project_id")
-    project = db.query(Project).filter_by(id=project_id).first() if project_id else None
+    project = await db.get(Project, project_id) if project_id else None
     if not project:
         return RedirectResponse(url="/progetto", status_code=303)
-    return templates.TemplateResponse("upload_documents.html", {"request": request, "project": project})
+    return templates.TemplateResponse(
+        "upload_documents.html", {"request": request, "project": project, "error": None}
+    )
 
 
 @app.post("/process", response_class=HTMLResponse)
@@ -133,92 +266,367 @@ async def process_documents(
     cv: UploadFile = File(...),
     documento_identita: UploadFile = File(...),
     tessera_sanitaria: UploadFile = File(...),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
     if require_login(request):
         return require_login(request)
     project_id = request.session.get("project_id")
-    project = db.query(Project).filter_by(id=project_id).first() if project_id else None
+    project = await db.get(Project, project_id) if project_id else None
     if not project:
         return RedirectResponse(url="/progetto", status_code=303)
 
-    cv_path = save_upload(cv, UPLOAD_DIR / f"cv_{cv.filename}")
-    doc_path = save_upload(documento_identita, UPLOAD_DIR / f"doc_{documento_identita.filename}")
-    tess_path = save_upload(tessera_sanitaria, UPLOAD_DIR / f"tess_{tessera_sanitaria.filename}")
-
-    testo_cv, _ = extract_text(str(cv_path))
-    testo_doc, _ = extract_text(str(doc_path))
-    testo_tess, _ = extract_text(str(tess_path))
-
-    data = extract_fields_with_ai(testo_cv, testo_doc, testo_tess)
-    alerts = build_alerts(data)
-
-    person = Person(
-        project_id=project.id,
-        nome=data.get("nome", ""),
-        cognome=data.get("cognome", ""),
-        codice_fiscale=data.get("codice_fiscale", ""),
-        indirizzo_domicilio=data.get("indirizzo_domicilio", ""),
-        indirizzo_residenza=data.get("indirizzo_residenza", ""),
-        data_nascita=data.get("data_nascita", ""),
-        comune_nascita=data.get("comune_nascita", ""),
-        provincia_nascita=data.get("provincia_nascita", ""),
-        sesso=data.get("sesso", ""),
-        numero_documento=data.get("numero_documento", ""),
-        ente_rilascio=data.get("ente_rilascio", ""),
-        data_rilascio=data.get("data_rilascio", ""),
-        data_scadenza=data.get("data_scadenza", ""),
-        titolo_studio_piu_recente=data.get("titolo_studio_piu_recente", {}).get("titolo", ""),
-        data_conseguimento_titolo=data.get("titolo_studio_piu_recente", {}).get("data_conseguimento", ""),
-        situazione_occupazionale=data.get("situazione_occupazionale", ""),
-        privacy_ok=bool(data.get("privacy_clause_present")),
-        cv_firmato=bool(data.get("firma_presente")),
-        data_cv=data.get("data_cv", ""),
-    )
-    db.add(person)
-    db.commit()
-    db.refresh(person)
+    try:
+        with job_timings() as timings:
+            stored = {
+                "cv": await store_upload(cv),
+                "doc": await store_upload(documento_identita),
+                "tess": await store_upload(tessera_sanitaria),
+            }
+    except UploadRejected as exc:
+        return templates.TemplateResponse(
+            "upload_documents.html", {"request": request, "project": project, "error": str(exc)}
+        )
+
+    job_id = await write_queue.run(create_job, project.id, stored, timings)
+    runner.enqueue(job_id)
+    return RedirectResponse(url=f"/jobs/{job_id}", status_code=303)
+
+
+def job_status_payload(job: Job) -> dict:
+    return {
+        "id": job.id,
+        "status": job.status,
+        "stage": job.stage,
+        "attempts": job.attempts,
+        "error": job.error,
+        "person_id": job.person_id,
+        "alerts": job.alerts,
+        "timings": job.timings,
+    }
+
+
+@app.get("/jobs/{job_id}/status")
+async def job_status(request: Request, job_id: int, db: AsyncSession = Depends(get_async_db)):
+    if require_login(request):
+        return JSONResponse({"error": "login richiesto"}, status_code=401)
+    job = await db.get(Job, job_id)
+    if not job:
+        return JSONResponse({"error": "job non trovato"}, status_code=404)
+    return job_status_payload(job)
+
 
+@app.get("/jobs/{job_id}", response_class=HTMLResponse)
+async def job_result(request: Request, job_id: int, db: AsyncSession = Depends(get_async_db)):
+    if require_login(request):
+        return require_login(request)
+    job = await db.get(Job, job_id, options=[joinedload(Job.project), joinedload(Job.person)])
+    if not job:
+        return RedirectResponse(url="/progetti", status_code=303)
+    if job.status != "done":
+        return templates.TemplateResponse(
+            "job_status.html", {"request": request, "project": job.project, "job": job}
+        )
     return templates.TemplateResponse(
         "results.html",
         {
             "request": request,
-            "project": project,
-            "data": data,
-            "alerts": alerts,
+            "project": job.project,
+            "person": job.person,
+            "data": job.data,
+            "alerts": job.alerts or [],
+        },
+    )
+
+
+@app.post("/jobs/{job_id}/retry")
+async def job_retry(request: Request, job_id: int):
+    if require_login(request):
+        return require_login(request)
+    await runner.retry(job_id)
+    return RedirectResponse(url=f"/jobs/{job_id}", status_code=303)
+
+
+@app.get("/batch", response_class=HTMLResponse)
+async def batch_page(request: Request, db: AsyncSession = Depends(get_async_db)):
+    if require_login(request):
+        return require_login(request)
+    project_id = request.session.get("project_id")
+    project = await db.get(Project, project_id) if project_id else None
+    if not project:
+        return RedirectResponse(url="/progetto", status_code=303)
+    return templates.TemplateResponse("batch_upload.html", {"request": request, "project": project, "error": None})
+
+
+@app.post("/batch")
+async def batch_upload(
+    request: Request,
+    archive: Optional[UploadFile] = File(None),
+    directory: str = Form(""),
+    db: AsyncSession = Depends(get_async_db),
+):
+    if require_login(request):
+        return require_login(request)
+    project_id = request.session.get("project_id")
+    project = await db.get(Project, project_id) if project_id else None
+    if not project:
+        return RedirectResponse(url="/progetto", status_code=303)
+
+    if archive is not None and archive.filename:
+        batch_dir = UPLOAD_DIR / "batches" / uuid.uuid4().hex
+        batch_dir.mkdir(parents=True, exist_ok=True)
+        archive_path = batch_dir / "archive.zip"
+        try:
+            await store_archive(archive, archive_path)
+        except UploadRejected as exc:
+            batch_dir.rmdir()
+            return templates.TemplateResponse(
+                "batch_upload.html", {"request": request, "project": project, "error": str(exc)}
+            )
+        batch_id = await write_queue.run(create_batch, project.id, archive.filename)
+        runner.spawn(process_batch(batch_id, lambda: ingest_archive(archive_path)))
+    elif directory.strip():
+        try:
+            path = resolve_import_dir(directory.strip())
+        except ValueError as exc:
+            return templates.TemplateResponse(
+                "batch_upload.html", {"request": request, "project": project, "error": str(exc)}
+            )
+        batch_id = await write_queue.run(create_batch, project.id, directory.strip())
+        runner.spawn(process_batch(batch_id, lambda: ingest_directory(path)))
+    else:
+        return templates.TemplateResponse(
+            "batch_upload.html",
+            {"request": request, "project": project, "error": "Carica un archivio ZIP o indica una cartella"},
+        )
+    return RedirectResponse(url=f"/batch/{batch_id}", status_code=303)
+
+
+@app.get("/batch/{batch_id}", response_class=HTMLResponse)
+async def batch_status(request: Request, batch_id: int, db: AsyncSession = Depends(get_async_db)):
+    if require_login(request):
+        return require_login(request)
+    batch = await db.get(Batch, batch_id, options=[joinedload(Batch.project)])
+    if not batch:
+        return RedirectResponse(url="/progetti", status_code=303)
+    progress = await db.run_sync(batch_progress, batch.id)
+    jobs = (await db.scalars(select(Job).where(Job.batch_id == batch.id).order_by(Job.candidate))).all()
+    in_progress = batch.status == "pending" or progress.get("pending", 0) + progress.get("running", 0) > 0
+    return templates.TemplateResponse(
+        "batch_status.html",
+        {
+            "request": request,
+            "project": batch.project,
+            "batch": batch,
+            "progress": progress,
+            "jobs": jobs,
+            "in_progress": in_progress,
         },
     )
 
 
 @app.get("/progetti", response_class=HTMLResponse)
-async def list_projects(request: Request, db: Session = Depends(get_db)):
+async def list_projects(request: Request, cursor: Optional[str] = None, db: AsyncSession = Depends(get_async_db)):
     if require_login(request):
         return require_login(request)
-    projects = db.query(Project).order_by(Project.created_at.desc()).all()
-    return templates.TemplateResponse("projects_list.html", {"request": request, "projects": projects})
+
+    async def render() -> Response:
+        projects, next_cursor = await project_page(db, cursor)
+        counts = await project_counts(db, [project.id for project in projects])
+        return templates.TemplateResponse(
+            "projects_list.html",
+            {
+                "request": request,
+                "projects": projects,
+                "counts": counts,
+                "cursor": cursor,
+                "next_cursor": next_cursor,
+            },
+        )
+
+    return await cached_page(request, await projects_validator(db), render, RULE_SET)
 
 
 @app.get("/progetti/{project_id}", response_class=HTMLResponse)
-async def project_detail(request: Request, project_id: int, db: Session = Depends(get_db)):
+async def project_detail(
+    request: Request,
+    project_id: int,
+    cursor: Optional[str] = None,
+    con_alert: bool = False,
+    alert: str = "",
+    db: AsyncSession = Depends(get_async_db),
+):
+    if require_login(request):
+        return require_login(request)
+    validator = await project_validator(db, project_id)
+    if validator is None:
+        return RedirectResponse(url="/progetti", status_code=303)
+
+    async def render() -> Response:
+        project = await db.get(Project, project_id)
+        rule = alert if alert in RULE_MESSAGES else None
+        persons, next_cursor = await person_page(db, project.id, cursor, only_alerts=con_alert, rule=rule)
+        counts = (await project_counts(db, [project.id]))[project.id]
+        return templates.TemplateResponse(
+            "project_detail.html",
+            {
+                "request": request,
+                "project": project,
+                "persons": persons,
+                "counts": counts,
+                "rules": await rule_counts(db, project.id),
+                "rule": rule,
+                "con_alert": con_alert,
+                # Carried over by the pagination links
+                "filter_query": f"&alert={rule}" if rule else "&con_alert=true" if con_alert else "",
+                "cursor": cursor,
+                "next_cursor": next_cursor,
+            },
+        )
+
+    return await cached_page(request, validator, render, RULE_SET)
+
+
+def export_response(fmt: str, label: str, **filters) -> StreamingResponse:
+    fmt = fmt if fmt in MEDIA_TYPES else "csv"
+    # A sync iterator: Starlette pulls each chunk in the threadpool, so the DB reads stay off the event loop
+    return StreamingResponse(
+        export_stream(fmt, iter_persons(**filters)),
+        media_type=MEDIA_TYPES[fmt],
+        headers={"Content-Disposition": f'attachment; filename="{export_filename(fmt, label)}"'},
+    )
+
+
+def parse_day(value: str) -> Optional[date]:
+    try:
+        return date.fromisoformat(value) if value else None
+    except ValueError:
+        return None
+
+
+@app.get("/progetti/{project_id}/export")
+async def export_project(
+    request: Request,
+    project_id: int,
+    formato: str = "csv",
+    con_alert: bool = False,
+    db: AsyncSession = Depends(get_async_db),
+):
     if require_login(request):
         return require_login(request)
-    project = db.query(Project).filter_by(id=project_id).first()
+    project = await db.get(Project, project_id)
     if not project:
         return RedirectResponse(url="/progetti", status_code=303)
-    persons = db.query(Person).filter_by(project_id=project.id).all()
+    return export_response(formato, project.name, project_ids=[project.id], only_alerts=con_alert)
+
+
+@app.get("/export")
+async def export_persons(
+    request: Request,
+    formato: str = "csv",
+    progetto: List[str] = Query([]),
+    con_alert: bool = False,
+    dal: str = "",
+    al: str = "",
+):
+    # Across projects: the ticked projects (all when none is), optionally only persons with alerts
+    # and created between dal and al, both days included
+    if require_login(request):
+        return require_login(request)
+    start, end = parse_day(dal), parse_day(al)
+    return export_response(
+        formato,
+        "progetti",
+        project_ids=[int(value) for value in progetto if value.isdigit()],
+        only_alerts=con_alert,
+        created_from=datetime.combine(start, datetime.min.time()) if start else None,
+        created_to=datetime.combine(end + timedelta(days=1), datetime.min.time()) if end else None,
+    )
+
+
+@app.get("/cerca", response_class=HTMLResponse)
+async def search(
+    request: Request,
+    q: str = "",
+    campo: str = "",
+    progetto: str = "",
+    db: AsyncSession = Depends(get_async_db),
+):
+    if require_login(request):
+        return require_login(request)
+    # The project select sends an empty string for "all projects"
+    project_id = int(progetto) if progetto.isdigit() else None
+    results = await db.run_sync(search_persons, q, campo or None, project_id) if q.strip() else []
+    projects = (await db.execute(select(Project.id, Project.name).order_by(Project.name))).all()
     return templates.TemplateResponse(
-        "project_detail.html", {"request": request, "project": project, "persons": persons}
+        "search.html",
+        {
+            "request": request,
+            "q": q,
+            "campo": campo,
+            "progetto": project_id,
+            "limit": SEARCH_LIMIT,
+            "projects": projects,
+            "results": results,
+        },
     )
 
 
+DOCUMENT_KINDS = {"cv": "CV", "doc": "Documento di identità", "tess": "Tessera sanitaria"}
+
+
 @app.get("/persone/{person_id}", response_class=HTMLResponse)
-async def person_detail(request: Request, person_id: int, db: Session = Depends(get_db)):
+async def person_detail(request: Request, person_id: int, db: AsyncSession = Depends(get_async_db)):
     if require_login(request):
         return require_login(request)
-    person = db.query(Person).filter_by(id=person_id).first()
-    if not person:
+    validator = await person_validator(db, person_id)
+    if validator is None:
         return RedirectResponse(url="/progetti", status_code=303)
-    project = db.query(Project).filter_by(id=person.project_id).first()
-    return templates.TemplateResponse(
-        "person_detail.html", {"request": request, "project": project, "person": person}
-    )
\ No newline at end of file
+
+    async def render() -> Response:
+        person = await db.get(Person, person_id)
+        project = await db.get(Project, person.project_id)
+        alerts = (
+            await db.scalars(
+                select(PersonAlert.message).where(PersonAlert.person_id == person.id).order_by(PersonAlert.id)
+            )
+        ).all()
+        documents = (
+            await db.execute(
+                select(PersonDocument.kind, PersonDocument.filename, Blob.mime)
+                .join(Blob, Blob.sha256 == PersonDocument.blob_sha256)
+                .where(PersonDocument.person_id == person.id)
+            )
+        ).all()
+        return templates.TemplateResponse(
+            "person_detail.html",
+            {
+                "request": request,
+                "project": project,
+                "person": person,
+                "alerts": alerts,
+                # Stale until the next recompute, e.g. right after a rule change
+                "alerts_stale": person.alerts_version != RULE_SET,
+                "documents": sorted(documents, key=lambda document: list(DOCUMENT_KINDS).index(document.kind)),
+                "document_kinds": DOCUMENT_KINDS,
+            },
+        )
+
+    return await cached_page(request, validator, render, RULE_SET)
+
+
+@app.get("/persone/{person_id}/documenti/{kind}")
+async def person_document(request: Request, person_id: int, kind: str, db: AsyncSession = Depends(get_async_db)):
+    # The uploaded file, for the previews of the person page; Range requests supported
+    if require_login(request):
+        return require_login(request)
+    row = (
+        await db.execute(
+            select(PersonDocument.filename, Blob.sha256, Blob.mime)
+            .join(Blob, Blob.sha256 == PersonDocument.blob_sha256)
+            .where(PersonDocument.person_id == person_id, PersonDocument.kind == kind)
+        )
+    ).first()
+    path = blob_path(row.sha256, row.mime) if row else None
+    if path is None or not await asyncio.to_thread(path.is_file):
+        return PlainTextResponse("documento non trovato", status_code=404)
+    return await asyncio.to_thread(file_response, request, path, row.mime, row.sha256, row.filename)
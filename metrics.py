@@ -0,0 +1,185 @@
+import bisect
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Optional, Tuple
+
+# In-process Prometheus metrics, rendered in the text exposition format at GET /metrics.
+# METRICS_ENABLED=0 turns every observation into a no-op and removes the endpoint and the
+# request middleware. The per-job timings (job_timings) are kept either way: they are stored
+# on the Job and copied to the Person it creates.
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+# Seconds; the pipeline spans milliseconds (DB, uploads) to minutes (OCR of long scans)
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+_registry: List["Metric"] = []
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Metric:
+    kind = ""
+
+    def __init__(self, name: str, description: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labels)
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        header = f"# HELP {self.name} {self.description}\n# TYPE {self.name} {self.kind}\n"
+        return header + "".join(line + "\n" for line in self.samples())
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, description: str, labels: Tuple[str, ...] = ()):
+        super().__init__(name, description, labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        if not METRICS_ENABLED:
+            return
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = list(self._values.items())
+        return [f"{self.name}{_labels(self.labels, key)} {value}" for key, value in values]
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, description: str, labels: Tuple[str, ...] = (), buckets=BUCKETS):
+        super().__init__(name, description, labels)
+        self.buckets = tuple(buckets)
+        # key -> [count per bucket (+Inf last), sum]
+        self._values: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        if not METRICS_ENABLED:
+            return
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = [(key, list(counts), total) for key, (counts, total) in self._values.items()]
+        lines = []
+        for key, counts, total in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                le = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_labels(self.labels, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labels, key)} {total}")
+            lines.append(f"{self.name}_count{_labels(self.labels, key)} {cumulative}")
+        return lines
+
+
+def render() -> str:
+    return "".join(metric.render() for metric in _registry)
+
+
+STAGE_SECONDS = Histogram(
+    "pipeline_stage_seconds", "Time spent in each stage of the candidate pipeline", ("stage",)
+)
+OCR_PAGE_SECONDS = Histogram(
+    "ocr_page_seconds", "OCR time per PDF page or image, by page classification", ("kind",)
+)
+LLM_REQUEST_SECONDS = Histogram("llm_request_seconds", "Duration of the model calls, retries included", ("part",))
+LLM_TOKENS = Counter("llm_tokens_total", "Tokens sent to and received from the model", ("part", "direction"))
+LLM_RETRIES = Counter("llm_retries_total", "Model calls retried after a transient error", ("part",))
+CANDIDATE_REUSES = Counter(
+    "candidate_reuses_total", "Identity document reads skipped for a returning candidate", ("stage",)
+)
+PAGE_CACHE = Counter(
+    "http_page_cache_total", "Page views answered 304, from the page cache (hit) or rendered (miss)", ("result",)
+)
+HTTP_SECONDS = Histogram(
+    "http_request_duration_seconds", "Latency of the HTTP requests", ("method", "route", "status")
+)
+
+_job: ContextVar[Optional[dict]] = ContextVar("job_timings", default=None)
+
+
+@contextmanager
+def job_timings(timings: Optional[dict] = None) -> Iterator[dict]:
+    # Everything recorded inside the block, including tasks and threads started from it, is
+    # also added to the returned dict: stage -> seconds, plus "pages" and "llm"
+    timings = {} if timings is None else timings
+    token = _job.set(timings)
+    try:
+        yield timings
+    finally:
+        _job.reset(token)
+
+
+def record(stage: str, seconds: float) -> None:
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    timings = _job.get()
+    if timings is not None:
+        timings[stage] = round(timings.get(stage, 0) + seconds, 4)
+
+
+@contextmanager
+def timed(stage: str) -> Iterator[None]:
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage, time.perf_counter() - start)
+
+
+def record_page(document: str, page: int, kind: str, seconds: float) -> None:
+    # page: 0-based number in a PDF, -1 for an image
+    OCR_PAGE_SECONDS.observe(seconds, kind=kind)
+    timings = _job.get()
+    if timings is not None:
+        timings.setdefault("pages", []).append(
+            {"document": document, "page": page, "kind": kind, "seconds": round(seconds, 4)}
+        )
+
+
+def record_llm(part: str, seconds: float, input_tokens: int, output_tokens: int, retries: int) -> None:
+    LLM_REQUEST_SECONDS.observe(seconds, part=part)
+    LLM_TOKENS.inc(input_tokens, part=part, direction="input")
+    LLM_TOKENS.inc(output_tokens, part=part, direction="output")
+    if retries:
+        LLM_RETRIES.inc(retries, part=part)
+    timings = _job.get()
+    if timings is not None:
+        llm = timings.setdefault("llm", {"calls": 0, "retries": 0, "input_tokens": 0, "output_tokens": 0})
+        llm["calls"] += 1
+        llm["retries"] += retries
+        llm["input_tokens"] += input_tokens
+        llm["output_tokens"] += output_tokens
@@ -0,0 +1,389 @@
+import sys
+from datetime import datetime
+from typing import Callable, List, NamedTuple
+
+from sqlalchemy import (
+    JSON,
+    Boolean,
+    Column,
+    DateTime,
+    ForeignKey,
+    Index,
+    Integer,
+    MetaData,
+    String,
+    Table,
+    Text,
+    UniqueConstraint,
+    bindparam,
+    inspect,
+    select,
+    text,
+    update,
+)
+from sqlalchemy.engine import Connection
+from sqlalchemy.exc import IntegrityError
+
+import fast_extract
+from database import engine
+
+# Versioned schema changes, applied in order and recorded in schema_version.
+#   python migrations.py          apply the pending ones
+#   python migrations.py status   print the current and the latest version
+# The application applies them at startup too, unless MIGRATE_ON_STARTUP=0: then it only
+# reports not ready until someone runs this command. A schema change (new table, column or
+# index) gets a new entry at the end of MIGRATIONS; applied entries are never edited.
+# Every migration declares the tables and columns it adds as they were then, never through
+# models.py, which only describes the latest schema. Each step checks before it creates, since
+# two workers starting together may both apply it (see migrate).
+
+
+class Migration(NamedTuple):
+    version: int
+    description: str
+    apply: Callable[[], None]
+
+
+def _referenced(metadata: MetaData, *names: str) -> None:
+    # Stand-ins for existing tables, so that the foreign keys of the new ones resolve
+    for name in names:
+        Table(name, metadata, Column("id", Integer, primary_key=True))
+
+
+def _add_columns(connection: Connection, table: Table) -> None:
+    # ALTER TABLE ... ADD COLUMN for the columns of table missing from the database, nullable
+    # whatever the declaration: the existing rows have no value for them
+    existing = {column["name"] for column in inspect(connection).get_columns(table.name)}
+    for column in table.columns:
+        if column.name in existing:
+            continue
+        definition = f"{column.name} {column.type.compile(connection.dialect)}"
+        for foreign_key in column.foreign_keys:
+            target_table, target_column = foreign_key.target_fullname.split(".")
+            definition += f" REFERENCES {target_table} ({target_column})"
+        connection.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {definition}"))
+
+
+def _create_indexes(connection: Connection, *tables: Table) -> None:
+    for table in tables:
+        for index in table.indexes:
+            index.create(bind=connection, checkfirst=True)
+
+
+def _baseline_tables() -> MetaData:
+    # The schema when versioning was introduced
+    metadata = MetaData()
+    Table(
+        "users",
+        metadata,
+        Column("id", Integer, primary_key=True, index=True),
+        Column("username", String, unique=True, nullable=False),
+        Column("password_hash", String, nullable=False),
+        Column("created_at", DateTime),
+    )
+    Table(
+        "projects",
+        metadata,
+        Column("id", Integer, primary_key=True, index=True),
+        Column("name", String, unique=True, nullable=False),
+        Column("created_at", DateTime, index=True),
+    )
+    Table(
+        "persons",
+        metadata,
+        Column("id", Integer, primary_key=True, index=True),
+        Column("project_id", Integer, ForeignKey("projects.id"), nullable=False, index=True),
+        *(
+            Column(name, String, index=name == "codice_fiscale")
+            for name in (
+                "nome",
+                "cognome",
+                "codice_fiscale",
+                "indirizzo_domicilio",
+                "indirizzo_residenza",
+                "data_nascita",
+                "comune_nascita",
+                "provincia_nascita",
+                "sesso",
+                "numero_documento",
+                "ente_rilascio",
+                "data_rilascio",
+                "data_scadenza",
+                "titolo_studio_piu_recente",
+                "data_conseguimento_titolo",
+                "situazione_occupazionale",
+            )
+        ),
+        Column("privacy_ok", Boolean),
+        Column("cv_firmato", Boolean),
+        Column("data_cv", String),
+        Column("timings", JSON, nullable=True),
+        Column("created_at", DateTime, index=True),
+        Index("ix_persons_project_created", "project_id", "created_at", "id"),
+    )
+    Table(
+        "blobs",
+        metadata,
+        Column("sha256", String(64), primary_key=True),
+        Column("size", Integer, nullable=False),
+        Column("mime", String, nullable=False),
+        Column("refcount", Integer, nullable=False, index=True),
+        Column("created_at", DateTime),
+    )
+    Table(
+        "person_documents",
+        metadata,
+        Column("id", Integer, primary_key=True, index=True),
+        Column("person_id", Integer, ForeignKey("persons.id"), nullable=False, index=True),
+        Column("kind", String, nullable=False),
+        Column("blob_sha256", String(64), ForeignKey("blobs.sha256"), nullable=False, index=True),
+        Column("filename", String),
+        Column("extracted_text", Text, nullable=True),
+        Column("created_at", DateTime),
+    )
+    Table(
+        "batches",
+        metadata,
+        Column("id", Integer, primary_key=True, index=True),
+        Column("project_id", Integer, ForeignKey("projects.id"), nullable=False),
+        Column("source", String),
+        Column("status", String),
+        Column("errors", JSON),
+        Column("created_at", DateTime),
+        Column("finished_at", DateTime, nullable=True),
+    )
+    Table(
+        "jobs",
+        metadata,
+        Column("id", Integer, primary_key=True, index=True),
+        Column("project_id", Integer, ForeignKey("projects.id"), nullable=False),
+        Column("batch_id", Integer, ForeignKey("batches.id"), nullable=True, index=True),
+        Column("candidate", String),
+        Column("status", String, index=True),
+        Column("stage", String),
+        Column("attempts", Integer),
+        Column("error", Text),
+        Column("cv_path", String, nullable=False),
+        Column("doc_path", String, nullable=False),
+        Column("tess_path", String, nullable=False),
+        *(Column(name, JSON, nullable=True) for name in ("documents", "texts", "data", "alerts", "timings")),
+        Column("person_id", Integer, ForeignKey("persons.id"), nullable=True),
+        Column("created_at", DateTime),
+        Column("updated_at", DateTime),
+    )
+    return metadata
+
+
+# The search index at versioning (see search.py), with the statement filling it from the
+# persons already stored: SQLite FTS5, rowid = persons.id, or a weighted tsvector on PostgreSQL
+BASELINE_SEARCH_SQLITE = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS person_search USING fts5("
+    "nome, cognome, codice_fiscale, titolo, documenti, progetto, "
+    "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3 4')"
+]
+BASELINE_SEARCH_SQLITE_FILL = (
+    "INSERT INTO person_search (rowid, nome, cognome, codice_fiscale, titolo, documenti, progetto) "
+    "SELECT p.id, COALESCE(p.nome, ''), COALESCE(p.cognome, ''), COALESCE(p.codice_fiscale, ''), "
+    "COALESCE(p.titolo_studio_piu_recente, ''), "
+    "COALESCE((SELECT group_concat(d.extracted_text, char(10)) FROM person_documents d "
+    "WHERE d.person_id = p.id AND d.extracted_text != ''), ''), CAST(p.project_id AS TEXT) "
+    "FROM persons p"
+)
+BASELINE_SEARCH_POSTGRES = [
+    "CREATE TABLE IF NOT EXISTS person_search ("
+    "person_id INTEGER PRIMARY KEY REFERENCES persons(id) ON DELETE CASCADE, "
+    "project_id INTEGER NOT NULL, document TSVECTOR NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS ix_person_search_document ON person_search USING GIN (document)",
+    "CREATE INDEX IF NOT EXISTS ix_person_search_project ON person_search (project_id)",
+]
+BASELINE_SEARCH_POSTGRES_FILL = (
+    "INSERT INTO person_search (person_id, project_id, document) "
+    "SELECT p.id, p.project_id, "
+    "setweight(to_tsvector('simple', COALESCE(p.nome, '') || ' ' || COALESCE(p.cognome, '')), 'A') || "
+    "setweight(to_tsvector('simple', COALESCE(p.codice_fiscale, '')), 'B') || "
+    "setweight(to_tsvector('simple', COALESCE(p.titolo_studio_piu_recente, '')), 'C') || "
+    "setweight(to_tsvector('simple', COALESCE((SELECT string_agg(d.extracted_text, E'\\n' ORDER BY d.kind) "
+    "FROM person_documents d WHERE d.person_id = p.id AND d.extracted_text != ''), '')), 'D') "
+    "FROM persons p ON CONFLICT (person_id) DO NOTHING"
+)
+
+
+def _baseline_search(connection: Connection) -> None:
+    postgres = connection.dialect.name == "postgresql"
+    for statement in BASELINE_SEARCH_POSTGRES if postgres else BASELINE_SEARCH_SQLITE:
+        connection.execute(text(statement))
+    # A database that had persons before the index existed: index them once
+    if connection.execute(text("SELECT 1 FROM person_search LIMIT 1")).first() is None:
+        connection.execute(text(BASELINE_SEARCH_POSTGRES_FILL if postgres else BASELINE_SEARCH_SQLITE_FILL))
+
+
+def _baseline() -> None:
+    # Idempotent, so it also brings databases created by the old create_all-at-import up to
+    # date: the tables they lack, then the columns and indexes added to the others over time
+    metadata = _baseline_tables()
+    with engine.begin() as connection:
+        metadata.create_all(bind=connection)
+        for table in metadata.sorted_tables:
+            _add_columns(connection, table)
+        _create_indexes(connection, *metadata.sorted_tables)
+        _baseline_search(connection)
+
+
+def _candidates() -> None:
+    metadata = MetaData()
+    _referenced(metadata, "projects")
+    candidates = Table(
+        "candidates",
+        metadata,
+        Column("id", Integer, primary_key=True, index=True),
+        Column("codice_fiscale", String, unique=True, nullable=False),
+        *(
+            Column(name, String)
+            for name in (
+                "nome",
+                "cognome",
+                "data_nascita",
+                "comune_nascita",
+                "provincia_nascita",
+                "sesso",
+                "numero_documento",
+                "ente_rilascio",
+                "data_rilascio",
+                "data_scadenza",
+                "indirizzo_residenza",
+            )
+        ),
+        Column("doc_sha256", String(64), nullable=True, index=True),
+        Column("created_at", DateTime),
+        Column("updated_at", DateTime),
+    )
+    persons = Table(
+        "persons",
+        MetaData(),
+        Column("candidate_id", Integer, ForeignKey("candidates.id"), nullable=True, index=True),
+    )
+    with engine.begin() as connection:
+        candidates.create(bind=connection, checkfirst=True)
+        _add_columns(connection, persons)
+        _create_indexes(connection, candidates, persons)
+
+
+def _stored_alerts() -> None:
+    # The existing persons get their alerts from the first recompute: alerts_version starts None
+    metadata = MetaData()
+    _referenced(metadata, "projects", "persons")
+    person_alerts = Table(
+        "person_alerts",
+        metadata,
+        Column("id", Integer, primary_key=True, index=True),
+        Column("person_id", Integer, ForeignKey("persons.id"), nullable=False, index=True),
+        Column("project_id", Integer, ForeignKey("projects.id"), nullable=False),
+        Column("rule", String, nullable=False),
+        Column("message", String, nullable=False),
+        UniqueConstraint("person_id", "rule"),
+        Index("ix_person_alerts_project_rule", "project_id", "rule", "person_id"),
+    )
+    alert_state = Table(
+        "alert_state",
+        metadata,
+        Column("id", Integer, primary_key=True),
+        Column("evaluated_on", String(10), nullable=False),
+    )
+    persons = Table(
+        "persons",
+        MetaData(),
+        Column("id", Integer, primary_key=True),
+        Column("nome", String),
+        Column("cognome", String),
+        Column("alerts_version", String, nullable=True, index=True),
+        Column("cf_nome_cognome", String),
+    )
+    with engine.begin() as connection:
+        metadata.create_all(bind=connection, tables=[person_alerts, alert_state])
+        _add_columns(connection, persons)
+        _create_indexes(connection, person_alerts, persons)
+        rows = connection.execute(select(persons.c.id, persons.c.nome, persons.c.cognome)).all()
+        if rows:
+            connection.execute(
+                update(persons)
+                .where(persons.c.id == bindparam("person_id"))
+                .values(cf_nome_cognome=bindparam("letters")),
+                [{"person_id": row.id, "letters": fast_extract.cf_name_letters(row.nome, row.cognome)} for row in rows],
+            )
+
+
+def _project_versions() -> None:
+    projects = Table(
+        "projects",
+        MetaData(),
+        Column("version", Integer),
+        Column("updated_at", DateTime, nullable=True),
+    )
+    with engine.begin() as connection:
+        _add_columns(connection, projects)
+
+
+MIGRATIONS: List[Migration] = [
+    Migration(1, "baseline: tables, late columns, indexes, search index", _baseline),
+    Migration(2, "candidates table and persons.candidate_id", _candidates),
+    Migration(3, "stored alerts: person_alerts, alert_state, persons.alerts_version", _stored_alerts),
+    Migration(4, "projects.version and projects.updated_at", _project_versions),
+]
+LATEST_VERSION = MIGRATIONS[-1].version
+
+
+def _ensure_version_table() -> None:
+    with engine.begin() as connection:
+        connection.execute(
+            text(
+                "CREATE TABLE IF NOT EXISTS schema_version ("
+                " version INTEGER PRIMARY KEY, description TEXT NOT NULL, applied_at TIMESTAMP NOT NULL)"
+            )
+        )
+
+
+def current_version() -> int:
+    if not inspect(engine).has_table("schema_version"):
+        return 0
+    with engine.connect() as connection:
+        return connection.execute(text("SELECT COALESCE(MAX(version), 0) FROM schema_version")).scalar()
+
+
+def pending() -> List[Migration]:
+    version = current_version()
+    return [migration for migration in MIGRATIONS if migration.version > version]
+
+
+def migrate() -> List[int]:
+    # Returns the versions applied by this call
+    _ensure_version_table()
+    applied = []
+    for migration in pending():
+        migration.apply()
+        try:
+            with engine.begin() as connection:
+                connection.execute(
+                    text("INSERT INTO schema_version (version, description, applied_at) VALUES (:v, :d, :t)"),
+                    {"v": migration.version, "d": migration.description, "t": datetime.utcnow()},
+                )
+        except IntegrityError:
+            # Another worker starting at the same time applied it first
+            continue
+        applied.append(migration.version)
+    return applied
+
+
+def main(argv: List[str]) -> None:
+    if argv[:1] == ["status"]:
+        print(f"schema version {current_version()}, latest {LATEST_VERSION}")
+        return
+    # The same listeners as the server, for any data migration that writes through a session
+    from models import register_listeners
+
+    register_listeners()
+    applied = migrate()
+    print(f"applied {applied}" if applied else "schema already up to date", f"(version {current_version()})")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -1,5 +1,5 @@
 from datetime import datetime
-from sqlalchemy import Column, Integer, String, DateTime, Boolean, ForeignKey
+from sqlalchemy import Column, Integer, String, DateTime, Boolean, ForeignKey, Index, JSON, Text, UniqueConstraint
 from sqlalchemy.orm import relationship
 
 from database import Base
@@ -19,19 +19,51 @@ class Project(Base):
 
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, unique=True, nullable=False)
-    created_at = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+    # Bumped with updated_at whenever its persons, their documents or alerts change (see versions.py)
+    version = Column(Integer, default=0)
+    updated_at = Column(DateTime, nullable=True)
 
     persons = relationship("Person", back_populates="project", cascade="all, delete-orphan")
 
 
+class Candidate(Base):
+    __tablename__ = "candidates"
+
+    # The same person across projects, keyed by a valid codice fiscale (see candidates.py)
+    id = Column(Integer, primary_key=True, index=True)
+    codice_fiscale = Column(String, unique=True, nullable=False)
+    nome = Column(String, default="")
+    cognome = Column(String, default="")
+    data_nascita = Column(String, default="")
+    comune_nascita = Column(String, default="")
+    provincia_nascita = Column(String, default="")
+    sesso = Column(String, default="")
+    numero_documento = Column(String, default="")
+    ente_rilascio = Column(String, default="")
+    data_rilascio = Column(String, default="")
+    data_scadenza = Column(String, default="")
+    indirizzo_residenza = Column(String, default="")
+    # Blob of the identity document the fields above were read from
+    doc_sha256 = Column(String(64), nullable=True, index=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    persons = relationship("Person", back_populates="candidate")
+
+
 class Person(Base):
     __tablename__ = "persons"
+    # Keyset pagination of a project's persons walks (project_id, created_at, id)
+    __table_args__ = (Index("ix_persons_project_created", "project_id", "created_at", "id"),)
 
     id = Column(Integer, primary_key=True, index=True)
-    project_id = Column(Integer, ForeignKey("projects.id"), nullable=False)
+    project_id = Column(Integer, ForeignKey("projects.id"), nullable=False, index=True)
+    # One Person per enrolment; the candidate links the enrolments of the same person
+    candidate_id = Column(Integer, ForeignKey("candidates.id"), nullable=True, index=True)
     nome = Column(String, default="")
     cognome = Column(String, default="")
-    codice_fiscale = Column(String, default="")
+    codice_fiscale = Column(String, default="", index=True)
     indirizzo_domicilio = Column(String, default="")
     indirizzo_residenza = Column(String, default="")
     data_nascita = Column(String, default="")
@@ -48,6 +80,128 @@ class Person(Base):
     privacy_ok = Column(Boolean, default=False)
     cv_firmato = Column(Boolean, default=False)
     data_cv = Column(String, default="")
+    # Seconds per pipeline stage for the job that created it (see metrics.job_timings)
+    timings = Column(JSON, nullable=True)
+    # Rule set the stored alerts were computed with; None once the data changes (see alerts.py)
+    alerts_version = Column(String, nullable=True, index=True)
+    # First six characters of the codice fiscale expected from nome and cognome
+    cf_nome_cognome = Column(String, default="")
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+
+    project = relationship("Project", back_populates="persons")
+    candidate = relationship("Candidate", back_populates="persons")
+    documents = relationship("PersonDocument", back_populates="person", cascade="all, delete-orphan")
+    alerts = relationship("PersonAlert", back_populates="person", cascade="all, delete-orphan")
+
+
+class PersonAlert(Base):
+    __tablename__ = "person_alerts"
+    __table_args__ = (
+        UniqueConstraint("person_id", "rule"),
+        # Per-project counts by rule without touching persons
+        Index("ix_person_alerts_project_rule", "project_id", "rule", "person_id"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    person_id = Column(Integer, ForeignKey("persons.id"), nullable=False, index=True)
+    project_id = Column(Integer, ForeignKey("projects.id"), nullable=False)
+    # Code of the rule in alerts.RULES
+    rule = Column(String, nullable=False)
+    message = Column(String, nullable=False)
+
+    person = relationship("Person", back_populates="alerts")
+
+
+class AlertState(Base):
+    __tablename__ = "alert_state"
+
+    # A single row: the day the date-based alert rules were last brought up to date
+    id = Column(Integer, primary_key=True)
+    evaluated_on = Column(String(10), nullable=False)
+
+
+class Blob(Base):
+    __tablename__ = "blobs"
+
+    # Uploaded files are stored once per content hash, see storage.py
+    sha256 = Column(String(64), primary_key=True)
+    size = Column(Integer, nullable=False)
+    mime = Column(String, nullable=False)
+    # Number of PersonDocument rows pointing at the blob; 0 means it can be garbage-collected
+    refcount = Column(Integer, default=0, nullable=False, index=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+class PersonDocument(Base):
+    __tablename__ = "person_documents"
+
+    id = Column(Integer, primary_key=True, index=True)
+    person_id = Column(Integer, ForeignKey("persons.id"), nullable=False, index=True)
+    # cv, doc, tess
+    kind = Column(String, nullable=False)
+    blob_sha256 = Column(String(64), ForeignKey("blobs.sha256"), nullable=False, index=True)
+    filename = Column(String, default="")
+    # OCR text of the document, fed to the full-text index (see search.py)
+    extracted_text = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    person = relationship("Person", back_populates="documents")
+    blob = relationship("Blob")
+
+
+class Batch(Base):
+    __tablename__ = "batches"
+
+    id = Column(Integer, primary_key=True, index=True)
+    project_id = Column(Integer, ForeignKey("projects.id"), nullable=False)
+    source = Column(String, default="")
+    # pending (reading the archive) -> running -> done
+    status = Column(String, default="pending")
+    # Candidates that could not even be queued, e.g. a missing document: [{"candidate", "error"}]
+    errors = Column(JSON, default=list)
     created_at = Column(DateTime, default=datetime.utcnow)
+    finished_at = Column(DateTime, nullable=True)
+
+    project = relationship("Project")
+    jobs = relationship("Job", back_populates="batch")
+
+
+class Job(Base):
+    __tablename__ = "jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    project_id = Column(Integer, ForeignKey("projects.id"), nullable=False)
+    batch_id = Column(Integer, ForeignKey("batches.id"), nullable=True, index=True)
+    candidate = Column(String, default="")
+    # pending -> running -> done | failed
+    status = Column(String, default="pending", index=True)
+    # ocr -> extraction -> persist -> done; a retry resumes from the stage that failed
+    stage = Column(String, default="ocr")
+    attempts = Column(Integer, default=0)
+    error = Column(Text, default="")
+    cv_path = Column(String, nullable=False)
+    doc_path = Column(String, nullable=False)
+    tess_path = Column(String, nullable=False)
+    # {kind: {"sha256", "filename"}} of the stored blobs, linked to the Person once persisted
+    documents = Column(JSON, nullable=True)
+    texts = Column(JSON, nullable=True)
+    data = Column(JSON, nullable=True)
+    alerts = Column(JSON, nullable=True)
+    timings = Column(JSON, nullable=True)
+    person_id = Column(Integer, ForeignKey("persons.id"), nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    project = relationship("Project")
+    person = relationship("Person")
+    batch = relationship("Batch", back_populates="jobs")
+
 
-    project = relationship("Project", back_populates="persons")
\ No newline at end of file
+def register_listeners() -> None:
+    # The search index, blob refcounts, project versions and alert tracking are kept up to date
+    # by flush and mapper listeners that their modules attach on import. Every process that
+    # writes persons calls this once at startup (server, CLIs, tests), before its first flush
+    import alerts  # noqa: F401
+    import search  # noqa: F401
+    import storage  # noqa: F401
+    import versions  # noqa: F401
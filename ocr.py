@@ -1,40 +1,414 @@
+import asyncio
+import hashlib
+import multiprocessing
 import os
-import tempfile
-from typing import Tuple
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from threading import Lock, local
+from typing import List, NamedTuple, Optional, Sequence, Tuple
 
 import pdfplumber
 import pytesseract
-from PIL import Image
+from PIL import Image, ImageChops, ImageFilter, ImageOps
+
+from cache import ocr_cache
+from metrics import record, record_page
+
+OCR_LANG = os.getenv("OCR_LANG", "ita+eng")
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", str(os.cpu_count() or 1)))
+OCR_CACHE_ENABLED = os.getenv("OCR_CACHE_ENABLED", "1") == "1"
+# Long side, in pixels, of the image handed to tesseract: about an A4 page at 300 dpi.
+# Renders and photos are sized to it, within the dpi bounds below
+OCR_MAX_SIDE = int(os.getenv("OCR_MAX_SIDE", "3500"))
+OCR_MIN_DPI = int(os.getenv("OCR_MIN_DPI", "150"))
+OCR_MAX_DPI = int(os.getenv("OCR_MAX_DPI", "400"))
+# Pages with fewer extractable characters than this are treated as scans
+OCR_MIN_TEXT_CHARS = int(os.getenv("OCR_MIN_TEXT_CHARS", "20"))
+# A page with a text layer whose images cover at least this share of it is "mixed"
+# (typically an ID card or a signed form pasted into a typed document)...
+OCR_MIXED_IMAGE_SHARE = float(os.getenv("OCR_MIXED_IMAGE_SHARE", "0.15"))
+# ...unless the image covers about the whole page: a scan that already carries an OCR text layer
+OCR_FULL_PAGE_SHARE = 0.9
+OCR_PREPROCESS = os.getenv("OCR_PREPROCESS", "1") == "1"
+# Bump whenever the extraction logic changes in a way that alters the produced text
+OCR_PIPELINE_VERSION = "3"
+
+# Preprocessed images are always dark text on white: skip tesseract's second pass that retries
+# every uncertain line as inverted (light on dark) text
+TESSERACT_VARIABLES = {"tessedit_do_invert": "0"} if OCR_PREPROCESS else {}
+
+DESKEW_MAX_ANGLE = 5.0
+DESKEW_SIDE = 800
+BACKGROUND_SIDE = 160
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = Lock()
+
+
+def get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn: the pool is created from a threaded server, forking it is not safe
+            _pool = ProcessPoolExecutor(
+                max_workers=OCR_WORKERS, mp_context=multiprocessing.get_context("spawn")
+            )
+        return _pool
+
+
+_tesserocr = None
+_tesserocr_loaded = False
+
+
+def load_tesserocr():
+    # The in-process binding (see requirements.txt): the engine and its language data are loaded
+    # once per pool worker. None when it is missing or cannot load here: its import installs
+    # signal handlers, which fails outside the main thread. The caller then falls back to
+    # pytesseract, one tesseract process per call.
+    global _tesserocr, _tesserocr_loaded
+    if not _tesserocr_loaded:
+        try:
+            import tesserocr
+
+            _tesserocr = tesserocr
+        except (ImportError, ValueError):
+            _tesserocr = None
+        _tesserocr_loaded = True
+    return _tesserocr
+
+
+_engine_version: Optional[str] = None
+
+
+def _worker_engine_version() -> str:
+    tesserocr = load_tesserocr()
+    if tesserocr is not None:
+        return tesserocr.tesseract_version().split()[1]
+    return str(pytesseract.get_tesseract_version())
+
+
+def engine_version() -> str:
+    global _engine_version
+    if _engine_version is None:
+        try:
+            # Asked of a pool worker, which runs the OCR: the server's threads may not load tesserocr
+            _engine_version = get_pool().submit(_worker_engine_version).result()
+        except Exception:
+            _engine_version = "unknown"
+    return _engine_version
+
+
+def file_sha256(file_path: str) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as handle:
+        for chunk in iter(lambda: handle.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def cache_key(content_hash: str, kind: str) -> str:
+    settings = (
+        f"{content_hash}:{kind}:{OCR_LANG}:{OCR_MAX_SIDE}:{OCR_MIN_DPI}:{OCR_MAX_DPI}:{OCR_PREPROCESS}:"
+        f"{engine_version()}:{OCR_PIPELINE_VERSION}"
+    )
+    return hashlib.sha256(settings.encode("utf-8")).hexdigest()
+
+
+def invalidate_cache(file_path: Optional[str] = None) -> int:
+    if file_path is None:
+        return ocr_cache.invalidate()
+    kind = "pdf" if file_path.lower().endswith(".pdf") else "image"
+    return ocr_cache.invalidate(cache_key(file_sha256(file_path), kind))
+
+
+def shutdown_pool() -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+
+_engines = local()
+
+
+def _engine():
+    # One tesserocr engine per thread; pool workers run one task at a time, so one per process
+    api = getattr(_engines, "api", None)
+    if api is None:
+        api = _engines.api = load_tesserocr().PyTessBaseAPI(lang=OCR_LANG)
+        for name, value in TESSERACT_VARIABLES.items():
+            api.SetVariable(name, value)
+    return api
+
+
+def _otsu_threshold(image: Image.Image) -> int:
+    histogram = image.histogram()
+    total = sum(histogram)
+    weighted_total = sum(level * count for level, count in enumerate(histogram))
+    best_level, best_variance = 127, 0.0
+    background = weighted_background = 0
+    for level, count in enumerate(histogram):
+        background += count
+        if background == 0:
+            continue
+        foreground = total - background
+        if foreground == 0:
+            break
+        weighted_background += level * count
+        mean_background = weighted_background / background
+        mean_foreground = (weighted_total - weighted_background) / foreground
+        variance = background * foreground * (mean_background - mean_foreground) ** 2
+        if variance > best_variance:
+            best_level, best_variance = level, variance
+    return best_level
+
+
+def _binarize(image: Image.Image) -> Image.Image:
+    # Flatten uneven lighting (phone photos, shadows) by subtracting an estimate of the paper,
+    # then a global Otsu threshold on what is left. The paper is estimated on a copy about
+    # BACKGROUND_SIDE px long: it only varies slowly, and a max filter at full size costs more
+    # than the OCR. Nearest sampling, not averaging, so that lines of text do not turn into
+    # grey bands the max filter cannot see past
+    step = max(1, max(image.size) // BACKGROUND_SIDE)
+    small = image.resize((max(1, image.width // step), max(1, image.height // step)), Image.NEAREST)
+    background = small.filter(ImageFilter.MaxFilter(5)).filter(ImageFilter.BoxBlur(2))
+    background = background.resize(image.size, Image.BILINEAR)
+    flat = ImageOps.invert(ImageChops.subtract(background, image))
+    threshold = _otsu_threshold(flat)
+    return flat.point(lambda value: 255 if value > threshold else 0, "1").convert("L")
+
+
+def _line_contrast(image: Image.Image, angle: float) -> float:
+    # Rows of a level page alternate between ink and blank: the sharper the row profile, the
+    # closer the angle is to the text orientation
+    rotated = image.rotate(angle, resample=Image.BILINEAR, fillcolor=255)
+    rows = list(rotated.resize((1, rotated.height), Image.BOX).getdata())
+    return float(sum((a - b) ** 2 for a, b in zip(rows, rows[1:])))
+
+
+def estimate_skew(image: Image.Image) -> float:
+    small = image.copy()
+    small.thumbnail((DESKEW_SIDE, DESKEW_SIDE))
+    small = _binarize(small)
+    best = max(range(-int(DESKEW_MAX_ANGLE), int(DESKEW_MAX_ANGLE) + 1), key=lambda a: _line_contrast(small, a))
+    fine = [best + step / 5 for step in range(-4, 5)]
+    return max(fine, key=lambda a: _line_contrast(small, a))
+
+
+def preprocess(image: Image.Image) -> Image.Image:
+    image = ImageOps.exif_transpose(image).convert("L")
+    if max(image.size) > OCR_MAX_SIDE:
+        image.thumbnail((OCR_MAX_SIDE, OCR_MAX_SIDE), Image.LANCZOS)
+    image = ImageOps.autocontrast(image)
+    angle = estimate_skew(image)
+    if abs(angle) >= 0.4:
+        image = image.rotate(angle, resample=Image.BICUBIC, expand=True, fillcolor=255)
+    return _binarize(image)
+
+
+def ocr_image(image: Image.Image) -> str:
+    if OCR_PREPROCESS:
+        image = preprocess(image)
+    if load_tesserocr() is not None:
+        api = _engine()
+        api.SetImage(image)
+        return api.GetUTF8Text()
+    config = " ".join(f"-c {name}={value}" for name, value in TESSERACT_VARIABLES.items())
+    return pytesseract.image_to_string(image, lang=OCR_LANG, config=config)
 
 
 def extract_text_from_image(file_path: str) -> str:
     try:
-        image = Image.open(file_path)
-        return pytesseract.image_to_string(image, lang="ita+eng")
+        with Image.open(file_path) as image:
+            return ocr_image(image)
     except Exception:
         return ""
 
 
-def extract_text_from_pdf(file_path: str) -> str:
-    text = ""
+class PagePlan(NamedTuple):
+    kind: str  # "text", "scanned" or "mixed"
+    text: str  # text layer
+    resolution: int
+    regions: List[Tuple[float, float, float, float]]  # image boxes to OCR on a mixed page
+
+
+def _clip(page, image) -> Optional[Tuple[float, float, float, float]]:
+    box = (
+        max(image["x0"], 0), max(image["top"], 0),
+        min(image["x1"], float(page.width)), min(image["bottom"], float(page.height)),
+    )
+    return box if box[2] > box[0] and box[3] > box[1] else None
+
+
+def page_resolution(page, images) -> int:
+    # Enough dpi for OCR_MAX_SIDE pixels on the long side, but no more than the embedded scan
+    # actually holds: upsampling a 150 dpi scan to 300 only makes tesseract slower
+    resolution = OCR_MAX_SIDE / (max(float(page.width), float(page.height)) / 72)
+    native = [
+        image["srcsize"][0] / ((image["x1"] - image["x0"]) / 72)
+        for image in images
+        if image.get("srcsize") and image["x1"] > image["x0"]
+    ]
+    if native:
+        resolution = min(resolution, max(native))
+    return int(min(max(resolution, OCR_MIN_DPI), OCR_MAX_DPI))
+
+
+def plan_page(page) -> PagePlan:
+    text = page.extract_text() or ""
+    boxes = [box for box in (_clip(page, image) for image in page.images) if box]
+    area = float(page.width) * float(page.height)
+    covered = sum((x1 - x0) * (bottom - top) for x0, top, x1, bottom in boxes) / area if area else 0
+    resolution = page_resolution(page, page.images)
+    if len(text.strip()) < OCR_MIN_TEXT_CHARS:
+        return PagePlan("scanned", text, resolution, [])
+    if OCR_MIXED_IMAGE_SHARE <= covered < OCR_FULL_PAGE_SHARE:
+        return PagePlan("mixed", text, resolution, boxes)
+    return PagePlan("text", text, resolution, [])
+
+
+def pdf_plan(file_path: str) -> List[PagePlan]:
+    try:
+        with pdfplumber.open(file_path) as pdf:
+            return [plan_page(page) for page in pdf.pages]
+    except Exception:
+        return []
+
+
+def ocr_pdf_page(file_path: str, page_number: int, resolution: int, regions: Sequence[Tuple] = ()) -> str:
+    # The whole page, or only the given image boxes of it
     try:
         with pdfplumber.open(file_path) as pdf:
-            for page in pdf.pages:
-                text += page.extract_text() or ""
-                # Attempt OCR on images if text is empty
-                if not text.strip():
-                    with tempfile.NamedTemporaryFile(suffix=".png", delete=False) as tmp_image:
-                        page_image = page.to_image(resolution=300)
-                        page_image.save(tmp_image.name, format="PNG")
-                        text += extract_text_from_image(tmp_image.name)
-                        os.unlink(tmp_image.name)
+            page = pdf.pages[page_number]
+            # Rendered in memory and handed straight to tesseract, no PNG round trip on disk
+            crops = [page.crop(box) for box in regions] or [page]
+            return "\n".join(ocr_image(crop.to_image(resolution=resolution).original) for crop in crops)
     except Exception:
-        return text
-    return text
+        return ""
+
+
+def extract_text_from_pdf(file_path: str) -> str:
+    return extract_texts([file_path])[0][0]
+
+
+def _cache_keys(
+    file_paths: Sequence[str], kinds: Sequence[str], content_hashes: Sequence[Optional[str]]
+) -> List[Optional[str]]:
+    keys: List[Optional[str]] = []
+    for path, kind, content_hash in zip(file_paths, kinds, content_hashes):
+        try:
+            keys.append(cache_key(content_hash or file_sha256(path), kind) if OCR_CACHE_ENABLED else None)
+        except OSError:
+            keys.append(None)
+    return keys
+
+
+async def extract_texts_async(
+    file_paths: Sequence[str], content_hashes: Optional[Sequence[Optional[str]]] = None
+) -> List[Tuple[str, str]]:
+    # One (text, kind) pair per input, in input order, same as extract_text.
+    # content_hashes: SHA-256 of each file when the caller already knows it (stored blobs).
+    # Only the short cache reads and writes take a thread; the OCR itself is awaited on the pool
+    kinds = ["pdf" if path.lower().endswith(".pdf") else "image" for path in file_paths]
+    keys = await asyncio.to_thread(_cache_keys, file_paths, kinds, content_hashes or [None] * len(file_paths))
+    cached = await asyncio.to_thread(lambda: [ocr_cache.get(key) if key else None for key in keys])
+    missing = [index for index, text in enumerate(cached) if text is None]
+    if missing:
+        computed = await _run_ocr([file_paths[index] for index in missing], [kinds[index] for index in missing])
+        fresh = {}
+        for index, text in zip(missing, computed):
+            cached[index] = text
+            # Empty output is usually a transient failure, so it is never cached
+            if keys[index] and text.strip():
+                fresh[keys[index]] = text
+        for key, text in fresh.items():
+            await asyncio.to_thread(ocr_cache.set, key, text)
+    return list(zip(cached, kinds))
+
+
+def extract_texts(
+    file_paths: Sequence[str], content_hashes: Optional[Sequence[Optional[str]]] = None
+) -> List[Tuple[str, str]]:
+    # Sync only, for scripts and threads without an event loop: inside one, await
+    # extract_texts_async instead (asyncio.run cannot nest)
+    _require_no_loop("extract_texts")
+    return asyncio.run(extract_texts_async(file_paths, content_hashes))
+
+
+def _require_no_loop(name: str) -> None:
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return
+    raise RuntimeError(f"ocr.{name} blocks and cannot run inside an event loop: await ocr.extract_texts_async")
+
+
+def _timed(function, *args):
+    # Runs in the pool worker; the timing travels back with the result and is recorded by the caller
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+async def _result(future: Future, default, record_time):
+    try:
+        result, seconds = await asyncio.wrap_future(future)
+    except Exception:
+        return default
+    record_time(seconds)
+    return result
+
+
+async def _pdf_text(pool: ProcessPoolExecutor, path: str, plan_future: Future) -> str:
+    # Every page is judged on its own: scans are OCR'd whole, mixed pages only in their image
+    # regions, and all of them in parallel across the pool
+    name = os.path.basename(path)
+    plans: List[PagePlan] = await _result(plan_future, [], lambda seconds: record("ocr_text_layer", seconds))
+    pages = {
+        number: pool.submit(_timed, ocr_pdf_page, path, number, plan.resolution, plan.regions)
+        for number, plan in enumerate(plans)
+        if plan.kind != "text"
+    }
+    texts = await asyncio.gather(
+        *(
+            _result(future, "", lambda seconds, number=number: record_page(name, number, plans[number].kind, seconds))
+            for number, future in pages.items()
+        )
+    )
+    ocr_texts = dict(zip(pages, texts))
+    parts = []
+    for number, plan in enumerate(plans):
+        if plan.kind == "scanned":
+            parts.append(ocr_texts[number])
+        elif plan.kind == "mixed":
+            parts.append(plan.text + "\n" + ocr_texts[number])
+        else:
+            parts.append(plan.text)
+    return "\n".join(parts)
+
+
+async def _run_ocr(file_paths: Sequence[str], kinds: Sequence[str]) -> List[str]:
+    # Awaits the pool's futures rather than blocking a thread on them: a job's OCR holds no
+    # thread of the default executor, which the uploads and the job stages' DB calls share
+    pool = get_pool()
+    first_pass: List[Future] = [
+        pool.submit(_timed, pdf_plan if kind == "pdf" else extract_text_from_image, path)
+        for path, kind in zip(file_paths, kinds)
+    ]
+    return await asyncio.gather(
+        *(
+            _pdf_text(pool, path, future)
+            if kind == "pdf"
+            else _result(
+                future, "", lambda seconds, path=path: record_page(os.path.basename(path), -1, "image", seconds)
+            )
+            for path, kind, future in zip(file_paths, kinds, first_pass)
+        )
+    )
 
 
 def extract_text(file_path: str) -> Tuple[str, str]:
-    lower = file_path.lower()
-    if lower.endswith(".pdf"):
-        return extract_text_from_pdf(file_path), "pdf"
-    return extract_text_from_image(file_path), "image"
+    # Sync only, like extract_texts
+    _require_no_loop("extract_text")
+    return extract_texts([file_path])[0]
@@ -0,0 +1,107 @@
+import base64
+import os
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import Select, and_, exists, func, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from alerts import RULE_MESSAGES
+from models import Person, PersonAlert, Project
+
+PAGE_SIZE = int(os.getenv("PAGE_SIZE", "50"))
+
+
+def encode_cursor(created_at: Optional[datetime], row_id: int) -> str:
+    value = f"{created_at.isoformat() if created_at else ''}|{row_id}"
+    return base64.urlsafe_b64encode(value.encode()).decode()
+
+
+def decode_cursor(cursor: Optional[str]) -> Optional[Tuple[datetime, int]]:
+    if not cursor:
+        return None
+    try:
+        created_at, row_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(created_at), int(row_id)
+    except ValueError:
+        return None
+
+
+async def _keyset(db: AsyncSession, query: Select, created_column, id_column, cursor: Optional[str], limit: int):
+    # Newest first; the cursor is the (created_at, id) of the last row of the previous page
+    position = decode_cursor(cursor)
+    if position:
+        created_at, row_id = position
+        query = query.where(
+            or_(created_column < created_at, and_(created_column == created_at, id_column < row_id))
+        )
+    rows = (await db.execute(query.order_by(created_column.desc(), id_column.desc()).limit(limit + 1))).all()
+    next_cursor = encode_cursor(rows[limit - 1].created_at, rows[limit - 1].id) if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
+
+def alert_filter(rule: Optional[str] = None):
+    # Persons with at least one stored alert, or one of the given rule
+    condition = exists().where(PersonAlert.person_id == Person.id)
+    return condition.where(PersonAlert.rule == rule) if rule else condition
+
+
+async def person_page(
+    db: AsyncSession,
+    project_id: int,
+    cursor: Optional[str] = None,
+    limit: int = PAGE_SIZE,
+    only_alerts: bool = False,
+    rule: Optional[str] = None,
+):
+    # Only the columns the list shows, no ORM hydration; the alert count is an index lookup per row
+    alerts = select(func.count(PersonAlert.id)).where(PersonAlert.person_id == Person.id).scalar_subquery()
+    query = select(
+        Person.id, Person.nome, Person.cognome, Person.codice_fiscale, Person.created_at, alerts.label("alerts")
+    ).where(Person.project_id == project_id)
+    if only_alerts or rule:
+        query = query.where(alert_filter(rule))
+    return await _keyset(db, query, Person.created_at, Person.id, cursor, limit)
+
+
+async def project_page(db: AsyncSession, cursor: Optional[str] = None, limit: int = PAGE_SIZE):
+    query = select(Project.id, Project.name, Project.created_at)
+    return await _keyset(db, query, Project.created_at, Project.id, cursor, limit)
+
+
+async def project_counts(db: AsyncSession, project_ids: Sequence[int]) -> Dict[int, Dict[str, int]]:
+    # Persons and persons with at least one stored alert, for every project in two GROUP BYs
+    if not project_ids:
+        return {}
+    persons = await db.execute(
+        select(Person.project_id, func.count(Person.id))
+        .where(Person.project_id.in_(project_ids))
+        .group_by(Person.project_id)
+    )
+    with_alerts = dict(
+        (
+            await db.execute(
+                select(PersonAlert.project_id, func.count(func.distinct(PersonAlert.person_id)))
+                .where(PersonAlert.project_id.in_(project_ids))
+                .group_by(PersonAlert.project_id)
+            )
+        ).all()
+    )
+    counts = {project_id: {"persons": 0, "with_alerts": 0} for project_id in project_ids}
+    for project_id, count in persons.all():
+        counts[project_id] = {"persons": count, "with_alerts": with_alerts.get(project_id, 0)}
+    return counts
+
+
+async def rule_counts(db: AsyncSession, project_id: int) -> List[Tuple[str, str, int]]:
+    # (rule, message, persons) for the rules with at least one alert in the project, in RULES order
+    rows = dict(
+        (
+            await db.execute(
+                select(PersonAlert.rule, func.count(PersonAlert.id))
+                .where(PersonAlert.project_id == project_id)
+                .group_by(PersonAlert.rule)
+            )
+        ).all()
+    )
+    return [(rule, message, rows[rule]) for rule, message in RULE_MESSAGES.items() if rule in rows]
@@ -0,0 +1,346 @@
+import os
+import re
+import sys
+import unicodedata
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+from sqlalchemy import case, event, func, literal, or_, select, text
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.orm import Session
+
+from models import Person, PersonDocument, Project
+
+# Inverted index over persons and the OCR text of their documents:
+#   SQLite      FTS5 virtual table person_search, rowid = persons.id
+#   PostgreSQL  person_search table with a weighted tsvector and a GIN index
+# Rows are refreshed from the session's after_flush, inside the transaction that writes the Person.
+
+SEARCH_LIMIT = 50
+# Broad queries (a word found in most CVs) are ranked among their newest SEARCH_CANDIDATES matches only
+SEARCH_CANDIDATES = int(os.getenv("SEARCH_CANDIDATES", "1000"))
+CHUNK = 500
+
+# Form/inline field name -> FTS5 columns and tsvector weights (A nome/cognome, B CF, C titolo, D testo)
+FIELDS = {
+    "nome": ("{nome cognome}", "A"),
+    "codice_fiscale": ("codice_fiscale", "B"),
+    "titolo": ("titolo", "C"),
+    "testo": ("documenti", "D"),
+}
+FIELD_ALIASES = {
+    "nome": "nome",
+    "cognome": "nome",
+    "cf": "codice_fiscale",
+    "codice_fiscale": "codice_fiscale",
+    "titolo": "titolo",
+    "testo": "testo",
+}
+
+FIELD_WEIGHTS = {"nome": 10, "codice_fiscale": 8, "titolo": 4, "testo": 1}
+
+# Free-text terms look at every column but the project one
+TEXT_COLUMNS = "{nome cognome codice_fiscale titolo documenti}"
+SNIPPET_WORDS = 12
+
+# The project is an indexed column rather than UNINDEXED: filtering on it then stays inside the
+# index instead of reading every matching row, OCR text included, back from the content table
+SQLITE_SCHEMA = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS person_search USING fts5("
+    "nome, cognome, codice_fiscale, titolo, documenti, progetto, "
+    "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3 4')"
+]
+POSTGRES_SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS person_search ("
+    "person_id INTEGER PRIMARY KEY REFERENCES persons(id) ON DELETE CASCADE, "
+    "project_id INTEGER NOT NULL, document TSVECTOR NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS ix_person_search_document ON person_search USING GIN (document)",
+    "CREATE INDEX IF NOT EXISTS ix_person_search_project ON person_search (project_id)",
+]
+
+
+class SearchResult(NamedTuple):
+    id: int
+    project_id: int
+    project_name: str
+    nome: str
+    cognome: str
+    codice_fiscale: str
+    titolo: str
+    # [(text, matched)] around the first hit in the documents, see make_snippet
+    snippet: List[Tuple[str, bool]]
+
+
+def _is_postgres(bind) -> bool:
+    return bind.dialect.name == "postgresql"
+
+
+def ensure_schema(engine: Engine) -> None:
+    postgres = _is_postgres(engine)
+    with engine.begin() as connection:
+        for statement in POSTGRES_SCHEMA if postgres else SQLITE_SCHEMA:
+            connection.execute(text(statement))
+        indexed = connection.execute(text("SELECT 1 FROM person_search LIMIT 1")).first()
+        existing = connection.execute(select(Person.id).limit(1)).first()
+    # First start on a database that already has persons: index them once
+    if existing and not indexed:
+        rebuild_index(engine)
+
+
+def _chunks(ids: List[int]) -> Iterable[List[int]]:
+    for start in range(0, len(ids), CHUNK):
+        yield ids[start:start + CHUNK]
+
+
+def _rows(connection: Connection, person_ids: List[int]) -> List[Dict]:
+    rows = {
+        row.id: {
+            "id": row.id,
+            "project_id": row.project_id,
+            "nome": row.nome or "",
+            "cognome": row.cognome or "",
+            "codice_fiscale": row.codice_fiscale or "",
+            "titolo": row.titolo_studio_piu_recente or "",
+            "documenti": [],
+        }
+        for row in connection.execute(
+            select(
+                Person.id,
+                Person.project_id,
+                Person.nome,
+                Person.cognome,
+                Person.codice_fiscale,
+                Person.titolo_studio_piu_recente,
+            ).where(Person.id.in_(person_ids))
+        )
+    }
+    documents = connection.execute(
+        select(PersonDocument.person_id, PersonDocument.extracted_text)
+        .where(PersonDocument.person_id.in_(person_ids))
+        .order_by(PersonDocument.person_id, PersonDocument.kind)
+    )
+    for person_id, extracted_text in documents:
+        if extracted_text and person_id in rows:
+            rows[person_id]["documenti"].append(extracted_text)
+    for row in rows.values():
+        row["documenti"] = "\n".join(row["documenti"])
+    return list(rows.values())
+
+
+def remove_persons(connection: Connection, person_ids: Iterable[int]) -> None:
+    column = "person_id" if _is_postgres(connection) else "rowid"
+    for chunk in _chunks(sorted(person_ids)):
+        connection.execute(text(f"DELETE FROM person_search WHERE {column} IN ({','.join(map(str, chunk))})"))
+
+
+def index_persons(connection: Connection, person_ids: Iterable[int]) -> None:
+    person_ids = sorted(set(person_ids))
+    for chunk in _chunks(person_ids):
+        rows = _rows(connection, chunk)
+        if _is_postgres(connection):
+            if rows:
+                connection.execute(
+                    text(
+                        "INSERT INTO person_search (person_id, project_id, document) VALUES (:id, :project_id, "
+                        "setweight(to_tsvector('simple', :nome || ' ' || :cognome), 'A') || "
+                        "setweight(to_tsvector('simple', :codice_fiscale), 'B') || "
+                        "setweight(to_tsvector('simple', :titolo), 'C') || "
+                        "setweight(to_tsvector('simple', :documenti), 'D')) "
+                        "ON CONFLICT (person_id) DO UPDATE SET project_id = EXCLUDED.project_id, "
+                        "document = EXCLUDED.document"
+                    ),
+                    rows,
+                )
+            continue
+        # FTS5 has no upsert: replace the rows
+        remove_persons(connection, chunk)
+        if rows:
+            connection.execute(
+                text(
+                    "INSERT INTO person_search (rowid, nome, cognome, codice_fiscale, titolo, documenti, progetto) "
+                    "VALUES (:id, :nome, :cognome, :codice_fiscale, :titolo, :documenti, CAST(:project_id AS TEXT))"
+                ),
+                rows,
+            )
+
+
+def rebuild_index(engine: Engine) -> int:
+    with engine.begin() as connection:
+        connection.execute(text("DELETE FROM person_search"))
+        person_ids = [row.id for row in connection.execute(select(Person.id))]
+        index_persons(connection, person_ids)
+    return len(person_ids)
+
+
+@event.listens_for(Session, "after_flush")
+def _refresh_index(session: Session, flush_context) -> None:
+    touched: Set[int] = set()
+    deleted: Set[int] = set()
+    for instance in list(session.new) + list(session.dirty):
+        if isinstance(instance, Person):
+            touched.add(instance.id)
+        elif isinstance(instance, PersonDocument) and instance.person_id:
+            touched.add(instance.person_id)
+    for instance in session.deleted:
+        if isinstance(instance, Person):
+            deleted.add(instance.id)
+        elif isinstance(instance, PersonDocument) and instance.person_id:
+            touched.add(instance.person_id)
+    if not touched and not deleted:
+        return
+    connection = session.connection()
+    if deleted:
+        remove_persons(connection, deleted)
+    if touched - deleted:
+        index_persons(connection, touched - deleted)
+
+
+def parse_query(query: str, field: Optional[str] = None) -> List[Tuple[Optional[str], str]]:
+    # "mario cf:RSSMRA titolo:laurea" -> [(None, "mario"), ("codice_fiscale", "rssmra"), ("titolo", "laurea")]
+    terms = []
+    default = field if field in FIELDS else None
+    for part in query.split():
+        name, _, value = part.partition(":")
+        target = default
+        if value and name.lower() in FIELD_ALIASES:
+            target, part = FIELD_ALIASES[name.lower()], value
+        for word in re.findall(r"\w+", part.lower()):
+            terms.append((target, word))
+    return terms
+
+
+def fts5_query(terms: List[Tuple[Optional[str], str]], project_id: Optional[int] = None) -> str:
+    # Every term is a quoted prefix query, so FTS5 operators typed by the user are taken literally
+    parts = []
+    for field, word in terms:
+        phrase = f'"{word}"*'
+        parts.append(f"{FIELDS[field][0] if field else TEXT_COLUMNS} : {phrase}")
+    if project_id:
+        parts.append(f'progetto : "{int(project_id)}"')
+    return " AND ".join(parts)
+
+
+def tsquery(terms: List[Tuple[Optional[str], str]]) -> str:
+    return " & ".join(f"{word}:*{FIELDS[field][1] if field else ''}" for field, word in terms)
+
+
+def _fold(word: str) -> str:
+    # Same normalisation as the unicode61 tokenizer with remove_diacritics
+    if word.isascii():
+        return word.lower()
+    return "".join(char for char in unicodedata.normalize("NFKD", word.lower()) if not unicodedata.combining(char))
+
+
+def _starts_word(column, word: str):
+    # Prefix of the value or of any word after a space; "_" is the one \w character LIKE treats specially
+    pattern = word.replace("_", "\\_")
+    value = func.lower(func.coalesce(column, ""))
+    return or_(value.like(f"{pattern}%", escape="\\"), value.like(f"% {pattern}%", escape="\\"))
+
+
+def score(terms: List[Tuple[Optional[str], str]]):
+    # Every candidate matched every term somewhere; weigh where: a hit on the name outranks the CV body
+    total = literal(0)
+    for field, word in terms:
+        if field:
+            total = total + FIELD_WEIGHTS[field]
+            continue
+        total = total + case(
+            (or_(_starts_word(Person.nome, word), _starts_word(Person.cognome, word)), FIELD_WEIGHTS["nome"]),
+            (_starts_word(Person.codice_fiscale, word), FIELD_WEIGHTS["codice_fiscale"]),
+            (_starts_word(Person.titolo_studio_piu_recente, word), FIELD_WEIGHTS["titolo"]),
+            else_=FIELD_WEIGHTS["testo"],
+        )
+    return total
+
+
+def make_snippet(document: str, words: List[str], size: int = SNIPPET_WORDS) -> List[Tuple[str, bool]]:
+    # A window of `size` words around the first word starting with one of the searched terms
+    tokens = list(re.finditer(r"\w+", document or ""))
+    prefixes = tuple(_fold(word) for word in words)
+    first = next((index for index, token in enumerate(tokens) if _fold(token.group()).startswith(prefixes)), None)
+    if first is None or not prefixes:
+        return []
+    start = max(0, first - size // 2)
+    end = min(len(tokens), start + size)
+    parts = [("… ", False)] if start else []
+    for index in range(start, end):
+        token = tokens[index]
+        parts.append((token.group(), _fold(token.group()).startswith(prefixes)))
+        if index + 1 < end:
+            parts.append((re.sub(r"\s+", " ", document[token.end():tokens[index + 1].start()]), False))
+    if end < len(tokens):
+        parts.append((" …", False))
+    return parts
+
+
+def _snippets(db: Session, person_ids: List[int], words: List[str]) -> Dict[int, List[Tuple[str, bool]]]:
+    # Built from the stored OCR text of the returned page only, never for every candidate
+    if not person_ids or not words:
+        return {}
+    documents: Dict[int, List[str]] = {}
+    rows = (
+        db.query(PersonDocument.person_id, PersonDocument.extracted_text)
+        .filter(PersonDocument.person_id.in_(person_ids))
+        .order_by(PersonDocument.kind)
+    )
+    for person_id, extracted_text in rows:
+        if extracted_text:
+            documents.setdefault(person_id, []).append(extracted_text)
+    return {person_id: make_snippet("\n".join(texts), words) for person_id, texts in documents.items()}
+
+
+def search_persons(
+    db: Session,
+    query: str,
+    field: Optional[str] = None,
+    project_id: Optional[int] = None,
+    limit: int = SEARCH_LIMIT,
+) -> List[SearchResult]:
+    terms = parse_query(query, field)
+    if not terms:
+        return []
+    # The index only finds the newest SEARCH_CANDIDATES matches, walking its posting lists by id;
+    # scoring every match (bm25/ts_rank) costs a full pass over the posting lists of common words
+    if _is_postgres(db.get_bind()):
+        # :project_id is only bound when the filter is in the SQL: binding an absent parameter fails
+        params = {"query": tsquery(terms), "candidates": SEARCH_CANDIDATES}
+        project_filter = ""
+        if project_id:
+            project_filter = "AND project_id = :project_id"
+            params["project_id"] = project_id
+        candidates = text(
+            f"SELECT person_id FROM person_search WHERE document @@ to_tsquery('simple', :query) {project_filter} "
+            "ORDER BY person_id DESC LIMIT :candidates"
+        ).bindparams(**params)
+    else:
+        candidates = text(
+            "SELECT rowid FROM person_search WHERE person_search MATCH :query ORDER BY rowid DESC LIMIT :candidates"
+        ).bindparams(query=fts5_query(terms, project_id), candidates=SEARCH_CANDIDATES)
+    relevance = score(terms)
+    persons = (
+        db.query(
+            Person.id,
+            Person.project_id,
+            Project.name,
+            Person.nome,
+            Person.cognome,
+            Person.codice_fiscale,
+            Person.titolo_studio_piu_recente,
+        )
+        .join(Project, Project.id == Person.project_id)
+        .filter(Person.id.in_(candidates))
+        .order_by(relevance.desc(), Person.id.desc())
+        .limit(limit)
+        .all()
+    )
+    snippets = _snippets(db, [row.id for row in persons], [word for field, word in terms if field in (None, "testo")])
+    return [SearchResult(*row, snippets.get(row.id, [])) for row in persons]
+
+
+if __name__ == "__main__":
+    # python search.py rebuild
+    if sys.argv[1:] == ["rebuild"]:
+        from database import engine
+
+        ensure_schema(engine)
+        print("indexed", rebuild_index(engine), "persons")
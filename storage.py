@@ -0,0 +1,217 @@
+import asyncio
+import hashlib
+import os
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import BinaryIO, Iterable, List, NamedTuple, Optional, Set
+
+from fastapi import UploadFile
+from sqlalchemy import event, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from metrics import timed
+from models import Blob, Job, PersonDocument
+
+UPLOAD_DIR = Path(os.getenv("UPLOAD_DIR", "uploads"))
+BLOB_DIR = UPLOAD_DIR / "blobs"
+TMP_DIR = UPLOAD_DIR / "tmp"
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(25 * 1024 * 1024)))
+BLOB_GC_GRACE_HOURS = float(os.getenv("BLOB_GC_GRACE_HOURS", "24"))
+CHUNK_SIZE = 1024 * 1024
+
+# (magic prefix, offset, MIME type, extension kept on the blob so OCR can tell PDFs from images)
+SIGNATURES = [
+    (b"%PDF-", 0, "application/pdf", ".pdf"),
+    (b"\x89PNG\r\n\x1a\n", 0, "image/png", ".png"),
+    (b"\xff\xd8\xff", 0, "image/jpeg", ".jpg"),
+    (b"II*\x00", 0, "image/tiff", ".tif"),
+    (b"MM\x00*", 0, "image/tiff", ".tif"),
+    (b"GIF87a", 0, "image/gif", ".gif"),
+    (b"GIF89a", 0, "image/gif", ".gif"),
+    (b"BM", 0, "image/bmp", ".bmp"),
+    (b"WEBP", 8, "image/webp", ".webp"),
+]
+EXTENSIONS = {mime: extension for _, _, mime, extension in SIGNATURES}
+
+
+class UploadRejected(ValueError):
+    pass
+
+
+class StoredFile(NamedTuple):
+    sha256: str
+    path: Path
+    mime: str
+    size: int
+    filename: str
+
+
+def sniff(head: bytes) -> Optional[str]:
+    for magic, offset, mime, _ in SIGNATURES:
+        if head[offset:offset + len(magic)] == magic:
+            return mime
+    return None
+
+
+def blob_path(sha256: str, mime: str) -> Path:
+    # Two levels of sharding keep directories small: blobs/ab/cd/abcd...
+    return BLOB_DIR / sha256[:2] / sha256[2:4] / f"{sha256}{EXTENSIONS[mime]}"
+
+
+class BlobWriter:
+    # Hashes, size-checks and sniffs the content as it is written, chunk by chunk, to a temp file
+
+    def __init__(self, filename: str, max_bytes: int = MAX_UPLOAD_BYTES):
+        self.filename = filename
+        self.max_bytes = max_bytes
+        self.digest = hashlib.sha256()
+        self.size = 0
+        self.mime: Optional[str] = None
+        TMP_DIR.mkdir(parents=True, exist_ok=True)
+        self.tmp_path = TMP_DIR / uuid.uuid4().hex
+        self.handle = self.tmp_path.open("wb")
+
+    def write(self, chunk: bytes) -> None:
+        if self.mime is None:
+            self.mime = sniff(chunk)
+            if self.mime is None:
+                raise UploadRejected(f"{self.filename}: formato non supportato (sono ammessi PDF e immagini)")
+        self.size += len(chunk)
+        if self.size > self.max_bytes:
+            raise UploadRejected(f"{self.filename}: supera la dimensione massima di {self.max_bytes // (1024 * 1024)} MB")
+        self.digest.update(chunk)
+        self.handle.write(chunk)
+
+    def commit(self) -> StoredFile:
+        self.handle.close()
+        if self.mime is None:
+            self.abort()
+            raise UploadRejected(f"{self.filename}: file vuoto")
+        sha256 = self.digest.hexdigest()
+        path = blob_path(sha256, self.mime)
+        if path.exists():
+            # Same bytes already stored: keep the existing blob, marked fresh so that the sweep
+            # of files without a row (see collect_garbage) leaves it alone until the job registers it
+            self.tmp_path.unlink()
+            os.utime(path)
+        else:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(self.tmp_path, path)
+        return StoredFile(sha256, path, self.mime, self.size, self.filename)
+
+    def abort(self) -> None:
+        self.handle.close()
+        self.tmp_path.unlink(missing_ok=True)
+
+
+async def store_upload(file: UploadFile) -> StoredFile:
+    writer = BlobWriter(file.filename or "")
+    try:
+        with timed("upload"):
+            while chunk := await file.read(CHUNK_SIZE):
+                await asyncio.to_thread(writer.write, chunk)
+            return await asyncio.to_thread(writer.commit)
+    except BaseException:
+        writer.abort()
+        raise
+
+
+def store_stream(source: BinaryIO, filename: str) -> StoredFile:
+    writer = BlobWriter(filename)
+    try:
+        with timed("upload"):
+            while chunk := source.read(CHUNK_SIZE):
+                writer.write(chunk)
+            return writer.commit()
+    except BaseException:
+        writer.abort()
+        raise
+
+
+def register_blobs(db: Session, stored: Iterable[StoredFile]) -> None:
+    for item in stored:
+        if db.get(Blob, item.sha256) is not None:
+            continue
+        try:
+            with db.begin_nested():
+                db.add(Blob(sha256=item.sha256, size=item.size, mime=item.mime, refcount=0))
+        except IntegrityError:
+            # The same content was registered concurrently by another upload
+            pass
+
+
+def link_documents(db: Session, person_id: int, documents: dict, texts: Optional[dict] = None) -> None:
+    # documents: {kind: {"sha256": ..., "filename": ...}}, texts: {kind: OCR text}
+    for kind, document in documents.items():
+        db.add(
+            PersonDocument(
+                person_id=person_id,
+                kind=kind,
+                blob_sha256=document["sha256"],
+                filename=document["filename"],
+                extracted_text=(texts or {}).get(kind),
+            )
+        )
+        db.execute(
+            update(Blob).where(Blob.sha256 == document["sha256"]).values(refcount=Blob.refcount + 1)
+        )
+
+
+@event.listens_for(PersonDocument, "after_delete")
+def _release_blob(mapper, connection, document: PersonDocument) -> None:
+    # Covers explicit deletes as well as the cascade when a Person is removed
+    connection.execute(
+        update(Blob).where(Blob.sha256 == document.blob_sha256).values(refcount=Blob.refcount - 1)
+    )
+
+
+def _referenced_by_jobs(db: Session) -> Set[str]:
+    hashes: Set[str] = set()
+    for (documents,) in db.query(Job.documents).filter(Job.status.in_(["pending", "running", "failed"])):
+        hashes.update(document["sha256"] for document in (documents or {}).values())
+    return hashes
+
+
+def _sweep_unregistered(db: Session, grace_hours: float) -> List[str]:
+    # Files stored but never registered: an upload whose other files were rejected, a failed
+    # request, an interrupted write. Only older than the grace period, so in-flight uploads stay
+    removed = []
+    limit = time.time() - grace_hours * 3600
+    for path in TMP_DIR.glob("*"):
+        if path.is_file() and path.stat().st_mtime < limit:
+            path.unlink(missing_ok=True)
+    for path in BLOB_DIR.glob("*/*/*"):
+        if not path.is_file() or path.stat().st_mtime >= limit:
+            continue
+        if db.get(Blob, path.stem) is None:
+            path.unlink(missing_ok=True)
+            removed.append(path.stem)
+    return removed
+
+
+def collect_garbage(db: Session, grace_hours: float = BLOB_GC_GRACE_HOURS) -> List[str]:
+    # Blobs nobody links to any more; the grace period covers uploads whose job has not persisted yet
+    cutoff = datetime.utcnow() - timedelta(hours=grace_hours)
+    in_use = _referenced_by_jobs(db)
+    removed = []
+    for blob in db.query(Blob).filter(Blob.refcount <= 0, Blob.created_at < cutoff).all():
+        if blob.sha256 in in_use:
+            continue
+        blob_path(blob.sha256, blob.mime).unlink(missing_ok=True)
+        db.delete(blob)
+        removed.append(blob.sha256)
+    db.commit()
+    return removed + _sweep_unregistered(db, grace_hours)
+
+
+if __name__ == "__main__":
+    # python storage.py gc
+    if sys.argv[1:] == ["gc"]:
+        from database import SessionLocal
+
+        with SessionLocal() as session:
+            print("removed", len(collect_garbage(session)), "blobs")
@@ -0,0 +1,81 @@
+import asyncio
+import sys
+from pathlib import Path
+
+import httpx
+import pytest
+from openai import AsyncOpenAI
+
+import ai_extraction
+
+sys.path.insert(0, str(Path(__file__).resolve().parent / "benchmarks"))
+
+import stub_llm  # noqa: E402
+
+CV_TEXT = "Curriculum vitae di Mario Rossi, via Roma 1"
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    # The stub Responses endpoint served in process; no backoff between the retries
+    monkeypatch.setattr(ai_extraction, "OPENAI_BACKOFF", 0)
+    monkeypatch.setattr(stub_llm, "STUB_LLM_MODE", "fixed")
+    stub_llm.app.state.calls = 0
+    return stub_llm
+
+
+def _client() -> AsyncOpenAI:
+    transport = httpx.ASGITransport(app=stub_llm.app)
+    return AsyncOpenAI(
+        api_key="stub", base_url="http://stub/v1", max_retries=0, http_client=httpx.AsyncClient(transport=transport)
+    )
+
+
+def _request(part: str, testo: str, fields):
+    async def run():
+        client = _client()
+        try:
+            return await ai_extraction._request(client, "stub", part, testo, fields)
+        finally:
+            await client.close()
+
+    return asyncio.run(run())
+
+
+def test_retryable_error_is_retried(stub, monkeypatch):
+    # The first call gets a 500, the retry the answer
+    monkeypatch.setattr(stub, "STUB_LLM_FAIL_EVERY", 2)
+    stub.app.state.calls = 1
+    data = _request("tessera_sanitaria", "RSSMRA80A01H501U", ["codice_fiscale"])
+    assert data == {"codice_fiscale": "RSSMRA80A01H501U"}
+    assert stub.app.state.calls == 3
+
+
+def test_retries_are_bounded(stub, monkeypatch):
+    monkeypatch.setattr(stub, "STUB_LLM_FAIL_EVERY", 1)
+    with pytest.raises(ai_extraction.InternalServerError):
+        _request("tessera_sanitaria", "RSSMRA80A01H501U", ["codice_fiscale"])
+    assert stub.app.state.calls == ai_extraction.OPENAI_MAX_RETRIES + 1
+
+
+def test_incomplete_answer_fails(stub, monkeypatch):
+    monkeypatch.setattr(stub, "STUB_LLM_INCOMPLETE_EVERY", 1)
+    with pytest.raises(ai_extraction.ExtractionFailed, match="incompleta"):
+        _request("cv", CV_TEXT, ["nome", "cognome"])
+
+
+def test_extract_part_is_memoised(stub, monkeypatch):
+    async def run():
+        client = _client()
+        monkeypatch.setattr(ai_extraction, "get_client", lambda: client)
+        try:
+            first = await ai_extraction.extract_part("cv", CV_TEXT)
+            second = await ai_extraction.extract_part("cv", CV_TEXT)
+        finally:
+            await client.close()
+        return first, second
+
+    (first, _), (second, _) = asyncio.run(run())
+    assert first == second
+    assert first["nome"] == "Mario" and first["titolo_studio_piu_recente"]["titolo"] == "Laurea in Economia"
+    assert stub.app.state.calls == 1
@@ -0,0 +1,61 @@
+from datetime import date
+
+import pytest
+from sqlalchemy import select
+
+from alerts import build_alerts, evaluate_persons
+
+TODAY = date(2024, 6, 1)
+COMPLETE = {
+    "nome": "Mario",
+    "cognome": "Rossi",
+    "codice_fiscale": "RSSMRA80A01H501U",
+    "indirizzo_domicilio": "Via Roma 1, Roma",
+    "indirizzo_residenza": "Via Roma 1, Roma",
+    "data_scadenza": "2030-01-01",
+    "titolo_studio_piu_recente": {"titolo": "Laurea in Economia", "data_conseguimento": "2004-07-15"},
+    "situazione_occupazionale": "Disoccupato",
+    "privacy_clause_present": True,
+    "firma_presente": True,
+    "data_cv": "2024-02-01",
+}
+CASES = {
+    "complete": {},
+    "no_addresses": {"indirizzo_domicilio": "", "indirizzo_residenza": ""},
+    "no_privacy_no_signature": {"privacy_clause_present": False, "firma_presente": False},
+    "no_names": {"nome": "", "cognome": ""},
+    "no_titolo": {"titolo_studio_piu_recente": {"titolo": "", "data_conseguimento": ""}},
+    "no_situazione": {"situazione_occupazionale": ""},
+    "no_data_cv": {"data_cv": ""},
+    "cv_old": {"data_cv": "2023-05-31"},
+    "cv_just_in_time": {"data_cv": "2023-06-02"},
+    "expired": {"data_scadenza": "2024-05-31"},
+    "expires_today": {"data_scadenza": "2024-06-01"},
+    "unparsable_dates": {"data_scadenza": "31/05/2024", "data_cv": "maggio 2020"},
+    "cf_other_person": {"codice_fiscale": "BNCGFR80A01H501X"},
+    "cf_lowercase": {"codice_fiscale": "rssmra80a01h501u"},
+    "cf_truncated": {"codice_fiscale": "BNCGFR80A01"},
+    "cf_without_name": {"nome": "", "codice_fiscale": "BNCGFR80A01H501X"},
+}
+
+
+@pytest.mark.parametrize("case", CASES)
+def test_sql_rules_match_build_alerts(project, case):
+    # Every rule is written twice; both must flag the same persons
+    from database import SessionLocal
+    from jobs import person_from_data
+    from models import PersonAlert
+
+    data = {**COMPLETE, **CASES[case]}
+    with SessionLocal() as db:
+        person = person_from_data(project, data)
+        db.add(person)
+        db.flush()
+        evaluate_persons(db, [person.id], today=TODAY)
+        db.commit()
+        stored = db.scalars(select(PersonAlert.message).where(PersonAlert.person_id == person.id)).all()
+    assert sorted(stored) == sorted(build_alerts(data, today=TODAY))
+
+
+def test_complete_data_has_no_alerts():
+    assert build_alerts(COMPLETE, today=TODAY) == []
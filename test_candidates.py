@@ -0,0 +1,65 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import event
+
+from candidates import merge_duplicates
+
+START = datetime(2024, 1, 1)
+
+
+def _enrol(db, project_id, codice_fiscale, minutes, **values):
+    from models import Person
+
+    values = {"nome": "Mario", "cognome": "Rossi", **values}
+    person = Person(
+        project_id=project_id, codice_fiscale=codice_fiscale, created_at=START + timedelta(minutes=minutes), **values
+    )
+    db.add(person)
+    db.flush()
+    return person.id
+
+
+def test_merge_duplicates(project):
+    from database import SessionLocal, engine
+    from models import Candidate, Person, Project
+
+    with SessionLocal() as db:
+        other = Project(name=f"Altro {project}")
+        db.add(other)
+        db.flush()
+        # Enrolled twice in the project, once more elsewhere; the codice fiscale is written
+        # differently each time
+        older = _enrol(db, project, "bncgfr80a01h501q", 0, nome="Gianfranco")
+        kept = _enrol(db, project, " BNCGFR80A01H501Q", 1, nome="Gianfranco", numero_documento="CA0000001")
+        elsewhere = _enrol(db, other.id, "BNCGFR80A01H501Q", 2, nome="Gianfranco")
+        single = _enrol(db, project, "VRDLGU75C10F205C", 3, nome="Luigi")
+        invalid = _enrol(db, project, "VRDLGU75C10F205X", 4)
+        db.commit()
+
+    loaded = []
+
+    def capture(connection, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().startswith("SELECT persons.id AS persons_id, persons.project_id"):
+            loaded.append(statement)
+
+    event.listen(engine, "before_cursor_execute", capture)
+    try:
+        with SessionLocal() as db:
+            report = merge_duplicates(db)
+    finally:
+        event.remove(engine, "before_cursor_execute", capture)
+    assert report["folded"] >= 1 and report["linked"] >= 3
+
+    with SessionLocal() as db:
+        assert db.get(Person, older) is None
+        shared = db.query(Candidate).filter_by(codice_fiscale="BNCGFR80A01H501Q").one()
+        assert shared.numero_documento == "" and shared.nome == "Gianfranco"
+        assert db.get(Person, kept).candidate_id == db.get(Person, elsewhere).candidate_id == shared.id
+        assert db.get(Person, single).candidate.codice_fiscale == "VRDLGU75C10F205C"
+        assert db.get(Person, invalid).candidate_id is None
+    # Whole persons are loaded only for the codici fiscali shared by several enrolments
+    assert loaded and all("WHERE upper(trim(persons.codice_fiscale)) IN" in statement for statement in loaded)
+
+    # Run again, nothing is left to do
+    with SessionLocal() as db:
+        assert merge_duplicates(db)["folded"] == 0
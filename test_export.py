@@ -0,0 +1,65 @@
+from sqlalchemy import event
+
+from export import csv_stream, iter_persons
+
+
+def _person(db, project_id, **values):
+    from models import Person
+
+    person = Person(project_id=project_id, nome="Mario", cognome="Rossi", **values)
+    db.add(person)
+    db.flush()
+    return person
+
+
+def test_alerts_of_the_exported_persons_only(project):
+    from database import SessionLocal, engine
+    from models import PersonAlert, Project
+
+    with SessionLocal() as db:
+        other = Project(name=f"Altro {project}")
+        db.add(other)
+        db.flush()
+        # Interleaved ids: the other project's person sits inside the exported id range
+        first = _person(db, project)
+        stranger = _person(db, other.id)
+        last = _person(db, project)
+        for person in (first, stranger, last):
+            db.add(PersonAlert(person_id=person.id, project_id=person.project_id, rule="nome", message=f"a{person.id}"))
+        db.commit()
+        ids = first.id, last.id, stranger.id
+
+    # The parameters of the alerts query: the batch's person ids, not a range around them
+    alert_queries = []
+
+    def capture(connection, cursor, statement, parameters, context, executemany):
+        if "FROM person_alerts" in statement:
+            alert_queries.append(parameters)
+
+    event.listen(engine, "before_cursor_execute", capture)
+    try:
+        rows = [row for batch in iter_persons(project_ids=[project]) for row in batch]
+    finally:
+        event.remove(engine, "before_cursor_execute", capture)
+    assert [row[0] for row in rows] == list(ids[:2])
+    assert [row[-1] for row in rows] == [f"a{ids[0]}", f"a{ids[1]}"]
+    assert alert_queries and all(set(parameters) == set(ids[:2]) for parameters in alert_queries)
+
+
+def test_formulas_are_quoted(project):
+    from database import SessionLocal
+
+    with SessionLocal() as db:
+        _person(
+            db,
+            project,
+            indirizzo_domicilio='=HYPERLINK("http://x","y")',
+            indirizzo_residenza="-2+3",
+            ente_rilascio="@SUM(A1)",
+        )
+        db.commit()
+
+    rows = [row for batch in iter_persons(project_ids=[project]) for row in batch]
+    assert "'=HYPERLINK(\"http://x\",\"y\")" in rows[0]
+    assert "'-2+3" in rows[0] and "'@SUM(A1)" in rows[0]
+    assert b"'=HYPERLINK" in b"".join(csv_stream(iter([rows])))
@@ -0,0 +1,97 @@
+from datetime import date
+
+import pytest
+
+import fast_extract
+
+
+@pytest.mark.parametrize(
+    "cf, valid",
+    [
+        ("RSSMRA80A01H501U", True),
+        ("rssmra80a01h501u", True),
+        ("RSSMRA80A01H501A", False),
+        # Omocodia: the last digit of the place code written as a letter (1 -> M)
+        ("RSSMRA80A41H50MQ", True),
+        ("RSSMRA80Z01H501U", False),
+        ("RSSMRA80A01H501", False),
+    ],
+)
+def test_is_valid_codice_fiscale(cf, valid):
+    assert fast_extract.is_valid_codice_fiscale(cf) is valid
+
+
+def test_cf_check_char():
+    assert fast_extract.cf_check_char("RSSMRA80A01H501") == "U"
+
+
+def test_decode_male():
+    assert fast_extract.decode_codice_fiscale("RSSMRA80A01H501U", today=date(2024, 6, 1)) == {
+        "data_nascita": "1980-01-01",
+        "sesso": "M",
+        "codice_catastale": "H501",
+        "comune_nascita": "",
+        "provincia_nascita": "",
+    }
+
+
+def test_decode_female_omocodia():
+    decoded = fast_extract.decode_codice_fiscale("RSSMRA80A41H50MQ", today=date(2024, 6, 1))
+    assert (decoded["data_nascita"], decoded["sesso"], decoded["codice_catastale"]) == ("1980-01-01", "F", "H501")
+
+
+def test_decode_century():
+    # Two-digit years up to the current one are this century, later ones the previous
+    body = "RSSMRA05C15H501"
+    assert fast_extract.decode_codice_fiscale(body + "X", today=date(2024, 6, 1))["data_nascita"] == "2005-03-15"
+    assert fast_extract.decode_codice_fiscale(body + "X", today=date(2004, 6, 1))["data_nascita"] == "1905-03-15"
+
+
+def test_decode_impossible_date():
+    assert fast_extract.decode_codice_fiscale("RSSMRA80B31H501X")["data_nascita"] == ""
+
+
+def test_decode_birthplace_from_table(tmp_path, monkeypatch):
+    table = tmp_path / "comuni.csv"
+    table.write_text("H501;Roma;RM\nF205;MILANO;MI\n", encoding="utf-8")
+    monkeypatch.setattr(fast_extract, "COMUNI_CATASTALI_PATH", str(table))
+    fast_extract.comuni_catastali.cache_clear()
+    try:
+        decoded = fast_extract.decode_codice_fiscale("RSSMRA80A01H501U")
+        fields = fast_extract.extract("documento_identita", "C.F. RSSMRA80A01H501U")
+    finally:
+        fast_extract.comuni_catastali.cache_clear()
+    assert (decoded["comune_nascita"], decoded["provincia_nascita"]) == ("ROMA", "RM")
+    assert fields["comune_nascita"] == ("ROMA", 0.9)
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        "Codice fiscale: RSSMRA80A01H501U",
+        "TESSERA SANITARIA\nRSSMRA 80A01 H501U\nROSSI MARIO",
+        # A misread candidate with a bad check character comes first and is skipped
+        "RSSMRA80A01H5O1U RSSMRA80A01H501A RSSMRA80A01H501U",
+    ],
+)
+def test_find_codice_fiscale(text):
+    assert fast_extract.find_codice_fiscale(text) == "RSSMRA80A01H501U"
+
+
+def test_find_codice_fiscale_none():
+    assert fast_extract.find_codice_fiscale("RSSMRA80A01H501A") is None
+
+
+@pytest.mark.parametrize(
+    "nome, cognome, letters",
+    [
+        ("Mario", "Rossi", "RSSMRA"),
+        # More than three consonants in the given name: the second is skipped
+        ("Gianfranco", "Bianchi", "BNCGFR"),
+        # Accents dropped, short names padded with X
+        ("Noè", "Fo", "FOXNOE"),
+        ("", "Rossi", ""),
+    ],
+)
+def test_cf_name_letters(nome, cognome, letters):
+    assert fast_extract.cf_name_letters(nome, cognome) == letters
@@ -0,0 +1,101 @@
+from datetime import datetime
+
+import pytest
+from starlette.requests import Request
+
+from http_cache import _byte_range, file_response, not_modified
+
+ETAG = 'W/"abc"'
+LAST_MODIFIED = datetime(2024, 3, 5, 10, 0, 0, 500000)
+
+
+def request(**headers) -> Request:
+    raw = [(name.replace("_", "-").lower().encode(), value.encode()) for name, value in headers.items()]
+    return Request({"type": "http", "method": "GET", "path": "/", "query_string": b"", "headers": raw})
+
+
+@pytest.mark.parametrize(
+    "header, expected",
+    [
+        ("bytes=0-99", (0, 99)),
+        ("bytes=100-", (100, 999)),
+        ("bytes=-100", (900, 999)),
+        # Past the end: clamped to the last byte; a suffix longer than the file is all of it
+        ("bytes=900-5000", (900, 999)),
+        ("bytes=-5000", (0, 999)),
+        (" bytes = 10-20 ", (10, 20)),
+        # Unsatisfiable: 416
+        ("bytes=1000-", (1000, 1000)),
+        ("bytes=-0", (1000, 1000)),
+        # Not a single byte range: the whole file
+        ("bytes=0-1,5-9", None),
+        ("items=0-9", None),
+        ("bytes=20-10", None),
+        ("bytes=-", None),
+        ("bytes=a-b", None),
+        ("bytes=10", None),
+    ],
+)
+def test_byte_range(header, expected):
+    assert _byte_range(header, 1000) == expected
+
+
+def test_byte_range_empty_file():
+    assert _byte_range("bytes=0-", 0) == (0, 0)
+    assert _byte_range("bytes=-10", 0) == (0, 0)
+
+
+@pytest.mark.parametrize(
+    "headers, expected",
+    [
+        ({}, False),
+        ({"if_none_match": ETAG}, True),
+        # Weak comparison: the W/ prefix does not matter
+        ({"if_none_match": '"abc"'}, True),
+        ({"if_none_match": '"other", W/"abc"'}, True),
+        ({"if_none_match": "*"}, True),
+        ({"if_none_match": '"other"'}, False),
+        ({"if_modified_since": "Tue, 05 Mar 2024 10:00:00 GMT"}, True),
+        ({"if_modified_since": "Tue, 05 Mar 2024 09:59:59 GMT"}, False),
+        ({"if_modified_since": "yesterday"}, False),
+        # If-None-Match wins over If-Modified-Since
+        ({"if_none_match": '"other"', "if_modified_since": "Tue, 05 Mar 2024 10:00:00 GMT"}, False),
+    ],
+)
+def test_not_modified(headers, expected):
+    assert not_modified(request(**headers), ETAG, LAST_MODIFIED) is expected
+
+
+def test_not_modified_without_last_modified():
+    assert not_modified(request(if_modified_since="Tue, 05 Mar 2024 10:00:00 GMT"), ETAG) is False
+
+
+@pytest.fixture
+def document(tmp_path):
+    path = tmp_path / "cv.pdf"
+    path.write_bytes(bytes(range(256)) * 4)
+    return path
+
+
+def test_file_response_range(document):
+    response = file_response(request(range="bytes=10-19"), document, "application/pdf", "abc", "cv.pdf")
+    assert response.status_code == 206
+    assert response.headers["content-range"] == "bytes 10-19/1024"
+    assert response.headers["content-length"] == "10"
+
+
+def test_file_response_range_ignored_for_other_version(document):
+    headers = {"range": "bytes=10-19", "if_range": '"old"'}
+    response = file_response(request(**headers), document, "application/pdf", "abc", "cv.pdf")
+    assert response.status_code == 200
+
+
+def test_file_response_unsatisfiable(document):
+    response = file_response(request(range="bytes=2000-"), document, "application/pdf", "abc", "cv.pdf")
+    assert response.status_code == 416
+    assert response.headers["content-range"] == "bytes */1024"
+
+
+def test_file_response_not_modified(document):
+    response = file_response(request(if_none_match='"abc"'), document, "application/pdf", "abc", "cv.pdf")
+    assert response.status_code == 304
@@ -0,0 +1,90 @@
+from datetime import datetime
+from typing import Iterable, NamedTuple, Optional, Set, Union
+
+from sqlalchemy import Select, event, func, select
+from sqlalchemy.engine import Connection
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from models import Person, PersonAlert, PersonDocument, Project
+
+# Per-project data version for the conditional GETs and the page cache of main.py. It is bumped
+# in the same transaction that changes one of the project's persons, their documents or alerts:
+# by the listener below for ORM flushes, by the caller for bulk statements (see alerts._evaluate).
+
+
+class Validator(NamedTuple):
+    # What a page depends on, as a string, and when it last changed
+    tag: str
+    last_modified: Optional[datetime]
+
+
+def bump(connection: Connection, project_ids: Union[Iterable[int], Select]) -> None:
+    # project_ids: ids, or a SELECT of them
+    projects = Project.__table__
+    if not isinstance(project_ids, Select):
+        project_ids = list(project_ids)
+    connection.execute(
+        projects.update()
+        .where(projects.c.id.in_(project_ids))
+        .values(version=func.coalesce(projects.c.version, 0) + 1, updated_at=datetime.utcnow())
+    )
+
+
+@event.listens_for(Session, "after_flush")
+def _bump_changed(session: Session, flush_context) -> None:
+    project_ids: Set[int] = set()
+    person_ids: Set[int] = set()
+    for instance in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(instance, (Person, PersonAlert)):
+            project_ids.add(instance.project_id)
+        elif isinstance(instance, PersonDocument):
+            person_ids.add(instance.person_id)
+    connection = session.connection()
+    if project_ids:
+        bump(connection, project_ids)
+    if person_ids:
+        bump(connection, select(Person.project_id).where(Person.id.in_(person_ids)))
+
+
+def _latest(*values: Optional[datetime]) -> Optional[datetime]:
+    return max((value for value in values if value), default=None)
+
+
+async def projects_validator(db: AsyncSession) -> Validator:
+    # The project list changes with a new project or any project's version
+    count, created, versions, updated = (
+        await db.execute(
+            select(
+                func.count(Project.id),
+                func.max(Project.created_at),
+                func.coalesce(func.sum(Project.version), 0),
+                func.max(Project.updated_at),
+            )
+        )
+    ).one()
+    return Validator(f"projects:{count}:{versions}:{created}", _latest(created, updated))
+
+
+async def project_validator(db: AsyncSession, project_id: int) -> Optional[Validator]:
+    row = (
+        await db.execute(
+            select(Project.version, Project.created_at, Project.updated_at).where(Project.id == project_id)
+        )
+    ).first()
+    if row is None:
+        return None
+    return Validator(f"project:{project_id}:{row.version or 0}", _latest(row.created_at, row.updated_at))
+
+
+async def person_validator(db: AsyncSession, person_id: int) -> Optional[Validator]:
+    row = (
+        await db.execute(
+            select(Project.id, Project.version, Project.updated_at, Person.created_at)
+            .join(Person, Person.project_id == Project.id)
+            .where(Person.id == person_id)
+        )
+    ).first()
+    if row is None:
+        return None
+    return Validator(f"person:{person_id}:{row.id}:{row.version or 0}", _latest(row.created_at, row.updated_at))